@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+"""Benchmarks of bdist_pkg packaging phases on a synthetic install tree.
+
+Every phase is run `--repeat` times and the best time is reported along
+with the peak memory allocated by Python while it runs. Results are
+printed or written to `--output` as JSON, one document per run.
+
+Example::
+
+    python benchmarks/bench_packaging.py --files 20000 --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from setuptools import Distribution
+
+from setuptools_pkg.bdist_pkg import bdist_pkg
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+
+FORMATS = ('tar', 'tgz', 'tbz', 'txz', 'tzst')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000,
+                        help='Number of files in install tree.')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='Depth of directories tree.')
+    parser.add_argument('--fanout', type=int, default=4,
+                        help='Number of subdirectories per directory.')
+    parser.add_argument('--min-size', type=int, default=0,
+                        help='Minimal file size in bytes.')
+    parser.add_argument('--max-size', type=int, default=64 * 1024,
+                        help='Maximal file size in bytes. Sizes are'
+                             ' log-uniformly distributed between min and'
+                             ' max ones, so small files dominate.')
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help='Comma separated package formats to benchmark.')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='bdist_pkg jobs.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of each phase.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of install tree generator.')
+    parser.add_argument('--output',
+                        help='File to write results to. Default: stdout.')
+    return parser.parse_args(argv)
+
+
+def make_install_tree(root, prefix, args):
+    """Generates install tree of `args.files` files spread over directories
+    tree of `args.depth` levels. Content is made of random words, so it's
+    as compressible as the real one is."""
+    rnd = random.Random(args.seed)
+    words = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz_')
+                     for _ in range(rnd.randint(2, 12)))
+             for _ in range(2048)]
+    pool = ' '.join(rnd.choice(words)
+                    for _ in range(256 * 1024)).encode('ascii')
+    while len(pool) < args.max_size:
+        pool += pool
+
+    dirs = level_dirs = ['']
+    for _ in range(args.depth):
+        level_dirs = [os.path.join(parent, 'd{}'.format(idx))
+                      for parent in level_dirs for idx in range(args.fanout)]
+        dirs = dirs + level_dirs
+    base = os.path.join(root, prefix.lstrip('/'), 'lib', 'python',
+                        'site-packages', 'bench')
+    low = max(args.min_size, 1)
+    for idx in range(args.files):
+        dirpath = os.path.join(base, rnd.choice(dirs))
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        size = int(round(low * (float(args.max_size) / low) ** rnd.random()))
+        size = max(args.min_size, min(size, args.max_size))
+        offset = rnd.randint(0, len(pool) - size)
+        with open(os.path.join(dirpath, 'f{}.py'.format(idx)), 'wb') as fobj:
+            fobj.write(pool[offset:offset + size])
+
+
+def new_command(tmpdir, install_dir, jobs):
+    dist = Distribution({
+        'author': 'Benchmark',
+        'author_email': 'bench@example.com',
+        'description': 'benchmark',
+        'long_description': 'benchmark package',
+        'name': 'bench',
+        # Pure distribution gets the generic ABI on any system.
+        'py_modules': ['bench'],
+        'version': '1.0',
+    })
+    cmd = bdist_pkg(dist)
+    cmd.bdist_base = os.path.join(tmpdir, 'build')
+    cmd.dist_dir = os.path.join(tmpdir, 'dist')
+    cmd.jobs = jobs
+    cmd.no_digest_cache = True
+    cmd.finalize_options()
+    cmd.bdist_dir = os.path.join(tmpdir, 'bdist')
+    cmd.install_dir = install_dir
+    os.makedirs(cmd.bdist_dir)
+    os.makedirs(cmd.dist_dir)
+    return cmd
+
+
+def measure(func, repeat):
+    """Returns the best time of `repeat` calls of `func`, the peak memory
+    allocated by one more call and its result. Memory is traced separately
+    since tracing slows everything down a lot."""
+    best = None
+    for _ in range(repeat):
+        start = clock()
+        func()
+        elapsed = clock() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if tracemalloc is None:
+        return best, None, func()
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def run_benchmarks(cmd, args):
+    results = []
+
+    def record(phase, func, **extra):
+        seconds, peak, result = measure(func, args.repeat)
+        results.append(dict(extra, phase=phase, seconds=seconds,
+                            peak_memory=peak))
+        sys.stderr.write('{:<32} {:>10.4f}s\n'.format(
+            ' '.join([phase] + [str(v) for v in extra.values()]), seconds))
+        return result
+
+    def iter_install_files():
+        cmd.inventory = None
+        return list(cmd.iter_install_files())
+
+    def generate_manifest_content():
+        cmd.inventory = None
+        return cmd.generate_manifest_content()
+
+    record('iter_install_files', iter_install_files)
+    manifest = record('generate_manifest_content', generate_manifest_content)
+    record('make_manifests', lambda: cmd.make_manifests(manifest))
+
+    for format in args.formats.split(','):
+        cmd.format = format
+        compressor = None
+        if format != 'tar':
+            compressor = cmd.get_compressor(format)
+            if compressor is None:
+                sys.stderr.write('{} is not available, skipped\n'
+                                 ''.format(format))
+                continue
+        files_paths = [(cmd.make_manifest(manifest), '+MANIFEST')]
+        path = record('make_tar',
+                      lambda: cmd.make_tar(files_paths, format, compressor),
+                      format=format)
+        results[-1]['size'] = os.path.getsize(path)
+
+        def make_pkg():
+            with cmd.open_payload() as payload:
+                content = cmd.generate_manifest_content(payload)
+                return cmd.make_pkg(content, payload)
+
+        path = record('make_pkg', make_pkg, format=format)
+        results[-1]['size'] = os.path.getsize(path)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        install_dir = os.path.join(tmpdir, 'root')
+        make_install_tree(install_dir, '/usr/local', args)
+        cmd = new_command(tmpdir, install_dir, args.jobs)
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': vars(args),
+            'tree': {'files': len(cmd.get_inventory()),
+                     'flatsize': cmd.get_inventory().flatsize},
+            'results': run_benchmarks(cmd, args),
+        }
+    finally:
+        shutil.rmtree(tmpdir)
+    content = json.dumps(report, sort_keys=True, indent=4)
+    if args.output is None:
+        sys.stdout.write(content + '\n')
+    else:
+        with open(args.output, 'w') as fobj:
+            fobj.write(content + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -91,6 +91,8 @@ setup(
     entry_points={
         "distutils.commands": [
             "bdist_pkg = setuptools_pkg.bdist_pkg:bdist_pkg",
+            "pkg_repo = setuptools_pkg.pkg_repo:pkg_repo",
+            "pkg_wheelhouse = setuptools_pkg.wheelhouse:pkg_wheelhouse",
         ],
     },
     extras_require={
@@ -109,6 +111,9 @@ setup(
             'pip>=8.0.0',
             'wheel>=0.25.0',
         ],
+        'zstd': [
+            'zstandard>=0.15.0',
+        ],
     },
     command_options={
         'bdist_pkg': {
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import os
+import stat
+import tarfile
+
+try:
+    import grp
+    import pwd
+except ImportError:  # pragma: no cover
+    grp = pwd = None
+
+__all__ = (
+    'CHUNK_SIZE',
+    'HashingReader',
+    'TarStream',
+    'make_hardlink',
+    'make_tarinfo',
+    'normalize_tarinfo',
+)
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingReader(object):
+    """File-like wrapper which feeds everything read through it into
+    the given hasher."""
+
+    def __init__(self, fileobj, hasher):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hasher.update(data)
+        return data
+
+
+class TarStream(object):
+    """Write-only tar stream.
+
+    Unlike :class:`tarfile.TarFile` it frames members itself and never
+    seeks, so already framed members (a payload written by another
+    :class:`TarStream`) can be spliced into it verbatim.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def addfile(self, tarinfo, fileobj=None):
+        self.write(tarinfo.tobuf())
+        if fileobj is None or not tarinfo.isreg():
+            return
+        remaining = tarinfo.size
+        while remaining:
+            chunk = fileobj.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise IOError('unexpected end of data for {}'
+                              ''.format(tarinfo.name))
+            self.write(chunk)
+            remaining -= len(chunk)
+        self.pad(tarfile.BLOCKSIZE)
+
+    def splice(self, fileobj):
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.write(chunk)
+
+    def pad(self, size):
+        remainder = self.offset % size
+        if remainder:
+            self.write(tarfile.NUL * (size - remainder))
+
+    def close(self):
+        self.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        self.pad(tarfile.RECORDSIZE)
+
+
+def make_tarinfo(path, name, st=None):
+    st = os.lstat(path) if st is None else st
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.mode = stat.S_IMODE(st.st_mode)
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.mtime = st.st_mtime
+    if stat.S_ISDIR(st.st_mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(path)
+    else:
+        tarinfo.type = tarfile.REGTYPE
+        tarinfo.size = st.st_size
+    tarinfo.uname = lookup_uname(st.st_uid)
+    tarinfo.gname = lookup_gname(st.st_gid)
+    return tarinfo
+
+
+def make_hardlink(tarinfo, linkname):
+    """Turns regular file `tarinfo` into hard link to `linkname`
+    member, which content it shares."""
+    tarinfo.type = tarfile.LNKTYPE
+    tarinfo.linkname = linkname
+    tarinfo.size = 0
+    return tarinfo
+
+
+def lookup_uname(uid, _cache={}):
+    if uid not in _cache:
+        _cache[uid] = ''
+        if pwd is not None:
+            try:
+                _cache[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                pass
+    return _cache[uid]
+
+
+def lookup_gname(gid, _cache={}):
+    if gid not in _cache:
+        _cache[gid] = ''
+        if grp is not None:
+            try:
+                _cache[gid] = grp.getgrgid(gid).gr_name
+            except KeyError:
+                pass
+    return _cache[gid]
+
+
+def normalize_tarinfo(tarinfo, mtime=0):
+    """Drops everything which is specific to the build host from
+    the tar header: ownership, mtime and umask affected modes."""
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = 'root'
+    tarinfo.gname = 'wheel'
+    tarinfo.mtime = mtime
+    if tarinfo.issym():
+        tarinfo.mode = 0o777
+    elif tarinfo.isdir() or tarinfo.mode & 0o111:
+        tarinfo.mode = 0o755
+    else:
+        tarinfo.mode = 0o644
+    return tarinfo
@@ -8,22 +8,45 @@
 #
 
 import bz2
+import contextlib
 import gzip
 import hashlib
+import importlib
+import io
 import json
 import os
 import platform
 import re
+import shlex
 import shutil
+import stat
 import sys
 import tarfile
-from distutils.errors import DistutilsOptionError
-from itertools import chain, takewhile
+import tempfile
+import threading
+from distutils import log
+from distutils.errors import (DistutilsError, DistutilsExecError,
+                              DistutilsOptionError)
+from itertools import takewhile
 
 from pkg_resources import Requirement
 from setuptools import Command
 from setuptools.package_index import PackageIndex
 
+from .archive import (CHUNK_SIZE, HashingReader, TarStream, make_hardlink,
+                      make_tarinfo, normalize_tarinfo)
+from .cache import DigestCache, ResolutionCache, stat_key
+from .compression import (Compressor, DeferredWriter, GzipCompressor,
+                          XZCompressor, ZstdCompressor)
+from .inventory import Inventory, PathFilter
+from .manifest import DirectoriesView, FilesView, write_manifests
+from .matrix import MatrixTarget
+from .metrics import Metrics
+from .pipeline import Pipeline, Stage
+from .strip import is_elf, strip_file
+from .utils import ProcessPoolExecutor, ThreadPoolExecutor, imap_ordered
+from .wheel import WheelInventory
+
 try:
     import lzma
 except ImportError:  # pragma: no cover
@@ -32,6 +55,10 @@ except ImportError:  # pragma: no cover
     except ImportError:
         lzma = None
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
 
 try:
     import pip.wheel
@@ -53,16 +80,108 @@ class bdist_pkg(Command):
     user_options = [
         ('bdist-base=', 'b',
          'Base directory for creating built distributions.'),
+        ('compression-level=', None,
+         'Compression level to use for the package archive. Allowed range'
+         ' depends on the format.'),
+        ('compression-profile=', None,
+         'Compression level profile: fast, balanced, max or auto. The auto'
+         ' one picks the highest level which fits compression-time-budget,'
+         ' measured on a sample of the package.'),
+        ('compression-time-budget=', None,
+         'Number of seconds package compression is allowed to take in auto'
+         ' profile. Default: 60'),
+        ('deps-cache=', None,
+         'Path to the file where resolved PyPI dependencies are cached.'
+         ' Default: ~/.cache/setuptools-pkg/pypi-deps.json'),
+        ('deps-cache-ttl=', None,
+         'Number of seconds resolved PyPI dependencies are cached for.'
+         ' Default: 86400'),
         ('dist-dir=', 'd',
          'Directory to put distribute files in.'),
+        ('exclude=', None,
+         'Comma separated glob rules of install paths to leave out of the'
+         ' package, like */tests/*. Rules match the whole path.'),
+        ('find-links=', None,
+         'Additional URLs or local directories to look for PyPI dependencies'
+         ' in.'),
         ('format=', 'f',
          'Set format as the package output format.  It can be one'
-         ' of txz, tbz, tgz or tar.  If an invalid or no format is specified'
-         ' tgz is assumed.'),
+         ' of txz, tbz, tgz, tzst or tar.  If an invalid or no format is'
+         ' specified tgz is assumed.'),
+        ('index-url=', None,
+         'Base URL of the Python Package Index to resolve PyPI dependencies'
+         ' against. Local mirror can be set with file:// URL.'),
+        ('hardlink-duplicates', None,
+         'Store install files with the same content as an earlier one as'
+         ' hard links to it in the package archive.'),
+        ('include=', None,
+         'Comma separated glob rules of install paths to keep in the'
+         ' package even if they match exclude ones.'),
+        ('incremental', 'i',
+         'Reuse staging root of the previous build if sources, install'
+         ' options and project name and version are the same. Implies'
+         ' keep-temp.'),
+        ('jobs=', 'j',
+         'Number of worker threads to use for hashing install files and'
+         ' package compression. Only txz and tzst formats support parallel'
+         ' compression.'),
         ('keep-temp', None,
          'Keep intermediate build directories and files.'),
+        ('manifest-indent=', None,
+         'Number of spaces to indent manifests with. Zero makes them'
+         ' written in a single line. Default: 4'),
+        ('matrix=', 'm',
+         'Build a package for each of the listed targets in parallel'
+         ' instead. Target is an interpreter with optional extras to select'
+         ' for it: INTERPRETER[:EXTRA[+EXTRA...]]. Number of simultaneous'
+         ' builds is set by jobs.'),
+        ('matrix-target=', None,
+         'State file of the matrix target. For internal use.'),
+        ('metrics-hook=', None,
+         'Function to pass the build phases metrics to, as module:function.'),
+        ('no-deps-cache', None,
+         'Do not use resolved PyPI dependencies cache.'),
+        ('no-digest-cache', None,
+         'Do not use install files digests cache and hash every file.'),
         ('origin=', None,
          'Custom origin name for build package.'),
+        ('pipeline', None,
+         'Read, hash, frame and compress install files at once, each stage'
+         ' in its own thread connected to others by bounded queues.'),
+        ('pipeline-buffer=', None,
+         'Peak size in MiB of data queued between pipeline stages.'
+         ' Default: 64'),
+        ('report', None,
+         'Write wall and CPU time, peak RSS and processed bytes of every'
+         ' build phase to a JSON file next to the package.'),
+        ('precompile=', None,
+         'Comma separated optimization levels, 0, 1 or 2, to precompile'
+         ' Python files of the staging root for. Hash-based pycs are made,'
+         ' so they are the same for the same sources.'),
+        ('pyc-cache=', None,
+         'Directory where precompiled pycs are cached by source digest.'
+         ' Default: ~/.cache/setuptools-pkg/pyc'),
+        ('no-pyc-cache', None,
+         'Do not use precompiled pycs cache.'),
+        ('objcopy=', None,
+         'Tool to split debug info off with. Default: objcopy'),
+        ('reproducible', None,
+         'Make the same package for the same install files: sort archive'
+         ' members, drop their ownership, normalize modes and set their mtime'
+         ' to SOURCE_DATE_EPOCH or zero.'),
+        ('selected-options=', None,
+         'Comma separated list of extras to build package with.'),
+        ('split-debug', None,
+         'Along with strip, put debug info of ELF files into a separate'
+         ' -debug package.'),
+        ('stream-wheel', None,
+         'Along with use-wheel, make package right of the built wheel'
+         ' instead of installing it into staging root first.'),
+        ('strip', None,
+         'Strip debug symbols off ELF files of the staging root, like'
+         ' extension modules, in parallel.'),
+        ('strip-command=', None,
+         'Command to strip ELF files with. Default: strip --strip-unneeded'),
         ('use-pypi-deps', None,
          'Automatically convert unknown Python dependencies to package ones.'
          ' Note that those dependencies will be named with py{}{}- prefix and'
@@ -74,28 +193,85 @@ class bdist_pkg(Command):
         ('with-py-prefix', None,
          'Prepends py{}{}- prefix to package name.'
          ''.format(*sys.version_info[:2])),
+        ('xz-memory-limit=', None,
+         'Memory usage limit of txz compression in MiB. Compression level'
+         ' gets lowered to fit it.'),
     ]
-    boolean_options = ('keep-temp', 'use-wheel', 'python-deps-to-pkg',
-                       'with-py-prefix')
+    #: Size of the package payload sample to measure compression speed on.
+    compression_sample_size = 1024 * 1024
+
+    boolean_options = ('hardlink-duplicates', 'incremental', 'keep-temp',
+                       'no-deps-cache', 'no-digest-cache', 'no-pyc-cache',
+                       'pipeline', 'report', 'reproducible', 'split-debug',
+                       'stream-wheel', 'strip', 'use-wheel',
+                       'python-deps-to-pkg', 'with-py-prefix')
+
+    #: Upper limit of threads used to resolve PyPI dependencies, unless
+    #: more jobs are set.
+    max_resolve_workers = 8
 
     compressor_for_format = {
-        'txz': lzma,
-        'tgz': gzip,
-        'tbz': bz2,
+        'txz': XZCompressor(lzma, 'backports.lzma'),
+        'tgz': GzipCompressor(gzip),
+        'tbz': Compressor(bz2),
+        'tzst': ZstdCompressor(zstandard, 'zstandard'),
     }
 
     def initialize_options(self):
         self.bdist_base = None
+        self.compression_level = None
+        self.compression_profile = None
+        self.compression_time_budget = None
+        self.deps_cache = None
+        self.deps_cache_ttl = None
+        self.digest_cache = DigestCache()
+        self.digest_cache_name = 'pkg-digests.json'
         self.dist_dir = None
+        self.duplicate_sizes = set()
+        self.exclude = None
+        self.find_links = None
         self.format = None
+        self.hardlink_duplicates = False
+        self.include = None
+        self.incremental = False
+        self.index_url = None
+        self.inventory = None
+        self.jobs = None
         self.keep_temp = False
+        self.manifest_indent = None
+        self.matrix = None
+        self.matrix_target = None
+        self.metrics = Metrics()
+        self.metrics_hook = None
         self.name_prefix = None
+        self.no_deps_cache = False
+        self.no_digest_cache = False
+        self.no_pyc_cache = False
+        self.objcopy = None
         self.package_index = PackageIndex()
+        self.path_filter = None
+        self.payload_size = None
+        self.pipeline = False
+        self.pipeline_buffer = None
+        self.pipeline_stats = None
+        self.precompile = None
+        self.pyc_cache = None
+        self.report = False
+        self.reproducible = False
+        self.source_date_epoch = None
+        self.split_debug = False
+        self.stream_wheel = False
+        self.strip = False
+        self.strip_command = None
         self.requirements_mapping = None
+        self.resolution_cache = ResolutionCache()
+        self.resolved_deps = {}
         self.selected_options = None
         self.use_pypi_deps = False
         self.use_wheel = False
+        self.wheel_path = None
         self.with_py_prefix = False
+        self.xz_memory_limit = None
         self.initialize_manifest_options()
 
     def initialize_manifest_options(self):
@@ -151,8 +327,21 @@ class bdist_pkg(Command):
         self.set_undefined_options('bdist', ('bdist_base', 'bdist_base'))
         self.set_undefined_options('bdist', ('dist_dir', 'dist_dir'))
         self.ensure_format('tgz')
+        self.ensure_jobs(1)
+        self.ensure_compression_level()
+        self.ensure_reproducible()
+        self.ensure_manifest_indent(4)
+        self.ensure_pipeline_buffer(64)
+        self.ensure_precompile()
+        self.ensure_path_filter()
+        self.ensure_strip()
+        self.ensure_metrics_hook()
+        self.ensure_package_index()
         self.bdist_dir = os.path.join(self.bdist_base, 'pkg')
         self.install_dir = os.path.join(self.bdist_dir, 'root')
+        self.debug_dir = os.path.join(self.bdist_dir, 'debug-root')
+        self.ensure_matrix()
+        self.load_matrix_target()
         self.finalize_manifest_options()
 
     def finalize_manifest_options(self):
@@ -179,31 +368,249 @@ class bdist_pkg(Command):
         self.maybe_rename_console_scripts(project)
 
     def run(self):
-        self.build_and_install()
-        self.make_pkg(self.generate_manifest_content())
+        if self.matrix:
+            self.run_matrix()
+            return
+        if self.wheel_path is None:
+            self.maybe_build_and_install()
+        self.maybe_precompile()
+        self.inventory = None
+        with self.metrics.phase('inventory') as phase:
+            inventory = self.get_inventory()
+            phase.files, phase.bytes = len(inventory), inventory.flatsize
+        for rule, (files, size) in sorted(self.path_filter.removed.items()):
+            log.info('exclude %s removed %d files, %d bytes', rule, files,
+                     size)
+        with self.open_payload() as payload:
+            with self.metrics.phase('manifest') as phase:
+                manifest = self.generate_manifest_content(payload)
+                phase.files, phase.bytes = len(inventory), inventory.flatsize
+            with self.metrics.phase('archive') as phase:
+                phase.bytes = self.payload_size
+                path = self.make_pkg(manifest, payload)
+                phase.bytes_out = os.path.getsize(path)
+        debug_path = self.maybe_make_debug_pkg()
+        if debug_path is not None:
+            log.info('debug info is packaged into %s', debug_path)
+        self.save_matrix_target(path)
+        self.report_metrics(path)
         self.maybe_remove_temp(self.bdist_base)
 
+    def report_metrics(self, path):
+        """Writes metrics of the build phases next to the package if
+        asked to and passes them to the metrics hook. Override it to
+        collect the metrics by other means."""
+        if not self.report and self.metrics_hook is None:
+            return
+        report = self.metrics.as_dict()
+        report.update({
+            'excluded': self.path_filter.as_dict(),
+            'format': self.format,
+            'jobs': self.jobs,
+            'name': self.name,
+            'package': os.path.abspath(path),
+            'version': self.version,
+        })
+        if self.pipeline_stats is not None:
+            report['pipeline'] = self.pipeline_stats
+        if self.report:
+            with open(path + '.metrics.json', 'w') as fobj:
+                json.dump(report, fobj, sort_keys=True, indent=4)
+        if self.metrics_hook is not None:
+            self.metrics_hook(report)
+
+    def run_matrix(self):
+        # Dependencies are resolved here once for all the targets, while
+        # everything else that depends on Python version is left for
+        # the target interpreters.
+        state = {'resolved_deps': self.resolve_matrix_deps()}
+        args = [self.distribution.script_name or 'setup.py', 'bdist_pkg']
+        args.extend(self.get_matrix_args())
+        matrix_base = os.path.join(self.bdist_base, 'matrix')
+
+        def build(target):
+            # Package name depends neither on the selected extras nor,
+            # unless with_py_prefix is set, on the interpreter, and even
+            # different interpreter names may stand for the same Python.
+            # So packages of every target are kept apart.
+            dist_dir = os.path.abspath(self.dist_dir)
+            if len(self.matrix) > 1:
+                dist_dir = os.path.join(dist_dir, target.id)
+            log.info('building %s', target.spec)
+            return target.run(args + ['--dist-dir', dist_dir],
+                              os.path.join(matrix_base, target.id), state)
+
+        if self.jobs == 1 or ThreadPoolExecutor is None:
+            targets = [build(target) for target in self.matrix]
+        else:
+            # Targets are built by child processes, threads only wait
+            # for them.
+            with ThreadPoolExecutor(self.jobs) as executor:
+                targets = list(executor.map(build, self.matrix))
+
+        for target in targets:
+            log.info(target.summary())
+        failed = [target.spec for target in targets if not target.ok]
+        if failed:
+            raise DistutilsExecError('Matrix build failed for: {}'
+                                     ''.format(', '.join(failed)))
+        self.maybe_remove_temp(matrix_base)
+
+    def resolve_matrix_deps(self):
+        if not self.use_pypi_deps:
+            return {}
+        requirements = set(self.distribution.install_requires or [])
+        for target in self.matrix:
+            for option in target.extras:
+                requirements |= set(self.distribution.extras_require[option])
+        requirements -= set(self.requirements_mapping or {})
+        self.resolve_pypi_deps(sorted(requirements))
+        return self.resolved_deps
+
+    def get_matrix_args(self):
+        # Command line options are passed through to the targets, except
+        # ones which are set for each target on its own.
+        own_options = {'bdist_base', 'dist_dir', 'jobs', 'matrix',
+                       'matrix_target', 'selected_options'}
+        boolean_options = {name.replace('-', '_')
+                           for name in self.boolean_options}
+        options = self.distribution.get_option_dict(self.get_command_name())
+        args = []
+        for name, (source, value) in sorted(options.items()):
+            if source != 'command line' or name in own_options:
+                continue
+            option = '--' + name.replace('_', '-')
+            if name in boolean_options:
+                if value:
+                    args.append(option)
+            else:
+                args.extend([option, str(value)])
+        return args
+
+    def load_matrix_target(self):
+        if self.matrix_target is None:
+            return
+        with open(self.matrix_target) as fobj:
+            state = json.load(fobj)
+        self.resolved_deps.update(state.get('resolved_deps', {}))
+
+    def save_matrix_target(self, path):
+        if self.matrix_target is None:
+            return
+        with open(self.matrix_target) as fobj:
+            state = json.load(fobj)
+        state['package'] = os.path.abspath(path)
+        with open(self.matrix_target, 'w') as fobj:
+            json.dump(state, fobj)
+
+    def maybe_build_and_install(self):
+        # Data files of packages are found with egg_info.
+        self.maybe_isolate_egg_info()
+        if not self.incremental or self.stream_wheel:
+            self.build_and_install()
+            self.maybe_strip()
+            return
+        fingerprint = self.get_install_fingerprint()
+        fingerprint_path = os.path.join(self.bdist_dir, 'install.fingerprint')
+        if os.path.isdir(self.install_dir):
+            try:
+                with open(fingerprint_path) as fobj:
+                    previous = fobj.read()
+            except (IOError, OSError):
+                previous = None
+            if previous == fingerprint:
+                log.info('staging root is up to date,'
+                         ' skipping build and install')
+                return
+            # Build step is incremental by its own, but staging root may
+            # contain files which are gone from the sources.
+            shutil.rmtree(self.install_dir)
+        self.build_and_install()
+        # Stripped files can't be stripped once again, so it's a part of
+        # install step.
+        self.maybe_strip()
+        with open(fingerprint_path, 'w') as fobj:
+            fobj.write(fingerprint)
+
+    def get_install_fingerprint(self):
+        # Only things which affect staging root are counted here. Manifest
+        # and archive are made on every run anyway.
+        sources = sorted(set(self.iter_source_files()))
+        content = {
+            'name': self.distribution.get_name(),
+            'version': self.distribution.get_version(),
+            'prefix': self.prefix,
+            'strip': self.strip_command if self.strip else None,
+            'split_debug': bool(self.split_debug),
+            'use_wheel': bool(self.use_wheel),
+            'with_py_prefix': bool(self.with_py_prefix),
+            'python': list(sys.version_info[:2]),
+            'sources': [[path] + stat_key(os.stat(path))[:2]
+                        for path in sources if os.path.exists(path)],
+        }
+        data = json.dumps(content, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    def iter_source_files(self):
+        if self.distribution.script_name:
+            yield self.distribution.script_name
+        # Config files may change build and install options as well.
+        for path in self.distribution.find_config_files():
+            yield path
+        build = self.get_finalized_command('build')
+        for command in build.get_sub_commands():
+            command = self.get_finalized_command(command)
+            for path in command.get_source_files() or []:
+                yield path
+        # Unlike modules, package data isn't among build_py sources.
+        build_py = self.get_finalized_command('build_py')
+        for _, src_dir, _, filenames in build_py.data_files or []:
+            for filename in filenames:
+                yield os.path.join(src_dir, filename)
+        for item in self.distribution.data_files or []:
+            if isinstance(item, str):
+                yield item
+                continue
+            for path in item[1]:
+                yield path
+
     def build_and_install(self):
-        if self.use_wheel:
+        self.maybe_isolate_egg_info()
+        if self.use_wheel or self.stream_wheel:
             self.build_and_install_via_wheel()
         else:
             self.build_and_install_via_setuptools()
 
+    def maybe_isolate_egg_info(self):
+        # Matrix targets are built at once from the same sources, so each
+        # one writes egg-info into its own bdist_base instead of rewriting
+        # the one next to the sources.
+        if self.matrix_target is None:
+            return
+        egg_info = self.distribution.get_command_obj('egg_info')
+        if egg_info.egg_base == self.bdist_base:
+            return
+        self.mkpath(self.bdist_base)
+        egg_info = self.reinitialize_command('egg_info')
+        egg_info.egg_base = self.bdist_base
+
     def build_and_install_via_setuptools(self):
         # Basically, we need the intermediate results of bdist_dumb,
         # but since it's too monolithic and does the stuff that we would like
         # to avoid, here short copy-paste happens /:
         build = self.reinitialize_command('build', reinit_subcommands=1)
         build.build_base = self.bdist_base
-        self.run_command('build')
+        with self.metrics.phase('build'):
+            self.run_command('build')
         install = self.reinitialize_command('install', reinit_subcommands=1)
         install.prefix = self.prefix
         install.root = self.install_dir
         install.warn_dir = 0
-        self.run_command('install')
+        with self.metrics.phase('install'):
+            self.run_command('install')
 
     def build_and_install_via_wheel(self):
-        if not wheel_available:
+        if not wheel_available and not self.stream_wheel:
             raise RuntimeError('The `wheel` package is not available.')
         build = self.reinitialize_command('build', reinit_subcommands=1)
         build.build_base = self.bdist_base
@@ -212,18 +619,160 @@ class bdist_pkg(Command):
             reinit_subcommands=1
         )
         bdist_wheel.bdist_base = self.bdist_base
-        bdist_wheel.keep_temp = True
-        self.run_command('bdist_wheel')
+        bdist_wheel.keep_temp = not self.stream_wheel
+        if self.stream_wheel:
+            bdist_wheel.dist_dir = self.bdist_dir
+        with self.metrics.phase('build'):
+            self.run_command('bdist_wheel')
+        if self.stream_wheel:
+            # Wheel members are archived right from it, so nothing gets
+            # installed at all.
+            self.wheel_path = self.get_built_wheel()
+            return
         name = self.distribution.get_name()
-        pip.wheel.move_wheel_files(
-            name=self.name,
-            req=WhlRequirement.parse('{}=={}'.format(name, self.version)),
-            wheeldir=bdist_wheel.bdist_dir,
-            root=self.install_dir,
-            prefix=self.prefix,
-        )
+        with self.metrics.phase('install'):
+            pip.wheel.move_wheel_files(
+                name=self.name,
+                req=WhlRequirement.parse('{}=={}'.format(name, self.version)),
+                wheeldir=bdist_wheel.bdist_dir,
+                root=self.install_dir,
+                prefix=self.prefix,
+            )
+
+    def get_built_wheel(self):
+        for command, _, path in reversed(self.distribution.dist_files):
+            if command == 'bdist_wheel':
+                return path
+        raise DistutilsExecError('bdist_wheel made no wheel')
+
+    def maybe_strip(self):
+        if not self.strip:
+            return
+        if self.wheel_path is not None:
+            self.warn('strip is not supported for streamed wheels')
+            return
+        if os.path.isdir(self.debug_dir):
+            shutil.rmtree(self.debug_dir)
+        elf_files = [item for item in Inventory(self.install_dir, self.prefix)
+                     if is_elf(item.path, item.stat)]
+        if not elf_files:
+            return
+
+        def strip(item):
+            debug_path = None
+            if self.split_debug:
+                debug_path = self.get_debug_path(item.install_path)
+            return strip_file(item.path, self.strip_command, self.objcopy,
+                              debug_path)
+
+        with self.metrics.phase('strip') as phase:
+            if self.jobs == 1 or ThreadPoolExecutor is None:
+                sizes = [strip(item) for item in elf_files]
+            else:
+                # Tools do the work, threads only wait for them.
+                with ThreadPoolExecutor(self.jobs) as executor:
+                    sizes = list(executor.map(strip, elf_files))
+            phase.files = len(elf_files)
+            phase.bytes = sum(before for before, _ in sizes)
+            phase.bytes_out = sum(after for _, after in sizes)
+        log.info('stripped %d ELF files from %d to %d bytes', phase.files,
+                 phase.bytes, phase.bytes_out)
+        self.inventory = None
+
+    def get_debug_path(self, install_path):
+        # Debug info is looked for by its install path under debug
+        # directory of the prefix, as gdb does.
+        path = self.prefix + '/lib/debug' + install_path + '.debug'
+        return os.path.join(self.debug_dir, *path.split('/'))
 
-    def generate_manifest_content(self):
+    def maybe_make_debug_pkg(self):
+        """Makes `-debug` package of the debug info split off package
+        files. It's made by this command as well, with everything, but
+        the metadata and files, which belong to the package itself, left
+        out."""
+        if not self.split_debug or not os.path.isdir(self.debug_dir):
+            return None
+        debug = {
+            'comment': 'Debug info of {}'.format(self.name),
+            'deps': {self.name: {'origin': self.origin,
+                                 'version': self.version}},
+            'desc': 'Debug info of {} ELF files.'.format(self.name),
+            # Cache drops entries of the files it hasn't seen, so debug
+            # files get their own one.
+            'digest_cache_name': 'pkg-debug-digests.json',
+            'groups': None,
+            'install_dir': self.debug_dir,
+            'inventory': None,
+            'name': self.name + '-debug',
+            'path_filter': PathFilter(),
+            'pipeline_stats': None,
+            'provides': None,
+            'requires': None,
+            'scripts': None,
+            'users': None,
+        }
+        saved = {key: getattr(self, key) for key in debug}
+        try:
+            for key, value in debug.items():
+                setattr(self, key, value)
+            with self.open_payload() as payload:
+                manifest = self.generate_manifest_content(payload)
+                return self.make_pkg(manifest, payload)
+        finally:
+            for key, value in saved.items():
+                setattr(self, key, value)
+
+    def maybe_precompile(self):
+        if not self.precompile:
+            return
+        if self.wheel_path is not None:
+            self.warn('precompile is not supported for streamed wheels')
+            return
+        cache_dir = None if self.no_pyc_cache else self.pyc_cache
+        tasks = [(item.path, item.install_path, level, cache_dir)
+                 for item in Inventory(self.install_dir, self.prefix,
+                                       path_filter=self.path_filter)
+                 if item.install_path.endswith('.py') and
+                 stat.S_ISREG(item.stat.st_mode)
+                 for level in self.precompile]
+        if not tasks:
+            return
+        # bytecode relies on Python 3.7+ API, which ensure_precompile
+        # already checked, so don't import it on older Pythons.
+        from .bytecode import compile_file
+        with self.metrics.phase('precompile') as phase:
+            phase.files = len(tasks)
+            if self.jobs == 1 or ProcessPoolExecutor is None:
+                results = [compile_file(*task) for task in tasks]
+            else:
+                # Compilation is CPU bound, so it's spread over processes,
+                # not threads.
+                with ProcessPoolExecutor(self.jobs) as executor:
+                    results = list(executor.map(compile_file, *zip(*tasks),
+                                                chunksize=64))
+        cached = failed = 0
+        for (path, _, _, _), (cfile, hit, error) in zip(tasks, results):
+            cached += hit
+            if error is not None:
+                failed += 1
+                log.debug('unable to compile %s: %s', path, error)
+        log.info('precompiled %d files, %d of them taken from cache,'
+                 ' %d failed', len(tasks) - failed, cached, failed)
+        # Staging root has changed, so it has to be walked again.
+        self.inventory = None
+
+    def open_payload(self):
+        # Install files get framed and compressed into this spool while
+        # they are being hashed, so each of them is read only once and
+        # uncompressed payload is never stored. It's copied into
+        # the package right after the manifests.
+        # Not mkpath, since it remembers created directories for the whole
+        # process, while bdist_base gets removed after every build.
+        if not os.path.isdir(self.bdist_dir):
+            os.makedirs(self.bdist_dir)
+        return tempfile.TemporaryFile(dir=self.bdist_dir)
+
+    def generate_manifest_content(self, payload=None):
         manifest = {
             'abi': self.abi,
             'arch': self.arch,
@@ -231,9 +780,7 @@ class bdist_pkg(Command):
             'comment': self.comment,
             'deps': self.deps,
             'desc': self.desc,
-            'directories': {},
-            'files': {},
-            'flatsize': 0,
+            'flatsize': self.get_inventory().flatsize,
             'groups': self.groups,
             'licenselogic': 'single',
             'licenses': [self.license] if self.license else [],
@@ -250,23 +797,25 @@ class bdist_pkg(Command):
             'www': self.www,
         }
 
-        mdirs = manifest['directories']
-        mfiles = manifest['files']
-        for real_file_path, install_path in self.iter_install_files():
-            with open(real_file_path, 'rb') as fh:
-                data = fh.read()
-                manifest['flatsize'] += len(data)
-                mdirs[os.path.dirname(install_path)] = {
-                    'gname': 'wheel',
-                    'perm': '0755',
-                    'uname': 'root',
-                }
-                mfiles[install_path] = {
-                    'gname': 'wheel',
-                    'perm': '0644',
-                    'sum': hashlib.sha256(data).hexdigest(),
-                    'uname': 'root',
-                }
+        # File lists are views of the inventory, so entries of them are
+        # made only while the manifest is written.
+        inventory = self.get_inventory()
+        manifest['directories'] = DirectoriesView(inventory)
+        manifest['files'] = FilesView(inventory)
+        self.digest_cache = self.load_digest_cache()
+        self.payload_size = None
+        if payload is None:
+            for _ in self.digest_install_files():
+                pass
+        elif self.pipeline:
+            self.run_pipeline(payload)
+        else:
+            with self.compress_payload(payload) as fobj:
+                tar = TarStream(fobj)
+                for _ in self.digest_install_files(tar):
+                    pass
+            self.payload_size = tar.offset
+        self.digest_cache.save()
 
         # TODO: Should we keep UNKNOWN values?
         manifest = {key: value for key, value in manifest.items()
@@ -291,68 +840,446 @@ class bdist_pkg(Command):
 
         return manifest
 
-    def make_pkg(self, manifest):
-        manifest_path = self.make_manifest(manifest)
-        compact_manifest_path = self.make_compact_manifest(manifest)
-        files_paths = chain([
-            (manifest_path, os.path.basename(manifest_path)),
-            (compact_manifest_path, os.path.basename(compact_manifest_path))
-        ], self.iter_install_files())
+    def digest_install_files(self, tar=None):
+        seen = set()
+        links = {}
+        inventory = self.get_inventory()
+        self.duplicate_sizes = self.get_duplicate_sizes(inventory)
 
-        self.mkpath(self.dist_dir)
-        tar_path = self.make_tar(files_paths)
+        if self.jobs == 1 or ThreadPoolExecutor is None:
+            for item in inventory:
+                if tar is None:
+                    self.digest_file(item)
+                elif self.may_be_duplicate(item):
+                    # Content has to be known before it's written to tell
+                    # if it's a duplicate or not.
+                    self.digest_file(item)
+                    self.add_tar_dir(tar, item, seen)
+                    if not self.add_tar_hardlink(tar, item, links):
+                        self.archive_file(tar, item, hashed=True)
+                else:
+                    self.add_tar_dir(tar, item, seen)
+                    self.archive_file(tar, item)
+                yield item
+            return
+
+        # Files are read and hashed by the pool, while the payload gets
+        # assembled here in the original order, so it stays the same
+        # as sequential one.
+        task = self.digest_file if tar is None else self.frame_file
+        with ThreadPoolExecutor(self.jobs) as executor:
+            results = imap_ordered(executor, task,
+                                   ((item,) for item in inventory),
+                                   self.jobs * 4)
+            for (item,), segment in results:
+                if tar is not None:
+                    with segment:
+                        self.add_tar_dir(tar, item, seen)
+                        if not (self.may_be_duplicate(item) and
+                                self.add_tar_hardlink(tar, item, links)):
+                            tar.splice(segment)
+                yield item
+
+    def run_pipeline(self, payload):
+        """Makes the payload by the pipeline of read, hash, tar and
+        compress stages, which run at once with jobs more than one.
+        Otherwise they run one after another, which gives the same result.
+
+        Unlike the regular payload, it's compressed already, so package
+        of it is made by :meth:`make_segmented_tar`.
+        """
+        def chunk_size(message):
+            return len(message[1])
+
+        inventory = self.get_inventory()
+        self.duplicate_sizes = self.get_duplicate_sizes(inventory)
+        pipeline = Pipeline([
+            Stage('read', self.read_chunks, chunk_size),
+            Stage('hash', self.hash_chunks, chunk_size),
+            Stage('tar', self.frame_chunks),
+            Stage('compress', lambda blocks: self.compress_blocks(
+                blocks, payload), int),
+        ], self.pipeline_buffer * 1024 * 1024)
+        pipeline.run(inventory, threaded=self.jobs > 1)
+        self.payload_size = pipeline.stats[2].bytes
+        self.pipeline_stats = pipeline.as_dict()
+        for stage in self.pipeline_stats['stages']:
+            log.info('pipeline %s: %d%% busy, %.2fs waiting, %.2fs blocked',
+                     stage['name'], 100 * (stage['utilization'] or 0),
+                     stage['wait_time'], stage['blocked_time'])
+        log.info('pipeline peak buffered %d bytes',
+                 self.pipeline_stats['peak_buffered'])
+
+    def read_chunks(self, items):
+        """Pipeline stage which reads install files by chunks. Yields
+        `(item, chunk, last)` for every chunk and once for the files which
+        have no content to archive."""
+        for item in items:
+            item.digest = self.get_known_digest(item)
+            if stat.S_ISLNK(item.stat.st_mode):
+                if item.digest is None:
+                    self.digest_link(item)
+                yield item, b'', True
+                continue
+            size = item.stat.st_size if stat.S_ISREG(item.stat.st_mode) else 0
+            if not size:
+                yield item, b'', True
+                continue
+            with item.open() as fh:
+                while size:
+                    chunk = fh.read(min(CHUNK_SIZE, size))
+                    if not chunk:
+                        raise IOError('unexpected end of data for {}'
+                                      ''.format(item.install_path))
+                    size -= len(chunk)
+                    yield item, chunk, not size
+
+    def hash_chunks(self, chunks):
+        """Pipeline stage which hashes content of the files which digest
+        isn't known yet. Chunks are passed on as they are."""
+        hasher = None
+        for item, chunk, last in chunks:
+            if item.digest is None:
+                hasher = hasher or hashlib.sha256()
+                hasher.update(chunk)
+                if last:
+                    item.digest = hasher.hexdigest()
+                    hasher = None
+                    self.digest_cache.set(item.path, item.stat, item.digest)
+            yield item, chunk, last
+
+    def frame_chunks(self, chunks):
+        """Pipeline stage which frames chunks into tar members, the same
+        as :meth:`archive_file` does. Yields the payload by blocks of about
+        `CHUNK_SIZE`."""
+        buf = io.BytesIO()
+        tar = TarStream(buf)
+        seen = set()
+        links = {}
+        spool = tarinfo = None
+        for item, chunk, last in chunks:
+            if self.may_be_duplicate(item):
+                # Duplicate is known only once the whole content is hashed,
+                # so it's kept aside till then.
+                if spool is None:
+                    spool = tempfile.SpooledTemporaryFile(CHUNK_SIZE,
+                                                          dir=self.bdist_dir)
+                spool.write(chunk)
+                if last:
+                    self.add_tar_dir(tar, item, seen)
+                    if not self.add_tar_hardlink(tar, item, links):
+                        spool.seek(0)
+                        tar.addfile(self.get_tarinfo(item.path,
+                                                     item.install_path,
+                                                     item.stat), spool)
+                    spool.close()
+                    spool = None
+            else:
+                if tarinfo is None:
+                    self.add_tar_dir(tar, item, seen)
+                    tarinfo = self.get_tarinfo(item.path, item.install_path,
+                                               item.stat)
+                    tar.write(tarinfo.tobuf())
+                if tarinfo.isreg():
+                    tar.write(chunk)
+                    if last:
+                        tar.pad(tarfile.BLOCKSIZE)
+                if last:
+                    tarinfo = None
+            if buf.tell() >= CHUNK_SIZE:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    def compress_blocks(self, blocks, payload):
+        """Pipeline stage which writes the payload blocks into `payload`
+        compressed. Yields number of bytes written for every block."""
+        offset = payload.tell()
+        with self.compress_payload(payload) as fobj:
+            for block in blocks:
+                fobj.write(block)
+                yield payload.tell() - offset
+                offset = payload.tell()
+        yield payload.tell() - offset
+
+    @contextlib.contextmanager
+    def compress_payload(self, payload):
+        """Yields stream which compresses everything written to it into
+        `payload` spool, so uncompressed payload is never stored. With
+        auto compression profile the level is picked on the first sample
+        of the payload, while its size is taken for the flatsize."""
+        compressor = None
+        if self.format != 'tar':
+            compressor = self.get_compressor(self.format)
+        if compressor is None:
+            yield payload
+            return
+
+        def open_stream(sample):
+            if self.compression_profile == 'auto':
+                self.compression_level = self.pick_compression_level(
+                    compressor, sample, self.get_inventory().flatsize)
+            return self.open_archive(payload, compressor)
+
+        sample_size = 0
+        if self.compression_profile == 'auto':
+            sample_size = self.compression_sample_size
+        fobj = DeferredWriter(open_stream, sample_size)
+        try:
+            yield fobj
+        finally:
+            fobj.close()
+
+    def digest_file(self, item):
+        item.digest = self.get_known_digest(item)
+        if item.digest is not None:
+            return
+        if stat.S_ISLNK(item.stat.st_mode):
+            self.digest_link(item)
+            return
+        # Files are hashed by chunks to keep memory usage flat no matter
+        # how big they are.
+        hasher = hashlib.sha256()
+        with item.open() as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        item.digest = hasher.hexdigest()
+        self.digest_cache.set(item.path, item.stat, item.digest)
+
+    def archive_file(self, tar, item, hashed=False):
+        tarinfo = self.get_tarinfo(item.path, item.install_path, item.stat)
+        if not hashed:
+            item.digest = self.get_known_digest(item)
+        if not tarinfo.isreg():
+            tar.addfile(tarinfo)
+            if item.digest is None:
+                self.digest_link(item)
+            return
+        with item.open() as f:
+            if item.digest is not None:
+                tar.addfile(tarinfo, f)
+                return
+            hasher = hashlib.sha256()
+            tar.addfile(tarinfo, HashingReader(f, hasher))
+        item.digest = hasher.hexdigest()
+        self.digest_cache.set(item.path, item.stat, item.digest)
+
+    def digest_link(self, item):
+        # Same as pkg does, symlinks are summed by their target path, so
+        # the sum doesn't depend on what they point to, if anything.
+        target = os.readlink(item.path)
+        item.digest = hashlib.sha256(target.encode('utf-8')).hexdigest()
+        self.digest_cache.set(item.path, item.stat, item.digest)
+
+    def get_known_digest(self, item):
+        if item.known_digest is not None:
+            return item.known_digest
+        return self.digest_cache.get(item.path, item.stat)
+
+    def frame_file(self, item):
+        hashed = self.may_be_duplicate(item)
+        if hashed:
+            self.digest_file(item)
+        segment = tempfile.SpooledTemporaryFile(CHUNK_SIZE,
+                                                dir=self.bdist_dir)
+        self.archive_file(TarStream(segment), item, hashed)
+        segment.seek(0)
+        return segment
+
+    def get_duplicate_sizes(self, inventory):
+        """Returns sizes which more than one regular non-empty install file
+        has. Files of other sizes can't have the same content, so there is
+        no need to hash them before they are archived."""
+        if not self.hardlink_duplicates:
+            return set()
+        sizes, duplicate_sizes = set(), set()
+        for item in inventory:
+            if stat.S_ISREG(item.stat.st_mode) and item.stat.st_size:
+                size = item.stat.st_size
+                (duplicate_sizes if size in sizes else sizes).add(size)
+        return duplicate_sizes
+
+    def may_be_duplicate(self, item):
+        return (item.stat.st_size in self.duplicate_sizes and
+                stat.S_ISREG(item.stat.st_mode))
+
+    def add_tar_hardlink(self, tar, item, links):
+        """Adds hard link to the first install file of the same content,
+        if there was one. Otherwise remembers `item` as the first one.
+
+        Hard links share the inode, so only files which would get the same
+        mode and ownership out of the archive are linked together."""
+        tarinfo = self.get_tarinfo(item.path, item.install_path, item.stat)
+        key = (item.digest, tarinfo.mode, tarinfo.uid, tarinfo.gid)
+        linkname = links.setdefault(key, item.install_path)
+        if linkname == item.install_path:
+            return False
+        tar.addfile(make_hardlink(tarinfo, linkname))
+        return True
+
+    def load_digest_cache(self):
+        if self.no_digest_cache:
+            return DigestCache()
+        return DigestCache(os.path.join(self.bdist_base,
+                                        self.digest_cache_name))
+
+    def load_resolution_cache(self):
+        if self.no_deps_cache or not self.use_pypi_deps:
+            return ResolutionCache()
+        index = ' '.join([self.index_url or 'pypi'] +
+                         (self.find_links or []))
+        return ResolutionCache(self.deps_cache, self.deps_cache_ttl,
+                               index=index)
 
+    def make_pkg(self, manifest, payload=None):
         ext = self.format
+        compressor = None
         if ext != 'tar':
             compressor = self.get_compressor(ext)
             if compressor is None:
                 raise RuntimeError('Format {} is not supported'.format(ext))
-            self.compress_tar(tar_path, ext, compressor)
-            os.remove(tar_path)
+
+        manifest_path, compact_manifest_path = self.make_manifests(manifest)
+        files_paths = [
+            (manifest_path, os.path.basename(manifest_path)),
+            (compact_manifest_path, os.path.basename(compact_manifest_path))
+        ]
+
+        self.mkpath(self.dist_dir)
+        if payload is not None and self.payload_size is not None:
+            # Payload is compressed while it's framed already.
+            return self.make_segmented_tar(files_paths, payload, ext,
+                                           compressor)
+
+        if self.compression_profile == 'auto' and compressor is not None:
+            self.compression_level = self.choose_compression_level(compressor)
+        return self.make_tar(files_paths, ext, compressor)
+
+    def choose_compression_level(self, compressor):
+        # Without payload there is nothing to measure compression on.
+        return self.get_limited_compression_level(
+            compressor.profiles['balanced'])
+
+    def pick_compression_level(self, compressor, sample, size):
+        low, high = compressor.levels
+        high = self.get_limited_compression_level(high)
+        level = compressor.choose_level(sample, size,
+                                        self.compression_time_budget,
+                                        self.jobs, (low, high))
+        log.info('picked compression level %d for %s', level, self.format)
+        return level
+
+    def make_manifests(self, content):
+        """Writes both +MANIFEST and +COMPACT_MANIFEST in a single pass
+        over `content`."""
+        path = os.path.join(self.bdist_dir, '+MANIFEST')
+        compact_path = os.path.join(self.bdist_dir, '+COMPACT_MANIFEST')
+        with open(path, 'w') as fobj, open(compact_path, 'w') as compact_fobj:
+            write_manifests(content, fobj, compact_fobj, self.manifest_indent)
+        return path, compact_path
 
     def make_manifest(self, content):
         path = os.path.join(self.bdist_dir, '+MANIFEST')
         with open(path, 'w') as fobj:
-            json.dump(content, fobj, sort_keys=True, indent=4)
+            write_manifests(content, fobj, indent=self.manifest_indent)
         return path
 
     def make_compact_manifest(self, content):
         path = os.path.join(self.bdist_dir, '+COMPACT_MANIFEST')
-        compact_content = content.copy()
-        compact_content.pop('directories')
-        compact_content.pop('files')
-        with open(path, 'w') as fobj:
-            json.dump(compact_content, fobj, sort_keys=True, indent=4)
+        with open(path, 'w') as fobj, open(os.devnull, 'w') as devnull:
+            write_manifests(content, devnull, fobj, self.manifest_indent)
         return path
 
-    def make_tar(self, files_paths):
-        basename = '{}-{}.tar'.format(self.name, self.version)
+    def make_tar(self, files_paths, ext='tar', compressor=None):
+        basename = '{}-{}.{}'.format(self.name, self.version, ext)
         path = os.path.join(self.dist_dir, basename)
         seen = set()
-        with tarfile.open(path, 'w') as tar:
+        # Archive gets compressed while it's being written, so neither
+        # intermediate .tar file nor whole package in memory is needed.
+        with self.open_archive(path, compressor) as fobj:
+            tar = TarStream(fobj)
             for file_path, tar_path in files_paths:
-                tar_dir_path = os.path.dirname(tar_path)
-                if tar_dir_path and tar_dir_path not in seen:
-                    tarinfo = tar.gettarinfo(os.path.dirname(file_path),
-                                             tar_dir_path)
-                    tarinfo.name = tar_dir_path
+                self.add_tar_file(tar, file_path, tar_path)
+            # No payload was framed while generating manifest, so install
+            # files have to be read once again.
+            links = {}
+            inventory = self.get_inventory()
+            self.duplicate_sizes = self.get_duplicate_sizes(inventory)
+            for item in inventory:
+                self.add_tar_dir(tar, item, seen)
+                if (self.may_be_duplicate(item) and
+                        self.add_tar_hardlink(tar, item, links)):
+                    continue
+                tarinfo = self.get_tarinfo(item.path, item.install_path,
+                                           item.stat)
+                if not tarinfo.isreg():
                     tar.addfile(tarinfo)
-                    seen.add(tar_dir_path)
-                tarinfo = tar.gettarinfo(file_path, tar_path)
-                tarinfo.name = tar_path
-                with open(file_path, 'rb') as f:
+                    continue
+                with item.open() as f:
                     tar.addfile(tarinfo, f)
+            tar.close()
+        return path
+
+    def make_segmented_tar(self, files_paths, payload, ext='tar',
+                           compressor=None):
+        """Same as :meth:`make_tar`, but for the payload which was
+        compressed on its own while install files were framed. Manifests
+        and the end of archive are compressed as separate streams around
+        it. Concatenated gzip, bzip2, xz and zstd
+        streams decode as a single one, so it's still a valid package."""
+        basename = '{}-{}.{}'.format(self.name, self.version, ext)
+        path = os.path.join(self.dist_dir, basename)
+        with open(path, 'wb') as fobj:
+            with self.open_segment(fobj, compressor) as segment:
+                tar = TarStream(segment)
+                for file_path, tar_path in files_paths:
+                    self.add_tar_file(tar, file_path, tar_path)
+            payload.seek(0)
+            shutil.copyfileobj(payload, fobj, CHUNK_SIZE)
+            tar.offset += self.payload_size
+            with self.open_segment(fobj, compressor) as segment:
+                tar.fileobj = segment
+                tar.close()
         return path
 
-    def compress_tar(self, tar_path, ext, compressor):
-        txx_path = tar_path.rsplit('.tar', 1)[0] + '.' + ext
-        with compressor.open(txx_path, 'w') as txx:
-            with open(tar_path, 'rb') as tar:
-                txx.write(tar.read())
-        return txx_path
+    @contextlib.contextmanager
+    def open_segment(self, fobj, compressor=None):
+        if compressor is None:
+            yield fobj
+            return
+        with self.open_archive(fobj, compressor) as segment:
+            yield segment
+
+    def add_tar_dir(self, tar, item, seen):
+        tar_dir_path = os.path.dirname(item.install_path)
+        if tar_dir_path and tar_dir_path not in seen:
+            real_dir_path, st = self.inventory.dirs[tar_dir_path]
+            tar.addfile(self.get_tarinfo(real_dir_path, tar_dir_path, st))
+            seen.add(tar_dir_path)
+
+    def open_archive(self, path, compressor=None):
+        if compressor is None:
+            return open(path, 'wb')
+        return compressor.open(path, level=self.compression_level,
+                               jobs=self.jobs, reproducible=self.reproducible)
+
+    def add_tar_file(self, tar, file_path, tar_path):
+        with open(file_path, 'rb') as f:
+            tar.addfile(self.get_tarinfo(file_path, tar_path), f)
+
+    def get_tarinfo(self, path, name, st=None):
+        tarinfo = make_tarinfo(path, name, st)
+        if self.reproducible:
+            normalize_tarinfo(tarinfo, self.source_date_epoch)
+        return tarinfo
 
     def get_compressor(self, format):
-        return self.compressor_for_format.get(format)
+        compressor = self.compressor_for_format.get(format)
+        if compressor is None or not compressor.available:
+            return None
+        return compressor
 
     def get_abi(self):
         if platform.system().lower() != 'freebsd':
@@ -433,10 +1360,214 @@ class bdist_pkg(Command):
 
     def ensure_format(self, default):
         self.ensure_string('format', default)
-        if self.format not in {'txz', 'tbz', 'tgz', 'tar'}:
+        if self.format not in {'txz', 'tbz', 'tgz', 'tzst', 'tar'}:
             self.warn('Unknown format {!r}, falling back to {}'
                       ''.format(self.format, default))
             self.format = default
+        compressor = self.compressor_for_format.get(self.format)
+        if compressor is not None and not compressor.available:
+            raise DistutilsOptionError(
+                'Format {} requires {} package to be installed'
+                ''.format(self.format, compressor.requirement)
+            )
+
+    def ensure_compression_level(self):
+        self.ensure_positive_int('compression_time_budget', 60)
+        self.ensure_positive_int('xz_memory_limit')
+        if self.compression_level is None and self.compression_profile is None:
+            self.compression_level = self.get_limited_compression_level()
+            return
+        compressor = self.compressor_for_format.get(self.format)
+        if compressor is None:
+            raise DistutilsOptionError('Format {} does not support'
+                                       ' compression levels'
+                                       ''.format(self.format))
+        if self.compression_profile is not None:
+            self.ensure_compression_profile(compressor)
+            return
+        try:
+            self.compression_level = int(self.compression_level)
+        except ValueError:
+            raise DistutilsOptionError('compression_level must be an integer,'
+                                       ' got {!r}'
+                                       ''.format(self.compression_level))
+        low, high = compressor.levels
+        if not low <= self.compression_level <= high:
+            raise DistutilsOptionError('compression_level for {} must be'
+                                       ' within {}..{}, got {}'
+                                       ''.format(self.format, low, high,
+                                                 self.compression_level))
+        self.compression_level = self.get_limited_compression_level()
+
+    def ensure_compression_profile(self, compressor):
+        if self.compression_level is not None:
+            raise DistutilsOptionError('compression_level and'
+                                       ' compression_profile are mutually'
+                                       ' exclusive')
+        profiles = sorted(compressor.profiles) + ['auto']
+        if self.compression_profile not in profiles:
+            raise DistutilsOptionError('compression_profile must be one of'
+                                       ' {}, got {!r}'
+                                       ''.format(', '.join(profiles),
+                                                 self.compression_profile))
+        if self.compression_profile == 'auto' and self.reproducible:
+            # Level picked by timing may differ from one build to another.
+            raise DistutilsOptionError('compression_profile auto and'
+                                       ' reproducible are mutually exclusive')
+        if self.compression_profile != 'auto':
+            self.compression_level = self.get_limited_compression_level(
+                compressor.profiles[self.compression_profile])
+
+    def ensure_positive_int(self, option, default=None):
+        value = getattr(self, option)
+        if value is None:
+            setattr(self, option, default)
+            return
+        try:
+            value = int(value)
+        except ValueError:
+            raise DistutilsOptionError('{} must be an integer, got {!r}'
+                                       ''.format(option, value))
+        if value < 1:
+            raise DistutilsOptionError('{} must be positive, got {}'
+                                       ''.format(option, value))
+        setattr(self, option, value)
+
+    def get_limited_compression_level(self, level=None):
+        level = self.compression_level if level is None else level
+        if self.format != 'txz' or self.xz_memory_limit is None:
+            return level
+        return self.compressor_for_format['txz'].limit_level(
+            level, self.xz_memory_limit, self.jobs)
+
+    def ensure_jobs(self, default):
+        if self.jobs is None:
+            self.jobs = default
+        try:
+            self.jobs = int(self.jobs)
+        except ValueError:
+            raise DistutilsOptionError('jobs must be an integer, got {!r}'
+                                       ''.format(self.jobs))
+        if self.jobs < 1:
+            raise DistutilsOptionError('jobs must be positive, got {}'
+                                       ''.format(self.jobs))
+
+    def ensure_manifest_indent(self, default):
+        if self.manifest_indent is None:
+            self.manifest_indent = default
+        try:
+            self.manifest_indent = int(self.manifest_indent)
+        except ValueError:
+            raise DistutilsOptionError(
+                'manifest_indent must be an integer, got {!r}'
+                ''.format(self.manifest_indent))
+        if self.manifest_indent < 0:
+            raise DistutilsOptionError('manifest_indent must not be negative,'
+                                       ' got {}'.format(self.manifest_indent))
+
+    def ensure_pipeline_buffer(self, default):
+        if self.pipeline_buffer is None:
+            self.pipeline_buffer = default
+        try:
+            self.pipeline_buffer = int(self.pipeline_buffer)
+        except ValueError:
+            raise DistutilsOptionError(
+                'pipeline_buffer must be an integer, got {!r}'
+                ''.format(self.pipeline_buffer))
+        if self.pipeline_buffer < 1:
+            raise DistutilsOptionError('pipeline_buffer must be positive,'
+                                       ' got {}'.format(self.pipeline_buffer))
+
+    def ensure_matrix(self):
+        # Targets run the same setup script, so they see the matrix set
+        # in config files too, but mustn't fan out once more.
+        if self.matrix is None or self.matrix_target is not None:
+            self.matrix = None
+            return
+        self.ensure_string_list('matrix')
+        self.matrix = [MatrixTarget(spec) for spec in self.matrix]
+        provided_options = set(self.distribution.extras_require or {})
+        for target in self.matrix:
+            unknown_options = set(target.extras) - provided_options
+            if not target.interpreter or unknown_options:
+                raise DistutilsOptionError('Invalid matrix target: {}'
+                                           ''.format(target.spec))
+        ids = [target.id for target in self.matrix]
+        if len(set(ids)) != len(ids):
+            raise DistutilsOptionError('Matrix targets must be unique')
+
+    def ensure_metrics_hook(self):
+        if self.metrics_hook is None or callable(self.metrics_hook):
+            return
+        module_name, _, attr = self.metrics_hook.partition(':')
+        try:
+            obj = importlib.import_module(module_name)
+            for name in attr.split('.') if attr else []:
+                obj = getattr(obj, name)
+        except (ImportError, AttributeError, ValueError) as err:
+            raise DistutilsOptionError('Unable to load metrics_hook {}: {}'
+                                       ''.format(self.metrics_hook, err))
+        if not callable(obj):
+            raise DistutilsOptionError('metrics_hook {} is not callable'
+                                       ''.format(self.metrics_hook))
+        self.metrics_hook = obj
+
+    def ensure_reproducible(self):
+        if not self.reproducible:
+            return
+        value = os.environ.get('SOURCE_DATE_EPOCH', '0')
+        try:
+            self.source_date_epoch = int(value)
+        except ValueError:
+            raise DistutilsOptionError('SOURCE_DATE_EPOCH must be an integer,'
+                                       ' got {!r}'.format(value))
+
+    def ensure_package_index(self):
+        self.ensure_string('deps_cache', os.path.join(
+            os.path.expanduser('~'), '.cache', 'setuptools-pkg',
+            'pypi-deps.json'))
+        if self.deps_cache_ttl is None:
+            self.deps_cache_ttl = 24 * 60 * 60
+        try:
+            self.deps_cache_ttl = int(self.deps_cache_ttl)
+        except ValueError:
+            raise DistutilsOptionError('deps_cache_ttl must be an integer,'
+                                       ' got {!r}'.format(self.deps_cache_ttl))
+        self.ensure_string_list('find_links')
+        if self.index_url is not None:
+            self.package_index = PackageIndex(self.index_url)
+        if self.find_links:
+            self.package_index.add_find_links(self.find_links)
+        self.resolution_cache = self.load_resolution_cache()
+
+    def ensure_strip(self):
+        if self.split_debug:
+            self.strip = True
+        if not isinstance(self.strip_command, list):
+            self.ensure_string('strip_command', 'strip --strip-unneeded')
+            self.strip_command = shlex.split(self.strip_command)
+        self.ensure_string('objcopy', 'objcopy')
+
+    def ensure_path_filter(self):
+        self.ensure_string_list('include')
+        self.ensure_string_list('exclude')
+        self.path_filter = PathFilter(self.include, self.exclude)
+
+    def ensure_precompile(self):
+        self.ensure_string_list('precompile')
+        try:
+            levels = sorted(set(int(level) for level in self.precompile or []))
+        except ValueError:
+            raise DistutilsOptionError('precompile levels must be integers,'
+                                       ' got {!r}'.format(self.precompile))
+        if not set(levels) <= {0, 1, 2}:
+            raise DistutilsOptionError('precompile levels must be 0, 1 or 2,'
+                                       ' got {}'.format(levels))
+        if levels and sys.version_info < (3, 7):
+            raise DistutilsOptionError('precompile requires Python 3.7+')
+        self.precompile = levels
+        self.ensure_string('pyc_cache', os.path.join(
+            os.path.expanduser('~'), '.cache', 'setuptools-pkg', 'pyc'))
 
     def ensure_prefix(self, default=None):
         self.ensure_string('prefix', default)
@@ -481,14 +1612,11 @@ class bdist_pkg(Command):
 
         missing = seen_deps ^ install_requires
         if missing and self.use_pypi_deps:
-            for item in missing:
-                requirement = Requirement.parse(item)
-                distribution = self.package_index.obtain(requirement)
-                key = 'py{1}{2}-{0}'.format(distribution.key,
-                                            *sys.version_info[:2])
+            for dep in self.resolve_pypi_deps(sorted(missing)):
+                key = 'py{1}{2}-{0}'.format(dep['key'], *sys.version_info[:2])
                 self.deps[key] = {
-                    'origin': 'pypi/py-{}'.format(distribution.key),
-                    'version': distribution.version
+                    'origin': 'pypi/py-{}'.format(dep['key']),
+                    'version': dep['version']
                 }
         elif missing:
             raise DistutilsOptionError('These packages are listed in install'
@@ -496,6 +1624,67 @@ class bdist_pkg(Command):
                                        ' requirements mapping: {}'
                                        ''.format(', '.join(missing)))
 
+    def resolve_pypi_deps(self, items):
+        # Lookups are mostly waiting for the index, so they run on more
+        # threads than jobs. Results come in the order of `items` and all
+        # the failures are reported at once.
+        workers = min(len(items), max(self.jobs, self.max_resolve_workers))
+        local = threading.local()
+
+        def resolve(item, package_index=None):
+            try:
+                return self.resolve_pypi_dep(item, package_index), None
+            except (DistutilsError, EnvironmentError, ValueError) as err:
+                return None, '{}: {}'.format(item, err)
+
+        def resolve_in_worker(item):
+            # PackageIndex keeps fetched pages and found distributions in
+            # plain dicts, so every worker queries the index on its own.
+            if getattr(local, 'package_index', None) is None:
+                local.package_index = self.new_package_index()
+            return resolve(item, local.package_index)
+
+        if workers <= 1 or ThreadPoolExecutor is None:
+            results = [resolve(item) for item in items]
+        else:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(executor.map(resolve_in_worker, items))
+        self.resolution_cache.save()
+
+        errors = [error for dep, error in results if error is not None]
+        if errors:
+            raise DistutilsOptionError('Unable to resolve PyPI dependencies:'
+                                       '\n  {}'.format('\n  '.join(errors)))
+        return [dep for dep, error in results]
+
+    def resolve_pypi_dep(self, item, package_index=None):
+        if item in self.resolved_deps:
+            return self.resolved_deps[item]
+        dep = self.resolution_cache.get(item)
+        if dep is None:
+            requirement = Requirement.parse(item)
+            if package_index is None:
+                package_index = self.package_index
+            distribution = package_index.obtain(requirement)
+            if distribution is None:
+                raise DistutilsOptionError('no matching distribution found')
+            dep = {'key': distribution.key, 'version': distribution.version}
+            self.resolution_cache.set(item, dep['key'], dep['version'])
+        self.resolved_deps[item] = dep
+        return dep
+
+    def new_package_index(self):
+        """Returns a package index of the same `index_url` and
+        `find_links` as :attr:`package_index`, but which shares no state
+        with it."""
+        if self.index_url is None:
+            package_index = PackageIndex()
+        else:
+            package_index = PackageIndex(self.index_url)
+        if self.find_links:
+            package_index.add_find_links(self.find_links)
+        return package_index
+
     def ensure_desc(self, project):
         desc = project.get_long_description()
         desc = desc if desc != 'UKNOWN' else project.get_description()
@@ -512,7 +1701,9 @@ class bdist_pkg(Command):
 
     def ensure_options(self):
         provided_options = set(self.distribution.extras_require or {})
-        self.selected_options = set(self.selected_options or [])
+        if isinstance(self.selected_options, str):
+            self.ensure_string_list('selected_options')
+        self.selected_options = set(filter(None, self.selected_options or []))
         unknown_options = self.selected_options - provided_options
         if not unknown_options:
             self.options = {option: option in self.selected_options
@@ -548,17 +1739,23 @@ class bdist_pkg(Command):
             raise DistutilsOptionError('invalid scripts: {}'
                                        ''.format(', '.join(bad_keys)))
 
+    def get_inventory(self):
+        root = self.wheel_path or self.install_dir
+        if self.inventory is None or self.inventory.root != root:
+            if self.wheel_path is None:
+                self.inventory = Inventory(self.install_dir, self.prefix,
+                                           path_filter=self.path_filter)
+            else:
+                self.inventory = WheelInventory(self.wheel_path, self.prefix,
+                                                path_filter=self.path_filter)
+        return self.inventory
+
     def iter_install_files(self):
-        for root, dirs, files in os.walk(self.install_dir):
-            for file in files:
-                reldir = os.path.relpath(root, self.install_dir)
-                install_path = '/' + os.path.join(reldir, file)
-                install_path = install_path.replace(self.prefix + '/lib64/',
-                                                    self.prefix + '/lib/')
-                yield os.path.join(root, file), install_path
+        for item in self.get_inventory():
+            yield item.path, item.install_path
 
     def maybe_remove_temp(self, path):
-        if self.keep_temp:
+        if self.keep_temp or self.incremental:
             return
         if path is None:
             return
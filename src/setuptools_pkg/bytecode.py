@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import hashlib
+import importlib.util
+import os
+import py_compile
+import shutil
+import tempfile
+
+__all__ = (
+    'compile_file',
+)
+
+
+def get_cache_key(source, dfile, optimize):
+    """Returns cache key of the compiled `source`. Besides the source
+    itself, bytecode depends on the interpreter, optimization level and
+    the path it's compiled for, which gets into code objects."""
+    hasher = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+    hasher.update('{}\0{}\0'.format(optimize, dfile).encode('utf-8'))
+    hasher.update(source)
+    return hasher.hexdigest()
+
+
+def compile_file(path, dfile, optimize, cache_dir=None):
+    """Compiles `path` into hash-based pyc of `optimize` level next to it,
+    as if it was compiled at `dfile`. Hash-based pycs don't depend on
+    source mtime, so they are the same for the same source.
+
+    Returns `(pyc path, cached, error)`, where `cached` tells if pyc
+    was taken from `cache_dir`.
+    """
+    cfile = importlib.util.cache_from_source(path,
+                                             optimization=optimize or '')
+    cached_path = None
+    if cache_dir is not None:
+        with open(path, 'rb') as fobj:
+            key = get_cache_key(fobj.read(), dfile, optimize)
+        cached_path = os.path.join(cache_dir, key[:2], key + '.pyc')
+        if os.path.exists(cached_path):
+            os.makedirs(os.path.dirname(cfile), exist_ok=True)
+            shutil.copyfile(cached_path, cfile)
+            return cfile, True, None
+    try:
+        py_compile.compile(
+            path, cfile, dfile, doraise=True, optimize=optimize,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+    except py_compile.PyCompileError as err:
+        # Same as compileall does, files which aren't valid Python of this
+        # version, like templates, are left as is.
+        return None, False, err.msg
+    if cached_path is not None:
+        # Workers may race for the same source, so pyc is moved into
+        # the cache whole.
+        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path))
+        os.close(fd)
+        shutil.copyfile(cfile, tmp_path)
+        os.replace(tmp_path, cached_path)
+    return cfile, False, None
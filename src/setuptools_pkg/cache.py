@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import time
+
+__all__ = (
+    'DigestCache',
+    'ResolutionCache',
+)
+
+
+def stat_key(st):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:  # pragma: no cover
+        mtime_ns = int(st.st_mtime * 1e9)
+    return [st.st_size, mtime_ns, st.st_ino]
+
+
+class DigestCache(object):
+    """Persistent file path to SHA-256 digest mapping.
+
+    Entry is valid while file size, mtime and inode stay the same. Entries
+    of files which weren't looked up since the cache was loaded are
+    considered stale and get dropped on save. Without path it's no-op.
+    """
+
+    version = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.seen = set()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fobj:
+                content = json.load(fobj)
+        except (IOError, OSError, ValueError):
+            return
+        if content.get('version') == self.version:
+            self.entries = content.get('entries', {})
+
+    def save(self):
+        if self.path is None:
+            return
+        if not os.path.isdir(os.path.dirname(self.path) or os.curdir):
+            return
+        entries = {path: value for path, value in self.entries.items()
+                   if path in self.seen}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump({'version': self.version, 'entries': entries}, fobj)
+        os.rename(tmp_path, self.path)
+
+    def get(self, path, st):
+        if self.path is None:
+            return None
+        self.seen.add(path)
+        entry = self.entries.get(path)
+        if entry is None or entry[:3] != stat_key(st):
+            return None
+        return entry[3]
+
+    def set(self, path, st, digest):
+        if self.path is None:
+            return
+        self.seen.add(path)
+        self.entries[path] = stat_key(st) + [digest]
+
+
+class ResolutionCache(object):
+    """Persistent mapping of requirement strings to PyPI distributions they
+    were resolved to: their keys and versions.
+
+    Entries expire in `ttl` seconds. On save expired entries are dropped
+    and only `max_entries` of the most recently resolved ones are kept.
+    Without path it's no-op.
+
+    The same requirement may resolve differently on another index, so
+    entries are kept apart for every `index`, which is any string naming
+    the index and the links it was resolved with.
+    """
+
+    version = 2
+
+    def __init__(self, path=None, ttl=24 * 60 * 60, max_entries=10000,
+                 index=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index = index
+        self.entries = {}
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fobj:
+                content = json.load(fobj)
+        except (IOError, OSError, ValueError):
+            return
+        if content.get('version') == self.version:
+            self.entries = content.get('entries', {})
+
+    def save(self):
+        if self.path is None:
+            return
+        dirname = os.path.dirname(self.path) or os.curdir
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                return
+        now = time.time()
+        entries = sorted(((item, value) for item, value in self.entries.items()
+                          if now - value[2] < self.ttl),
+                         key=lambda entry: entry[1][2], reverse=True)
+        entries = dict(entries[:self.max_entries])
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fobj:
+            json.dump({'version': self.version, 'entries': entries}, fobj)
+        os.rename(tmp_path, self.path)
+
+    def get_key(self, requirement):
+        if self.index is None:
+            return requirement
+        return '{}#{}'.format(self.index, requirement)
+
+    def get(self, requirement):
+        if self.path is None:
+            return None
+        entry = self.entries.get(self.get_key(requirement))
+        if entry is None or time.time() - entry[2] >= self.ttl:
+            return None
+        return {'key': entry[0], 'version': entry[1]}
+
+    def set(self, requirement, key, version):
+        if self.path is None:
+            return
+        self.entries[self.get_key(requirement)] = [key, version,
+                                                   time.time()]
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import collections
+import zlib
+
+from .utils import ThreadPoolExecutor
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+__all__ = (
+    'Compressor',
+    'DeferredWriter',
+    'GzipCompressor',
+    'ParallelXZFile',
+    'XZCompressor',
+    'ZstdCompressor',
+)
+
+
+class Compressor(object):
+    """Opens compressed streams for the package archive using one of
+    the stdlib-alike compression modules (gzip, bz2, lzma). Streams are
+    opened either by path or on top of a file object, which is left open
+    when they get closed."""
+
+    #: Range of supported compression levels.
+    levels = (1, 9)
+    #: Compression levels of named profiles.
+    profiles = {'fast': 1, 'balanced': 6, 'max': 9}
+    #: Whether compression is spread over the jobs.
+    parallel = False
+
+    def __init__(self, module, requirement=None):
+        self.module = module
+        self.requirement = requirement
+
+    @property
+    def available(self):
+        return self.module is not None
+
+    def open(self, path, level=None, jobs=1, reproducible=False):
+        if level is None:
+            return self.module.open(path, 'wb')
+        return self.module.open(path, 'wb', compresslevel=level)
+
+    def open_reader(self, path):
+        return self.module.open(path, 'rb')
+
+    def compress(self, data, level):
+        return self.module.compress(data, level)
+
+    def choose_level(self, sample, size, budget, jobs=1, levels=None):
+        """Picks the highest compression level which is expected to
+        compress `size` bytes within `budget` seconds, judging by how fast
+        `sample` gets compressed. Falls back to the lowest level if none
+        of them fits."""
+        low, high = levels or self.levels
+        if not sample:
+            return high
+        scale = float(size) / len(sample)
+        if self.parallel:
+            scale /= jobs
+        chosen = low
+        for level in range(low, high + 1):
+            start = clock()
+            self.compress(sample, level)
+            # Higher levels only get slower, so there is no point to try
+            # them once the budget is exceeded.
+            if (clock() - start) * scale > budget:
+                break
+            chosen = level
+        return chosen
+
+
+class GzipCompressor(Compressor):
+    """Same as :class:`Compressor`, but for reproducible output it stores
+    no timestamp in gzip header."""
+
+    def open(self, path, level=None, jobs=1, reproducible=False):
+        if not reproducible:
+            return super(GzipCompressor, self).open(path, level, jobs)
+        level = 9 if level is None else level
+        if not isinstance(path, str):
+            return self.module.GzipFile(fileobj=path, mode='wb', mtime=0,
+                                        compresslevel=level)
+        return self.module.GzipFile(path, 'wb', mtime=0, compresslevel=level)
+
+    def compress(self, data, level):
+        # Same deflate as in gzip, but without header and trailer.
+        return zlib.compress(data, level)
+
+
+class XZCompressor(Compressor):
+
+    levels = (0, 9)
+    profiles = {'fast': 0, 'balanced': 6, 'max': 9}
+    parallel = True
+    default_level = 6
+    #: Compressor memory usage in MiB for each preset, as `xz` reports.
+    memory_usage = (3, 9, 17, 32, 48, 94, 94, 186, 370, 674)
+
+    def open(self, path, level=None, jobs=1, reproducible=False):
+        # Output of parallel compression depends on the block size only,
+        # so for reproducible output it's used for any number of jobs.
+        if (jobs > 1 or reproducible) and ThreadPoolExecutor is not None:
+            return ParallelXZFile(path, self.module, jobs, preset=level)
+        return self.module.open(path, 'wb', preset=level)
+
+    def compress(self, data, level):
+        return self.module.compress(data, preset=level)
+
+    def limit_level(self, level, memory_limit, jobs=1):
+        """Lowers the preset until compression fits in `memory_limit` MiB,
+        like `xz --memlimit-compress` does. Every job holds its own
+        compressor."""
+        level = self.default_level if level is None else level
+        while level > 0 and self.memory_usage[level] * jobs > memory_limit:
+            level -= 1
+        return level
+
+
+class ZstdCompressor(Compressor):
+    """Compressor on top of `zstandard` package which does multi-threaded
+    compression on its own."""
+
+    levels = (1, 22)
+    profiles = {'fast': 1, 'balanced': 3, 'max': 19}
+    parallel = True
+    default_level = 3
+
+    def open(self, path, level=None, jobs=1, reproducible=False):
+        # Multi-threaded compression output doesn't depend on the number
+        # of threads, but differs from the single-threaded one.
+        cctx = self.module.ZstdCompressor(
+            level=self.default_level if level is None else level,
+            threads=jobs if jobs > 1 or reproducible else 0,
+        )
+        if not isinstance(path, str):
+            return cctx.stream_writer(path, closefd=False)
+        return cctx.stream_writer(open(path, 'wb'), closefd=True)
+
+    def open_reader(self, path):
+        dctx = self.module.ZstdDecompressor()
+        return dctx.stream_reader(open(path, 'rb'), read_across_frames=True,
+                                  closefd=True)
+
+    def compress(self, data, level):
+        return self.module.ZstdCompressor(level=level).compress(data)
+
+
+class DeferredWriter(object):
+    """Write-only stream which holds the first `sample_size` bytes written
+    to it until `opener` makes the actual stream of them. So the stream
+    may depend on its content, like compression level picked on a sample.
+    """
+
+    def __init__(self, opener, sample_size=0):
+        self.opener = opener
+        self.sample_size = sample_size
+        self.buffer = bytearray()
+        self.fileobj = None
+
+    def write(self, data):
+        if self.fileobj is not None:
+            return self.fileobj.write(data)
+        self.buffer.extend(data)
+        if len(self.buffer) >= self.sample_size:
+            self.start()
+        return len(data)
+
+    def start(self):
+        self.fileobj = self.opener(bytes(self.buffer[:self.sample_size]))
+        self.fileobj.write(bytes(self.buffer))
+        del self.buffer[:]
+
+    def close(self):
+        if self.fileobj is None:
+            self.start()
+        self.fileobj.close()
+
+
+class ParallelXZFile(object):
+    """Write-only xz file which compresses its input by independent blocks
+    on a pool of threads.
+
+    Each block becomes a complete xz stream. Concatenated streams are
+    a valid xz file which both `xz -d` and libarchive (thus `pkg`) decode
+    as a whole. lzma releases the GIL while compressing, so threads are
+    enough to load all the cores.
+
+    `path` may be a file object as well, which is left open on close.
+    """
+
+    #: Same as `xz -T` picks for the default preset: three times
+    #: the dictionary size.
+    block_size = 3 * 8 * 1024 * 1024
+
+    def __init__(self, path, lzma, jobs, preset=None, block_size=None):
+        self.lzma = lzma
+        self.jobs = jobs
+        self.preset = preset
+        if block_size is not None:
+            self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = collections.deque()
+        self.executor = ThreadPoolExecutor(jobs)
+        self.closefd = isinstance(path, str)
+        self.fileobj = open(path, 'wb') if self.closefd else path
+        self.closed = False
+        self.empty = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self.submit(block)
+        return len(data)
+
+    def submit(self, block):
+        self.empty = False
+        self.pending.append(self.executor.submit(self.compress, block))
+        # Keep memory bounded: no more than two blocks per worker
+        # are allowed to be in flight.
+        while len(self.pending) > self.jobs * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def compress(self, block):
+        return self.lzma.compress(block, format=self.lzma.FORMAT_XZ,
+                                  preset=self.preset)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buffer or self.empty:
+                self.submit(bytes(self.buffer))
+                del self.buffer[:]
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            if self.closefd:
+                self.fileobj.close()
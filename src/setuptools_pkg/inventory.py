@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import fnmatch
+import os
+import re
+import stat
+
+try:
+    from os import scandir
+except ImportError:  # pragma: no cover
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = (
+    'InstallFile',
+    'Inventory',
+    'PathFilter',
+)
+
+
+class InstallFile(object):
+    """Single file of the staging root."""
+
+    __slots__ = ('path', 'install_path', 'stat', 'digest')
+
+    #: Digest of the content, if it's known without reading it.
+    known_digest = None
+
+    def __init__(self, path, install_path, st, digest=None):
+        self.path = path
+        self.install_path = install_path
+        self.stat = st
+        self.digest = digest
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, self.install_path)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+class PathFilter(object):
+    """Install path glob rules. Files which match any of `exclude` rules
+    are left out, unless they match any of `include` ones. Rules match
+    the whole install path and `*` matches `/` too, so `*/tests/*` drops
+    every tests directory.
+
+    Number of files and bytes each exclude rule removed is counted.
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = self.compile(include)
+        self.exclude = [(rule, re.compile(fnmatch.translate(rule)).match)
+                        for rule in exclude or ()]
+        self.removed = {}
+        self.reset()
+
+    def __bool__(self):
+        return bool(self.exclude)
+
+    __nonzero__ = __bool__
+
+    def reset(self):
+        #: Exclude rule to [files, bytes] it removed mapping.
+        self.removed = {rule: [0, 0] for rule, _ in self.exclude}
+
+    def compile(self, rules):
+        if not rules:
+            return None
+        return re.compile('|'.join('(?:{})'.format(fnmatch.translate(rule))
+                                   for rule in rules)).match
+
+    def keep(self, install_path, size):
+        for rule, match in self.exclude:
+            if match(install_path):
+                break
+        else:
+            return True
+        if self.include is not None and self.include(install_path):
+            return True
+        self.removed[rule][0] += 1
+        self.removed[rule][1] += size
+        return False
+
+    def as_dict(self):
+        return {rule: {'files': files, 'bytes': size}
+                for rule, (files, size) in self.removed.items()}
+
+
+class Inventory(object):
+    """All the files of the staging root, collected by a single tree walk.
+
+    Every file and directory is stat'ed exactly once and install paths are
+    computed per directory, not per file. Manifest, flatsize and archive
+    are all made from here.
+    """
+
+    def __init__(self, root, prefix, path_filter=None):
+        self.root = root
+        self.prefix = prefix
+        self.path_filter = path_filter or None
+        self.files = []
+        #: Install directory path to (real path, stat) mapping.
+        self.dirs = {}
+        self.scan()
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def flatsize(self):
+        return sum(item.stat.st_size for item in self.files)
+
+    def scan(self):
+        if self.path_filter is not None:
+            self.path_filter.reset()
+        lib64, lib = self.prefix + '/lib64/', self.prefix + '/lib/'
+        stack = [(self.root, '')]
+        while stack:
+            real_dir, install_dir = stack.pop()
+            base = (install_dir + '/').replace(lib64, lib)
+            subdirs = []
+            count = len(self.files)
+            try:
+                # Sorted, so the manifest and archive come out the same
+                # for the same files.
+                entries = sorted(self.iter_dir(real_dir))
+            except OSError:
+                # Unreadable or missing directories are silently skipped
+                # as os.walk does.
+                continue
+            for name, path, is_dir, is_link, st in entries:
+                if is_dir:
+                    # Same as os.walk does: symlinks to directories are
+                    # neither followed nor treated as files.
+                    if not is_link:
+                        subdirs.append((path, install_dir + '/' + name))
+                    continue
+                if (self.path_filter is not None and
+                        not self.path_filter.keep(base + name, st.st_size)):
+                    continue
+                self.files.append(InstallFile(path, base + name, st))
+            if len(self.files) > count:
+                self.dirs[base[:-1]] = (real_dir, os.lstat(real_dir))
+            stack.extend(reversed(subdirs))
+
+    def iter_dir(self, path):
+        if scandir is None:  # pragma: no cover
+            for name in os.listdir(path):
+                item_path = os.path.join(path, name)
+                st = os.lstat(item_path)
+                is_link = stat.S_ISLNK(st.st_mode)
+                yield (name, item_path, os.path.isdir(item_path), is_link, st)
+            return
+        for entry in scandir(path):
+            is_dir = entry.is_dir()
+            is_link = entry.is_symlink()
+            st = None if is_dir else entry.stat(follow_symlinks=False)
+            yield entry.name, entry.path, is_dir, is_link, st
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import abc
+import json
+import operator
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+__all__ = (
+    'DirectoriesView',
+    'FilesView',
+    'write_manifests',
+)
+
+
+#: Manifest keys which are left out of +COMPACT_MANIFEST.
+FILE_LIST_KEYS = ('directories', 'files')
+
+
+class InventoryView(Mapping):
+    """Read-only mapping of install paths to manifest entries on top of
+    :class:`~setuptools_pkg.inventory.Inventory`. Entries are made on
+    access, so a manifest of any size costs no more memory than the
+    inventory itself."""
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+
+    def __repr__(self):
+        return '<{} of {} entries>'.format(type(self).__name__, len(self))
+
+    @abc.abstractmethod
+    def sorted_items(self):
+        """Same as `items`, but sorted by install path."""
+
+
+class FilesView(InventoryView):
+
+    def __init__(self, inventory):
+        super(FilesView, self).__init__(inventory)
+        self.index = None
+
+    def __getitem__(self, key):
+        # Install paths are indexed on the first lookup only, since
+        # manifest writing just iterates over the files.
+        if self.index is None:
+            self.index = {item.install_path: item
+                          for item in self.inventory}
+        return self.entry(self.index[key])
+
+    def __iter__(self):
+        for item in self.inventory:
+            yield item.install_path
+
+    def __len__(self):
+        return len(self.inventory)
+
+    def sorted_items(self):
+        for item in sorted(self.inventory,
+                           key=operator.attrgetter('install_path')):
+            yield item.install_path, self.entry(item)
+
+    def entry(self, item):
+        return {
+            'gname': 'wheel',
+            'perm': '0644',
+            'sum': item.digest,
+            'uname': 'root',
+        }
+
+
+class DirectoriesView(InventoryView):
+
+    def __getitem__(self, key):
+        if key not in self.inventory.dirs and not (
+                key == '/' and '' in self.inventory.dirs):
+            raise KeyError(key)
+        return self.entry()
+
+    def __iter__(self):
+        for path in self.inventory.dirs:
+            # Files of the staging root itself are in the root directory.
+            yield path or '/'
+
+    def __len__(self):
+        return len(self.inventory.dirs)
+
+    def sorted_items(self):
+        for path in sorted(self):
+            yield path, self.entry()
+
+    def entry(self):
+        return {
+            'gname': 'wheel',
+            'perm': '0755',
+            'uname': 'root',
+        }
+
+
+def write_manifests(manifest, fobj, compact_fobj=None, indent=4):
+    """Writes `manifest` as JSON to `fobj` and, without the file lists, to
+    `compact_fobj` in a single pass over it. Output is the same as of
+    :func:`json.dump` with sorted keys, but file lists are written entry
+    by entry, so they are never serialized as a whole in memory. Without
+    `indent` output is written in a single line."""
+    if indent:
+        separators = (',', ': ')
+        newline = '\n'
+        pad = ' ' * indent
+    else:
+        separators = (',', ':')
+        newline = pad = ''
+
+    def dumps(value, level):
+        data = json.dumps(value, sort_keys=True, indent=indent or None,
+                          separators=separators)
+        return data.replace('\n', newline + pad * level)
+
+    fobjs = [fobj] if compact_fobj is None else [fobj, compact_fobj]
+    for each in fobjs:
+        each.write('{')
+    first = [True] * len(fobjs)
+    for key in sorted(manifest):
+        value = manifest[key]
+        targets = [0] if key in FILE_LIST_KEYS else range(len(fobjs))
+        for idx in targets:
+            fobjs[idx].write(('' if first[idx] else separators[0]) +
+                             newline + pad + json.dumps(key) + separators[1])
+            first[idx] = False
+        if not isinstance(value, InventoryView):
+            data = dumps(value, 1)
+            for idx in targets:
+                fobjs[idx].write(data)
+            continue
+        write_entries(fobj, value, separators, newline, pad, dumps)
+    for idx, each in enumerate(fobjs):
+        each.write(('' if first[idx] else newline) + '}')
+
+
+def write_entries(fobj, view, separators, newline, pad, dumps):
+    if not len(view):
+        fobj.write('{}')
+        return
+    fobj.write('{')
+    sep = ''
+    for path, entry in view.sorted_items():
+        fobj.write(sep + newline + pad * 2 + json.dumps(path) +
+                   separators[1] + dumps(entry, 2))
+        sep = separators[0]
+    fobj.write(newline + pad + '}')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import re
+import subprocess
+import time
+
+__all__ = (
+    'MatrixTarget',
+)
+
+
+class MatrixTarget(object):
+    """Single build of the matrix: an interpreter and the extras selected
+    for it, written as ``INTERPRETER[:EXTRA[+EXTRA...]]``.
+
+    Each target is built by its own interpreter in a separate process, so
+    everything which depends on the Python version (package name prefix,
+    origin, console scripts) comes out right. Shared state, like resolved
+    dependencies, is passed to the child through a JSON file which the
+    child updates with the built package path.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        interpreter, _, extras = spec.partition(':')
+        self.interpreter = interpreter
+        self.extras = sorted(set(filter(None, extras.split('+'))))
+        self.returncode = None
+        self.elapsed = None
+        self.log_path = None
+        self.package = None
+
+    def __repr__(self):
+        return '<MatrixTarget {}>'.format(self.spec)
+
+    @property
+    def id(self):
+        name = re.sub(r'[^\w.]+', '_', os.path.basename(self.interpreter))
+        return '-'.join([name] + self.extras)
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def run(self, args, bdist_base, state):
+        """Runs child build and waits for it. Child output goes to the log
+        file next to its own `bdist_base`, which the child may remove."""
+        if not os.path.isdir(os.path.dirname(bdist_base)):
+            os.makedirs(os.path.dirname(bdist_base))
+        state_path = bdist_base + '.json'
+        with open(state_path, 'w') as fobj:
+            json.dump(state, fobj)
+        args = [self.interpreter] + args + [
+            '--bdist-base', bdist_base,
+            '--matrix-target', state_path,
+            '--selected-options', ','.join(self.extras),
+        ]
+        self.log_path = bdist_base + '.log'
+        start = time.time()
+        with open(self.log_path, 'wb') as log:
+            try:
+                self.returncode = subprocess.call(args, stdout=log,
+                                                  stderr=subprocess.STDOUT)
+            except OSError as err:
+                log.write(str(err).encode('utf-8'))
+                self.returncode = -1
+        self.elapsed = time.time() - start
+        try:
+            with open(state_path) as fobj:
+                self.package = json.load(fobj).get('package')
+        except (IOError, OSError, ValueError):
+            self.package = None
+        return self
+
+    def summary(self):
+        if self.ok:
+            return '{}: ok in {:.1f}s, {}'.format(
+                self.spec, self.elapsed, self.package)
+        return '{}: failed with exit code {} in {:.1f}s, see {}'.format(
+            self.spec, self.returncode, self.elapsed, self.log_path)
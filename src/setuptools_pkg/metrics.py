@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import contextlib
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+__all__ = (
+    'Metrics',
+    'Phase',
+)
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def process_peak_rss():
+    """Returns peak resident set size of the process in bytes."""
+    if resource is None:  # pragma: no cover
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It's in bytes on macOS and in kilobytes everywhere else.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def reset_peak_rss():
+    """Resets peak resident set size to the current one, so the peak of
+    what follows is measured on its own. Only Linux 4.0+ can do that,
+    elsewhere it's a no-op which returns ``False``."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fobj:
+            fobj.write('5')
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def peak_rss():
+    """Returns peak resident set size in bytes since the last
+    :func:`reset_peak_rss`, or since the process start if it wasn't
+    possible."""
+    try:
+        with open('/proc/self/status') as fobj:
+            for line in fobj:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return process_peak_rss()
+
+
+def max_rss(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+class Phase(object):
+    """Wall time, CPU time and peak RSS of a single build phase, along with
+    the number of files and bytes it has processed, if it's known.
+
+    Peak RSS is the phase's own where :func:`reset_peak_rss` works, that
+    is on Linux. Elsewhere it's the peak of the process by the end of the
+    phase, which earlier phases may have set.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss = None
+        self.files = None
+        self.bytes = None
+        self.bytes_out = None
+
+    def __repr__(self):
+        return '<Phase {}>'.format(self.name)
+
+    def start(self):
+        self.wall_time = -clock()
+        self.cpu_time = -cpu_time()
+
+    def stop(self):
+        self.wall_time += clock()
+        self.cpu_time += cpu_time()
+        self.peak_rss = max_rss(self.peak_rss, peak_rss())
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_rss': self.peak_rss,
+            'files': self.files,
+            'bytes': self.bytes,
+            'bytes_out': self.bytes_out,
+        }
+
+
+class Metrics(object):
+    """Phases of a single `bdist_pkg` run, in order they took place."""
+
+    def __init__(self):
+        self.phases = []
+        self.running = []
+        self.started = time.time()
+        self.peak_rss = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self.carry_peak_rss()
+        reset_peak_rss()
+        phase = Phase(name)
+        self.running.append(phase)
+        phase.start()
+        try:
+            yield phase
+        finally:
+            self.carry_peak_rss()
+            self.running.remove(phase)
+            phase.stop()
+            self.phases.append(phase)
+
+    def carry_peak_rss(self):
+        # Peak RSS is reset when a phase starts, so the peak so far is
+        # kept for the whole run and the phases which are still running.
+        rss = peak_rss()
+        for phase in self.running:
+            phase.peak_rss = max_rss(phase.peak_rss, rss)
+        self.peak_rss = max_rss(self.peak_rss, rss)
+
+    def as_dict(self):
+        return {
+            'started': self.started,
+            'wall_time': sum(phase.wall_time for phase in self.phases),
+            'cpu_time': sum(phase.cpu_time for phase in self.phases),
+            'peak_rss': max_rss(self.peak_rss, peak_rss(),
+                                process_peak_rss()),
+            'phases': [phase.as_dict() for phase in self.phases],
+        }
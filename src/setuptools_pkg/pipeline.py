@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import collections
+import threading
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock
+
+__all__ = (
+    'Pipeline',
+    'PipelineAborted',
+    'Stage',
+)
+
+
+#: Marks the end of the channel.
+END = object()
+
+
+class PipelineAborted(Exception):
+    """Raised in stages which are still running when another one failed."""
+
+
+class Stage(object):
+    """Single stage of :class:`Pipeline`.
+
+    `func` gets an iterable of the previous stage items, or the pipeline
+    source for the first one, and returns an iterable of items for the next
+    stage. Items are sized by `sizeof` to keep buffered bytes bounded.
+    """
+
+    def __init__(self, name, func, sizeof=len):
+        self.name = name
+        self.func = func
+        self.sizeof = sizeof
+
+
+class StageStats(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        #: Time spent to make items, including waiting for input.
+        self.total_time = 0
+        self.wait_time = 0
+        self.blocked_time = 0
+
+    @property
+    def busy_time(self):
+        return max(self.total_time - self.wait_time, 0)
+
+    def as_dict(self, wall_time):
+        return {
+            'name': self.name,
+            'items': self.items,
+            'bytes': self.bytes,
+            'busy_time': self.busy_time,
+            'wait_time': self.wait_time,
+            'blocked_time': self.blocked_time,
+            'utilization': self.busy_time / wall_time if wall_time else None,
+        }
+
+
+class Channel(object):
+    """Bounded queue between two stages. All channels of the pipeline share
+    its lock and its limit of buffered bytes.
+
+    Empty channel always accepts an item, so every consumer has something
+    to work on and the pipeline can't deadlock, no matter how big items
+    are. Thus the limit may be exceeded by one item per channel.
+    """
+
+    def __init__(self, pipeline, depth):
+        self.pipeline = pipeline
+        self.depth = depth
+        self.items = collections.deque()
+
+    def put(self, item, size):
+        pipeline = self.pipeline
+        with pipeline.cond:
+            while not pipeline.aborted and self.items and (
+                    len(self.items) >= self.depth or
+                    pipeline.buffered + size > pipeline.buffer_size):
+                pipeline.cond.wait()
+            if pipeline.aborted:
+                raise PipelineAborted
+            self.items.append((item, size))
+            pipeline.buffered += size
+            pipeline.peak_buffered = max(pipeline.peak_buffered,
+                                         pipeline.buffered)
+            pipeline.cond.notify_all()
+
+    def close(self):
+        with self.pipeline.cond:
+            self.items.append((END, 0))
+            self.pipeline.cond.notify_all()
+
+    def __iter__(self):
+        pipeline = self.pipeline
+        while True:
+            with pipeline.cond:
+                while not self.items and not pipeline.aborted:
+                    pipeline.cond.wait()
+                if pipeline.aborted:
+                    raise PipelineAborted
+                item, size = self.items.popleft()
+                pipeline.buffered -= size
+                pipeline.cond.notify_all()
+            if item is END:
+                return
+            yield item
+
+
+class Pipeline(object):
+    """Chain of stages which run concurrently, each in its own thread,
+    connected by bounded channels. No more than about `buffer_size` bytes
+    are queued between stages at once.
+
+    The same stages may run sequentially as well, chained as plain
+    iterators in the calling thread. Items pass every stage in the same
+    order either way, so results don't depend on how stages were run.
+
+    Every stage gets its own stats: time it was busy, waited for input
+    or was blocked by the next stage, along with the number and size
+    of items it has passed on.
+    """
+
+    def __init__(self, stages, buffer_size, depth=256):
+        self.stages = list(stages)
+        self.buffer_size = buffer_size
+        self.depth = depth
+        self.cond = threading.Condition()
+        self.aborted = False
+        self.buffered = 0
+        self.peak_buffered = 0
+        self.wall_time = None
+        self.threaded = None
+        self.stats = [StageStats(stage.name) for stage in self.stages]
+
+    def run(self, source, threaded=True):
+        """Feeds `source` through all the stages. Items the last stage
+        returns are dropped. First failure of any stage is reraised."""
+        self.threaded = threaded
+        start = clock()
+        try:
+            if threaded:
+                self.run_threaded(source)
+            else:
+                self.run_sequential(source)
+        finally:
+            self.wall_time = clock() - start
+
+    def run_sequential(self, source):
+        items = source
+        for stage, stats in zip(self.stages, self.stats):
+            items = self.timed(stage, stats, items)
+        for _ in items:
+            pass
+
+    def timed(self, stage, stats, inputs):
+        """Wraps stage output, so time spent to make every item gets
+        counted. Time the stage spends within the previous ones is counted
+        as its waiting time."""
+        inputs = iter(inputs)
+
+        def iter_inputs():
+            while True:
+                start = clock()
+                try:
+                    item = next(inputs)
+                except StopIteration:
+                    return
+                finally:
+                    stats.wait_time += clock() - start
+                yield item
+
+        outputs = iter(stage.func(iter_inputs()))
+        while True:
+            start = clock()
+            try:
+                item = next(outputs)
+            except StopIteration:
+                return
+            finally:
+                stats.total_time += clock() - start
+            stats.items += 1
+            stats.bytes += stage.sizeof(item)
+            yield item
+
+    def run_threaded(self, source):
+        channels = [Channel(self, self.depth) for _ in self.stages[1:]]
+        errors = []
+        threads = []
+        for index, stage in enumerate(self.stages):
+            inputs = channels[index - 1] if index else source
+            output = channels[index] if index < len(channels) else None
+            thread = threading.Thread(
+                target=self.run_stage,
+                args=(stage, self.stats[index], inputs, output, errors),
+                name='pipeline-{}'.format(stage.name))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def run_stage(self, stage, stats, inputs, output, errors):
+        try:
+            for item in self.timed(stage, stats, inputs):
+                if output is None:
+                    continue
+                start = clock()
+                output.put(item, stage.sizeof(item))
+                stats.blocked_time += clock() - start
+        except PipelineAborted:
+            pass
+        except BaseException as err:
+            with self.cond:
+                errors.append(err)
+                self.aborted = True
+                self.cond.notify_all()
+        finally:
+            if output is not None:
+                output.close()
+
+    def as_dict(self):
+        return {
+            'threaded': self.threaded,
+            'wall_time': self.wall_time,
+            'buffer_size': self.buffer_size,
+            'peak_buffered': self.peak_buffered,
+            'stages': [stats.as_dict(self.wall_time) for stats in self.stats],
+        }
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+from distutils import log
+from distutils.errors import DistutilsOptionError
+
+from setuptools import Command
+
+from .archive import CHUNK_SIZE, TarStream
+from .bdist_pkg import bdist_pkg
+from .cache import stat_key
+
+__all__ = (
+    'pkg_repo',
+)
+
+
+class pkg_repo(Command):
+    description = 'create FreeBSD pkg repository catalog from dist dir'
+
+    user_options = [
+        ('dist-dir=', 'd',
+         'Directory with packages to make repository of.'),
+        ('force', 'f',
+         'Read all the packages, even unchanged since the last run.'),
+        ('format=', None,
+         'Format of the catalog archives. It can be one of txz, tbz, tgz,'
+         ' tzst or tar. Default: txz'),
+    ]
+    boolean_options = ('force',)
+
+    pkg_formats = ('txz', 'tbz', 'tgz', 'tzst', 'tar')
+
+    #: Repository meta file format version.
+    meta_version = 2
+
+    #: Catalog state file, which keeps package manifests and checksums
+    #: between runs.
+    state_filename = '.pkg_repo.json'
+
+    def initialize_options(self):
+        self.dist_dir = None
+        self.force = False
+        self.format = None
+
+    def finalize_options(self):
+        self.set_undefined_options('bdist', ('dist_dir', 'dist_dir'))
+        self.ensure_string('format', 'txz')
+        if self.format not in self.pkg_formats:
+            raise DistutilsOptionError('format must be one of {}, got {!r}'
+                                       ''.format(', '.join(self.pkg_formats),
+                                                 self.format))
+        compressor = bdist_pkg.compressor_for_format.get(self.format)
+        if compressor is not None and not compressor.available:
+            raise DistutilsOptionError(
+                'Format {} requires {} package to be installed'
+                ''.format(self.format, compressor.requirement)
+            )
+
+    def run(self):
+        if not os.path.isdir(self.dist_dir):
+            raise DistutilsOptionError('{} is not a directory'
+                                       ''.format(self.dist_dir))
+        entries = self.update_catalog()
+        self.make_catalog(entries)
+
+    def update_catalog(self):
+        """Returns catalog entries of all packages in dist dir. Packages
+        which size, mtime and inode are the same as on previous run are not
+        read again."""
+        state = {} if self.force else self.load_state()
+        entries = {}
+        updated = 0
+        for path, repopath in self.iter_packages():
+            st = os.stat(path)
+            entry = state.get(repopath)
+            if entry is None or entry['stat'] != stat_key(st):
+                entry = {'stat': stat_key(st),
+                         'manifest': self.read_package(path, repopath, st)}
+                updated += 1
+            entries[repopath] = entry
+        log.info('%d packages in catalog, %d updated, %d removed',
+                 len(entries), updated, len(set(state) - set(entries)))
+        self.save_state(entries)
+        return entries
+
+    def iter_packages(self):
+        catalog_names = {'meta', 'packagesite', 'digests'}
+        for root, dirs, files in os.walk(self.dist_dir):
+            dirs.sort()
+            for name in sorted(files):
+                base, _, ext = name.rpartition('.')
+                if ext not in self.pkg_formats or base in catalog_names:
+                    continue
+                path = os.path.join(root, name)
+                repopath = os.path.relpath(path, self.dist_dir)
+                yield path, repopath.replace(os.sep, '/')
+
+    def read_package(self, path, repopath, st):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as fobj:
+            for chunk in iter(lambda: fobj.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        manifest = self.read_compact_manifest(path)
+        manifest.update({
+            'path': repopath,
+            'pkgsize': st.st_size,
+            'repopath': repopath,
+            'sum': hasher.hexdigest(),
+        })
+        return manifest
+
+    def read_compact_manifest(self, path):
+        # Manifests are the first archive members, so there is no need
+        # to decompress the rest of package.
+        compressor = self.get_compressor(path)
+        if compressor is None:
+            fobj = open(path, 'rb')
+        else:
+            fobj = compressor.open_reader(path)
+        with fobj, tarfile.open(fileobj=fobj, mode='r|') as tar:
+            for tarinfo in tar:
+                if tarinfo.name == '+COMPACT_MANIFEST':
+                    return json.loads(tar.extractfile(tarinfo).read()
+                                      .decode('utf-8'))
+        raise DistutilsOptionError('{} has no +COMPACT_MANIFEST'
+                                   ''.format(path))
+
+    def get_compressor(self, path):
+        compressor = bdist_pkg.compressor_for_format.get(
+            path.rpartition('.')[2])
+        if compressor is not None and not compressor.available:
+            raise DistutilsOptionError(
+                'Reading {} requires {} package to be installed'
+                ''.format(path, compressor.requirement)
+            )
+        return compressor
+
+    def load_state(self):
+        path = os.path.join(self.dist_dir, self.state_filename)
+        try:
+            with open(path) as fobj:
+                return json.load(fobj)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_state(self, entries):
+        path = os.path.join(self.dist_dir, self.state_filename)
+        with open(path + '.tmp', 'w') as fobj:
+            json.dump(entries, fobj, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def make_catalog(self, entries):
+        packagesite = io.BytesIO()
+        digests = []
+        for repopath in sorted(entries):
+            manifest = entries[repopath]['manifest']
+            line = json.dumps(manifest, sort_keys=True).encode('utf-8')
+            digests.append('{}:{}:{}:0:{}:0'.format(
+                manifest.get('origin', ''),
+                hashlib.sha256(line).hexdigest(),
+                packagesite.tell(),
+                len(line),
+            ))
+            packagesite.write(line + b'\n')
+        digests.sort()
+
+        meta = self.make_meta()
+        self.make_catalog_archive('meta', meta)
+        with open(os.path.join(self.dist_dir, 'meta.conf'), 'wb') as fobj:
+            fobj.write(meta)
+        self.make_catalog_archive('packagesite', packagesite.getvalue(),
+                                  'packagesite.yaml')
+        self.make_catalog_archive('digests', ''.join(
+            line + '\n' for line in digests).encode('utf-8'))
+
+    def make_meta(self):
+        return ''.join('{} = {};\n'.format(key, json.dumps(value))
+                       for key, value in (
+                           ('version', self.meta_version),
+                           ('packing_format', self.format),
+                           ('manifests', 'packagesite.yaml'),
+                           ('manifests_archive', 'packagesite'),
+                           ('digests', 'digests'),
+                           ('digests_archive', 'digests'),
+                       )).encode('utf-8')
+
+    def make_catalog_archive(self, name, data, member_name=None):
+        path = os.path.join(self.dist_dir, '{}.{}'.format(name, self.format))
+        tarinfo = tarfile.TarInfo(member_name or name)
+        tarinfo.size = len(data)
+        tarinfo.mode = 0o644
+        tarinfo.mtime = int(time.time())
+        compressor = bdist_pkg.compressor_for_format.get(self.format)
+        if compressor is None:
+            fobj = open(path, 'wb')
+        else:
+            fobj = compressor.open(path)
+        with fobj:
+            tar = TarStream(fobj)
+            tar.addfile(tarinfo, io.BytesIO(data))
+            tar.close()
+        return path
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import os
+import stat
+import subprocess
+from distutils.errors import DistutilsExecError
+
+__all__ = (
+    'is_elf',
+    'strip_file',
+)
+
+
+ELF_MAGIC = b'\x7fELF'
+
+
+def is_elf(path, st):
+    """Tells if `path` is ELF object. Only shared objects and executables
+    are looked into, so most files are never opened."""
+    if not stat.S_ISREG(st.st_mode) or st.st_size < len(ELF_MAGIC):
+        return False
+    name = os.path.basename(path)
+    if not (name.endswith('.so') or '.so.' in name or st.st_mode & 0o111):
+        return False
+    with open(path, 'rb') as fobj:
+        return fobj.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+
+def run_tool(args):
+    try:
+        subprocess.check_call(args)
+    except OSError as err:
+        raise DistutilsExecError('unable to run {}: {}'.format(args[0], err))
+    except subprocess.CalledProcessError as err:
+        raise DistutilsExecError('{} failed with exit code {}'
+                                 ''.format(' '.join(args), err.returncode))
+
+
+def strip_file(path, strip_command, objcopy=None, debug_path=None):
+    """Strips `path` with `strip_command`, a list of the tool and its
+    arguments. With `debug_path` debug info is copied there by `objcopy`
+    first and the stripped file gets a link to it.
+
+    Returns sizes of the file before and after stripping.
+    """
+    size = os.path.getsize(path)
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    # Installed extensions may be read-only.
+    os.chmod(path, mode | stat.S_IWUSR)
+    try:
+        if debug_path is not None:
+            if not os.path.isdir(os.path.dirname(debug_path)):
+                os.makedirs(os.path.dirname(debug_path))
+            run_tool([objcopy, '--only-keep-debug', path, debug_path])
+        run_tool(list(strip_command) + [path])
+        if debug_path is not None:
+            run_tool([objcopy, '--add-gnu-debuglink=' + debug_path, path])
+    finally:
+        os.chmod(path, mode)
+    return size, os.path.getsize(path)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import collections
+
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:  # pragma: no cover
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
+__all__ = (
+    'ProcessPoolExecutor',
+    'ThreadPoolExecutor',
+    'imap_ordered',
+)
+
+
+def imap_ordered(executor, func, iterable, window):
+    """Like :meth:`Executor.map`, but never keeps more than `window` items
+    in flight, so it's safe to use with huge or lazy iterables.
+
+    Yields `(item, result)` pairs in the order of `iterable`.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append((item, executor.submit(func, *item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
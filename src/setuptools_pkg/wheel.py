@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import base64
+import binascii
+import csv
+import email.parser
+import hashlib
+import io
+import os
+import stat
+import sys
+import sysconfig
+import time
+import zipfile
+
+try:
+    from configparser import RawConfigParser
+except ImportError:  # pragma: no cover
+    from ConfigParser import RawConfigParser
+
+from pkg_resources import Requirement
+
+from .inventory import InstallFile
+
+__all__ = (
+    'WheelInventory',
+    'WheelMember',
+    'read_metadata',
+)
+
+
+SCRIPT_TEMPLATE = '''#!{python}
+# -*- coding: utf-8 -*-
+import re
+import sys
+
+from {module} import {attr}
+
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw?|\\.exe)?$', '', sys.argv[0])
+    sys.exit({func}())
+'''
+
+
+class WheelMember(InstallFile):
+    """Install file which content is read right from the wheel or, for
+    those which pip generates or rewrites on install, from memory."""
+
+    __slots__ = ('zipfile', 'member', 'data', 'known_digest')
+
+    def __init__(self, path, install_path, st, zipfile=None, member=None,
+                 data=None, known_digest=None):
+        super(WheelMember, self).__init__(path, install_path, st)
+        self.zipfile = zipfile
+        self.member = member
+        self.data = data
+        self.known_digest = known_digest
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return self.zipfile.open(self.member)
+
+
+class WheelInventory(object):
+    """All the files of the wheel as if it was installed into `prefix`,
+    without installing it anywhere.
+
+    Members are mapped to install paths the same way pip does for
+    the `posix_prefix` scheme: purelib and platlib go to site-packages,
+    `.data/scripts` to bin with their shebangs fixed, `.data/headers`
+    to include and `.data/data` to prefix itself. Console and GUI scripts
+    are generated and RECORD is rewritten for install paths. Digests are
+    taken from the wheel RECORD, so content is read only while it's
+    archived.
+    """
+
+    def __init__(self, root, prefix, python=None, path_filter=None):
+        self.root = root
+        self.prefix = prefix
+        self.python = python or sys.executable
+        self.path_filter = path_filter or None
+        self.files = []
+        #: Install directory path to (real path, stat) mapping.
+        self.dirs = {}
+        self.zipfile = zipfile.ZipFile(root)
+        self.mtime = int(os.stat(root).st_mtime)
+        self.scan()
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def flatsize(self):
+        return sum(item.stat.st_size for item in self.files)
+
+    def get_paths(self, name):
+        paths = sysconfig.get_paths('posix_prefix', vars={
+            'base': self.prefix,
+            'platbase': self.prefix,
+            'installed_base': self.prefix,
+            'installed_platbase': self.prefix,
+        })
+        lib64, lib = self.prefix + '/lib64/', self.prefix + '/lib/'
+        return {
+            'purelib': paths['purelib'],
+            'platlib': paths['platlib'].replace(lib64, lib),
+            'scripts': paths['scripts'],
+            'headers': paths['include'] + '/' + name,
+            'data': paths['data'],
+        }
+
+    def scan(self):
+        if self.path_filter is not None:
+            self.path_filter.reset()
+        dist_info = find_dist_info(self.zipfile)
+        project = dist_info[:-len('.dist-info')].rsplit('-', 1)[0]
+        data_dir = dist_info[:-len('.dist-info')] + '.data/'
+        paths = self.get_paths(project)
+        site_dir = paths['purelib']
+        record_name = dist_info + '/RECORD'
+        record = self.read_record(record_name)
+
+        members = {}
+        for info in self.zipfile.infolist():
+            name = info.filename
+            if name.endswith('/') or name == record_name:
+                continue
+            if name.startswith(data_dir):
+                scheme, _, rest = name[len(data_dir):].partition('/')
+                if scheme not in paths:
+                    raise ValueError('{} has unknown {} data directory'
+                                     ''.format(self.root, scheme))
+                install_path = paths[scheme] + '/' + rest
+            else:
+                install_path = site_dir + '/' + name
+                scheme = None
+            if (self.path_filter is not None and not self.path_filter.keep(
+                    install_path, info.file_size)):
+                continue
+            members[install_path] = self.make_member(
+                info, install_path, record.get(name), scheme == 'scripts')
+
+        for install_path, data in self.iter_entry_point_scripts(
+                dist_info, paths['scripts']):
+            members[install_path] = self.make_data_member(install_path,
+                                                          data, 0o755)
+
+        record_path = site_dir + '/' + record_name
+        members[record_path] = self.make_data_member(
+            record_path, self.make_record(members, site_dir, record_path))
+
+        for install_path in sorted(members):
+            self.files.append(members[install_path])
+            dir_path = os.path.dirname(install_path)
+            if dir_path not in self.dirs:
+                self.dirs[dir_path] = (self.root, self.make_stat(
+                    stat.S_IFDIR | 0o755, 0, self.mtime))
+
+    def read_record(self, name):
+        """Returns member name to hex SHA-256 digest mapping of RECORD.
+        Entries with any other hash are left out."""
+        digests = {}
+        data = self.zipfile.read(name).decode('utf-8')
+        for row in csv.reader(data.splitlines()):
+            if len(row) < 2 or not row[1].startswith('sha256='):
+                continue
+            value = row[1][len('sha256='):]
+            digest = base64.urlsafe_b64decode(
+                (value + '=' * (-len(value) % 4)).encode('ascii'))
+            digests[row[0]] = binascii.hexlify(digest).decode('ascii')
+        return digests
+
+    def make_member(self, info, install_path, digest, is_script):
+        path = self.root + '!' + info.filename
+        mode = (info.external_attr >> 16) & 0o7777 or 0o644
+        mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+        data = None
+        if is_script:
+            mode |= 0o755
+            with self.zipfile.open(info) as fobj:
+                # Same as pip does, placeholder shebang line is replaced
+                # with the interpreter one.
+                if fobj.readline().startswith(b'#!python'):
+                    data = (b'#!' + self.python.encode('utf-8') + b'\n' +
+                            fobj.read())
+        if data is None and digest is None:
+            # Members without SHA-256 in RECORD are rare, so they are just
+            # hashed here.
+            digest = hashlib.sha256(self.zipfile.read(info)).hexdigest()
+        if data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+        size = info.file_size if data is None else len(data)
+        return WheelMember(path, install_path,
+                           self.make_stat(stat.S_IFREG | mode, size, mtime),
+                           zipfile=self.zipfile, member=info.filename,
+                           data=data, known_digest=digest)
+
+    def make_data_member(self, install_path, data, mode=0o644):
+        return WheelMember(self.root + '!' + install_path, install_path,
+                           self.make_stat(stat.S_IFREG | mode, len(data),
+                                          self.mtime),
+                           data=data,
+                           known_digest=hashlib.sha256(data).hexdigest())
+
+    def make_stat(self, mode, size, mtime):
+        return os.stat_result((mode, 0, 0, 1, 0, 0, size,
+                               mtime, mtime, mtime))
+
+    def iter_entry_point_scripts(self, dist_info, scripts_dir):
+        try:
+            data = self.zipfile.read(dist_info + '/entry_points.txt')
+        except KeyError:
+            return
+        parser = RawConfigParser()
+        parser.optionxform = str
+        if hasattr(parser, 'read_string'):
+            parser.read_string(data.decode('utf-8'))
+        else:  # pragma: no cover
+            parser.readfp(io.StringIO(data.decode('utf-8')))
+        for section in ('console_scripts', 'gui_scripts'):
+            if not parser.has_section(section):
+                continue
+            for name, value in sorted(parser.items(section)):
+                module, _, func = value.split('[')[0].strip().partition(':')
+                attr = func.split('.')[0]
+                script = SCRIPT_TEMPLATE.format(python=self.python,
+                                                module=module.strip(),
+                                                attr=attr.strip(),
+                                                func=func.strip())
+                yield scripts_dir + '/' + name, script.encode('utf-8')
+
+    def make_record(self, members, site_dir, record_path):
+        """Makes RECORD of installed distribution, with paths relative
+        to site-packages as pip writes it."""
+        output = io.StringIO() if sys.version_info[0] > 2 else io.BytesIO()
+        writer = csv.writer(output, lineterminator='\n')
+        for install_path in sorted(members):
+            item = members[install_path]
+            digest = base64.urlsafe_b64encode(
+                binascii.unhexlify(item.known_digest)).rstrip(b'=')
+            writer.writerow([os.path.relpath(install_path, site_dir),
+                             'sha256=' + digest.decode('ascii'),
+                             str(item.stat.st_size)])
+        writer.writerow([os.path.relpath(record_path, site_dir), '', ''])
+        return output.getvalue().encode('utf-8')
+
+
+def find_dist_info(zf):
+    for name in zf.namelist():
+        top = name.split('/')[0]
+        if top.endswith('.dist-info'):
+            return top
+    raise ValueError('{} has no .dist-info directory'.format(zf.filename))
+
+
+def read_metadata(path):
+    """Returns keyword arguments for :class:`setuptools.Distribution` made
+    of the wheel METADATA, along with `root_is_purelib` flag of it.
+    Requirements, which environment markers don't match the running
+    interpreter, are left out."""
+    with zipfile.ZipFile(path) as zf:
+        dist_info = find_dist_info(zf)
+        msg = email.parser.Parser().parsestr(
+            zf.read(dist_info + '/METADATA').decode('utf-8'))
+        wheel = email.parser.Parser().parsestr(
+            zf.read(dist_info + '/WHEEL').decode('utf-8'))
+    extras = msg.get_all('Provides-Extra') or []
+    install_requires = []
+    extras_require = {extra: [] for extra in extras}
+    for spec in msg.get_all('Requires-Dist') or []:
+        requirement = Requirement.parse(spec)
+        marker = requirement.marker
+        requirement.marker = None
+        item = str(requirement)
+        if marker is None or marker.evaluate({'extra': ''}):
+            install_requires.append(item)
+            continue
+        for extra in extras:
+            if marker.evaluate({'extra': extra}):
+                extras_require[extra].append(item)
+    attrs = {
+        'name': msg['Name'],
+        'version': msg['Version'],
+        'description': msg['Summary'],
+        'long_description': msg.get_payload() or msg['Description'],
+        'license': msg['License'] or msg['License-Expression'],
+        'author': msg['Author'],
+        'author_email': msg['Author-email'],
+        'maintainer': msg['Maintainer'],
+        'maintainer_email': msg['Maintainer-email'],
+        'url': msg['Home-page'],
+        'keywords': msg['Keywords'],
+        'classifiers': msg.get_all('Classifier'),
+        'install_requires': install_requires,
+        'extras_require': extras_require,
+    }
+    attrs = {key: value for key, value in attrs.items() if value}
+    attrs['root_is_purelib'] = (
+        (wheel['Root-Is-Purelib'] or 'true').strip().lower() == 'true')
+    return attrs
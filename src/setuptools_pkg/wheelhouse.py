@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import collections
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import zipfile
+from distutils import log
+from distutils.errors import DistutilsExecError, DistutilsOptionError
+
+from pkg_resources import Requirement, safe_name
+from setuptools import Command, Distribution
+
+from .bdist_pkg import bdist_pkg
+from .utils import ProcessPoolExecutor
+from .wheel import read_metadata
+
+__all__ = (
+    'WheelDistribution',
+    'convert_wheel',
+    'pkg_wheelhouse',
+)
+
+
+class WheelDistribution(Distribution):
+    """Distribution of the prebuilt wheel, made of its metadata."""
+
+    def __init__(self, attrs):
+        attrs = dict(attrs)
+        self.root_is_purelib = attrs.pop('root_is_purelib', True)
+        Distribution.__init__(self, attrs)
+
+    def is_pure(self):
+        return self.root_is_purelib
+
+
+def convert_wheel(path, attrs, options):
+    """Makes package of the wheel at `path`, which metadata is `attrs`,
+    with `options` of :class:`~setuptools_pkg.bdist_pkg.bdist_pkg` set.
+
+    Returns `(package path, error, elapsed seconds)`. Any failure is
+    returned as the error, rather than raised, so it never stops others.
+    """
+    start = time.time()
+    try:
+        cmd = bdist_pkg(WheelDistribution(attrs))
+        for name, value in options.items():
+            setattr(cmd, name, value)
+        cmd.ensure_finalized()
+        cmd.wheel_path = path
+        cmd.run()
+        package = os.path.join(cmd.dist_dir, '{}-{}.{}'.format(
+            cmd.name, cmd.version, cmd.format))
+        return package, None, time.time() - start
+    except Exception:
+        return None, traceback.format_exc(), time.time() - start
+
+
+class pkg_wheelhouse(Command):
+    description = 'create FreeBSD pkg packages of prebuilt wheels'
+
+    user_options = [
+        ('bdist-base=', 'b',
+         'Base directory for creating built distributions.'),
+        ('dist-dir=', 'd',
+         'Directory to put packages in.'),
+        ('format=', 'f',
+         'Format of the packages. It can be one of txz, tbz, tgz, tzst or'
+         ' tar. Default: tgz'),
+        ('jobs=', 'j',
+         'Number of wheels to convert at once, each in its own process.'
+         ' Default: number of CPUs'),
+        ('prefix=', None,
+         'The path where the package files are installed. Default:'
+         ' /usr/local'),
+        ('use-pypi-deps', None,
+         'Convert requirements which no wheel of the wheelhouse satisfies'
+         ' to py{}{}- packages, resolved on PyPI.'
+         ''.format(*sys.version_info[:2])),
+        ('wheel-dir=', 'w',
+         'Directory with wheels to make packages of.'),
+        ('with-py-prefix', None,
+         'Prepends py{}{}- prefix to package names.'
+         ''.format(*sys.version_info[:2])),
+    ]
+    boolean_options = ('use-pypi-deps', 'with-py-prefix')
+
+    def initialize_options(self):
+        self.bdist_base = None
+        self.dist_dir = None
+        self.format = None
+        self.jobs = None
+        self.prefix = None
+        self.use_pypi_deps = False
+        self.wheel_dir = None
+        self.with_py_prefix = False
+
+    def finalize_options(self):
+        self.set_undefined_options('bdist', ('bdist_base', 'bdist_base'))
+        self.set_undefined_options('bdist', ('dist_dir', 'dist_dir'))
+        if self.wheel_dir is None:
+            raise DistutilsOptionError('wheel_dir must be set')
+        self.ensure_string('format', 'tgz')
+        self.ensure_string('prefix', '/usr/local')
+        if self.jobs is None:
+            self.jobs = multiprocessing.cpu_count()
+        try:
+            self.jobs = int(self.jobs)
+        except ValueError:
+            raise DistutilsOptionError('jobs must be an integer, got {!r}'
+                                       ''.format(self.jobs))
+        if self.jobs < 1:
+            raise DistutilsOptionError('jobs must be positive, got {}'
+                                       ''.format(self.jobs))
+
+    def run(self):
+        if not os.path.isdir(self.wheel_dir):
+            raise DistutilsOptionError('{} is not a directory'
+                                       ''.format(self.wheel_dir))
+        wheels, failed = self.read_wheelhouse()
+        total = len(wheels) + len(failed)
+        results = self.convert_wheels(wheels)
+        for path, (package, error, elapsed) in zip(wheels, results):
+            if error is None:
+                log.info('%s: %s in %.1fs', os.path.basename(path), package,
+                         elapsed)
+            else:
+                failed.append(os.path.basename(path))
+                log.error('%s: failed in %.1fs\n%s', os.path.basename(path),
+                          elapsed, error)
+        log.info('%d of %d wheels converted', total - len(failed), total)
+        if failed:
+            raise DistutilsExecError('Unable to convert: {}'
+                                     ''.format(', '.join(sorted(failed))))
+
+    def read_wheelhouse(self):
+        """Returns wheel path to metadata mapping of all the wheels along
+        with names of ones which metadata is broken. Metadata is read here,
+        rather than by workers, since every wheel needs metadata of others
+        to map its requirements."""
+        wheels = collections.OrderedDict()
+        failed = []
+        for name in sorted(os.listdir(self.wheel_dir)):
+            if not name.endswith('.whl'):
+                continue
+            path = os.path.join(self.wheel_dir, name)
+            try:
+                wheels[path] = read_metadata(path)
+            except (EnvironmentError, KeyError, ValueError,
+                    zipfile.BadZipfile) as err:
+                log.error('%s: unable to read metadata: %s', name, err)
+                failed.append(name)
+        return wheels, failed
+
+    def get_requirements_mapping(self, attrs, wheels):
+        """Maps requirements of the wheel to packages of the other wheels
+        of the wheelhouse which satisfy them."""
+        projects = {}
+        for other in wheels.values():
+            projects.setdefault(safe_name(other['name']).lower(), []).append(
+                (other['name'], other['version']))
+        mapping = {}
+        for item in attrs.get('install_requires', []):
+            requirement = Requirement.parse(item)
+            for name, version in projects.get(requirement.key, []):
+                if version in requirement:
+                    mapping[item] = {
+                        'name': self.get_package_name(name),
+                        'origin': 'devel/py{}{}-{}'.format(
+                            sys.version_info[0], sys.version_info[1], name),
+                        'version': version,
+                    }
+                    break
+        return mapping
+
+    def get_package_name(self, name):
+        if self.with_py_prefix:
+            return 'py{}{}-{}'.format(sys.version_info[0],
+                                      sys.version_info[1], name)
+        return name
+
+    def get_options(self, path, attrs, wheels):
+        return {
+            'bdist_base': os.path.join(self.bdist_base, 'wheelhouse',
+                                       os.path.basename(path)),
+            'dist_dir': self.dist_dir,
+            'format': self.format,
+            'jobs': 1,
+            'prefix': self.prefix,
+            'requirements_mapping': self.get_requirements_mapping(attrs,
+                                                                  wheels),
+            'use_pypi_deps': self.use_pypi_deps,
+            'with_py_prefix': self.with_py_prefix,
+        }
+
+    def convert_wheels(self, wheels):
+        """Returns :func:`convert_wheel` results for `wheels`, in their
+        order."""
+        tasks = [(path, attrs, self.get_options(path, attrs, wheels))
+                 for path, attrs in wheels.items()]
+        if self.jobs == 1 or ProcessPoolExecutor is None or len(tasks) < 2:
+            return [convert_wheel(*task) for task in tasks]
+        with ProcessPoolExecutor(min(self.jobs, len(tasks))) as executor:
+            futures = [executor.submit(convert_wheel, *task)
+                       for task in tasks]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception:
+                    # Worker process has died along with the wheel, which
+                    # it was converting.
+                    results.append((None, traceback.format_exc(), 0))
+            return results
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import runpy
+import shutil
+import tempfile
+import unittest
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                         'benchmarks', 'bench_packaging.py')
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_smoke(self):
+        bench = runpy.run_path(BENCHMARK)
+        output = os.path.join(self.tmpdir, 'bench.json')
+        bench['main'](['--files', '10', '--repeat', '1',
+                       '--output', output])
+        with open(output) as fobj:
+            report = json.load(fobj)
+        self.assertEqual(report['tree']['files'], 10)
+        phases = {result['phase'] for result in report['results']}
+        self.assertIn('make_tar', phases)
+        self.assertIn('make_pkg', phases)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import importlib.util
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from distutils.errors import DistutilsOptionError
+
+from setuptools_pkg.bytecode import compile_file
+
+from .utils import SimpleProject
+
+
+class TestCompileFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fobj:
+            fobj.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as fobj:
+            return fobj.read()
+
+    def test_hash_based(self):
+        path = self.write('foo.py', 'assert True\nfoo = 42\n')
+        for level in (0, 1, 2):
+            cfile, cached, error = compile_file(path, '/usr/local/foo.py',
+                                                level)
+            self.assertIsNone(error)
+            self.assertFalse(cached)
+            self.assertEqual(cfile, importlib.util.cache_from_source(
+                path, optimization=level or ''))
+            data = self.read(cfile)
+            self.assertEqual(data[:4], importlib.util.MAGIC_NUMBER)
+            # Checked hash-based pyc flags.
+            self.assertEqual(struct.unpack('<I', data[4:8])[0], 0b11)
+
+    def test_reproducible(self):
+        path = self.write('foo.py', 'foo = 42\n')
+        cfile, _, _ = compile_file(path, '/usr/local/foo.py', 1)
+        data = self.read(cfile)
+        os.utime(path, (1, 1))
+        compile_file(path, '/usr/local/foo.py', 1)
+        self.assertEqual(self.read(cfile), data)
+
+    def test_cache(self):
+        path = self.write('foo.py', 'foo = 42\n')
+        cfile, cached, _ = compile_file(path, '/usr/local/foo.py', 0,
+                                        self.cache_dir)
+        self.assertFalse(cached)
+        data = self.read(cfile)
+        os.unlink(cfile)
+        cfile, cached, _ = compile_file(path, '/usr/local/foo.py', 0,
+                                        self.cache_dir)
+        self.assertTrue(cached)
+        self.assertEqual(self.read(cfile), data)
+        # Bytecode refers to the install path, so it's a different one.
+        _, cached, _ = compile_file(path, '/usr/local/bar.py', 0,
+                                    self.cache_dir)
+        self.assertFalse(cached)
+
+    def test_syntax_error(self):
+        path = self.write('foo.py', 'print "foo"\n')
+        cfile, cached, error = compile_file(path, '/usr/local/foo.py', 0,
+                                            self.cache_dir)
+        self.assertIsNone(cfile)
+        self.assertIsNotNone(error)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class TestPrecompile(SimpleProject):
+
+    def test_precompile(self):
+        self.cmd.precompile = '0,2'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.precompile, [0, 2])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.cmd.install_dir = os.path.join(tmpdir, 'root')
+            self.cmd.pyc_cache = os.path.join(tmpdir, 'cache')
+            shutil.copytree(os.path.join(os.path.dirname(__file__),
+                                         'simple_project_layout'),
+                            self.cmd.install_dir)
+            sources = [item.install_path
+                       for item in self.cmd.get_inventory()
+                       if item.install_path.endswith('.py')]
+            self.assertTrue(sources)
+            for jobs in (1, 2):
+                self.cmd.jobs = jobs
+                self.cmd.maybe_precompile()
+                manifest = self.cmd.generate_manifest_content()
+                pycs = [path for path in manifest['files']
+                        if path.endswith('.pyc')]
+                self.assertEqual(len(pycs), len(sources) * 2)
+                self.assertTrue(all('/__pycache__/' in path
+                                    for path in pycs))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_invalid_level(self):
+        self.cmd.precompile = '3'
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
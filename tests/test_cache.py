@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from setuptools_pkg.cache import DigestCache, ResolutionCache
+
+from .utils import mock
+
+
+class TestDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'digests.json')
+        self.file_path = os.path.join(self.tmpdir, 'file')
+        self.write_file(b'foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, data):
+        with open(self.file_path, 'wb') as f:
+            f.write(data)
+        return os.stat(self.file_path)
+
+    def test_hit(self):
+        cache = DigestCache(self.path)
+        st = os.stat(self.file_path)
+        self.assertIsNone(cache.get(self.file_path, st))
+        cache.set(self.file_path, st, 'abc')
+        cache.save()
+        cache = DigestCache(self.path)
+        self.assertEqual(cache.get(self.file_path, st), 'abc')
+
+    def test_miss_on_change(self):
+        cache = DigestCache(self.path)
+        cache.set(self.file_path, os.stat(self.file_path), 'abc')
+        st = self.write_file(b'foobar')
+        self.assertIsNone(cache.get(self.file_path, st))
+
+    def test_evict_stale(self):
+        cache = DigestCache(self.path)
+        st = os.stat(self.file_path)
+        cache.set(self.file_path, st, 'abc')
+        cache.set('/gone', st, 'cde')
+        cache.save()
+        cache = DigestCache(self.path)
+        cache.get(self.file_path, st)
+        cache.save()
+        with open(self.path) as f:
+            self.assertEqual(list(json.load(f)['entries']), [self.file_path])
+
+    def test_corrupted(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        cache = DigestCache(self.path)
+        self.assertIsNone(cache.get(self.file_path,
+                                    os.stat(self.file_path)))
+
+    def test_no_path(self):
+        cache = DigestCache()
+        st = os.stat(self.file_path)
+        cache.set(self.file_path, st, 'abc')
+        self.assertIsNone(cache.get(self.file_path, st))
+        cache.save()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestResolutionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache', 'deps.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hit(self):
+        cache = ResolutionCache(self.path)
+        self.assertIsNone(cache.get('foo>=1.0'))
+        cache.set('foo>=1.0', 'foo', '1.2')
+        cache.save()
+        cache = ResolutionCache(self.path)
+        self.assertEqual(cache.get('foo>=1.0'),
+                         {'key': 'foo', 'version': '1.2'})
+
+    def test_per_index(self):
+        cache = ResolutionCache(self.path, index='pypi')
+        cache.set('foo>=1.0', 'foo', '1.2')
+        cache.save()
+        cache = ResolutionCache(self.path, index='file:///mirror')
+        self.assertIsNone(cache.get('foo>=1.0'))
+        cache.set('foo>=1.0', 'foo', '1.1')
+        cache.save()
+        cache = ResolutionCache(self.path, index='pypi')
+        self.assertEqual(cache.get('foo>=1.0'),
+                         {'key': 'foo', 'version': '1.2'})
+
+    def test_expired(self):
+        cache = ResolutionCache(self.path, ttl=60)
+        cache.set('foo>=1.0', 'foo', '1.2')
+        with mock.patch('time.time', return_value=time.time() + 60):
+            self.assertIsNone(cache.get('foo>=1.0'))
+            cache.save()
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)['entries'], {})
+
+    def test_evict_oldest(self):
+        cache = ResolutionCache(self.path, max_entries=2)
+        now = time.time()
+        for offset, item in enumerate(['foo', 'bar', 'baz']):
+            with mock.patch('time.time', return_value=now + offset):
+                cache.set(item, item, '1.0')
+        cache.save()
+        with open(self.path) as f:
+            self.assertEqual(sorted(json.load(f)['entries']), ['bar', 'baz'])
+
+    def test_corrupted(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{')
+        cache = ResolutionCache(self.path)
+        self.assertIsNone(cache.get('foo'))
+
+    def test_no_path(self):
+        cache = ResolutionCache()
+        cache.set('foo', 'foo', '1.0')
+        self.assertIsNone(cache.get('foo'))
+        cache.save()
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from setuptools_pkg.bdist_pkg import lzma, zstandard
+from setuptools_pkg.compression import (Compressor, DeferredWriter,
+                                        ParallelXZFile, XZCompressor,
+                                        ZstdCompressor)
+
+from .utils import mock
+
+
+@unittest.skipIf(lzma is None, 'lzma is not available')
+class TestParallelXZFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'data.xz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        with lzma.open(self.path) as f:
+            return f.read()
+
+    def test_multiple_blocks(self):
+        data = os.urandom(1000) * 100
+        with ParallelXZFile(self.path, lzma, 4, block_size=4096) as f:
+            for idx in range(0, len(data), 1500):
+                f.write(data[idx:idx + 1500])
+        self.assertEqual(self.read(), data)
+
+    def test_empty(self):
+        with ParallelXZFile(self.path, lzma, 2):
+            pass
+        self.assertEqual(self.read(), b'')
+
+    def test_single_job_uses_lzma(self):
+        compressor = XZCompressor(lzma)
+        with compressor.open(self.path, jobs=1) as f:
+            self.assertNotIsInstance(f, ParallelXZFile)
+        with compressor.open(self.path, jobs=2) as f:
+            self.assertIsInstance(f, ParallelXZFile)
+        with compressor.open(self.path, jobs=1, reproducible=True) as f:
+            self.assertIsInstance(f, ParallelXZFile)
+
+
+class TestDeferredWriter(unittest.TestCase):
+
+    def test_sample(self):
+        for sample_size, data in ((4, b'abcdefgh'), (100, b'abc'), (0, b'')):
+            fobj = io.BytesIO()
+            opener = mock.Mock(return_value=fobj)
+            writer = DeferredWriter(opener, sample_size)
+            for idx in range(len(data)):
+                writer.write(data[idx:idx + 1])
+            fobj.close = mock.Mock()
+            writer.close()
+            opener.assert_called_once_with(data[:sample_size])
+            self.assertEqual(fobj.getvalue(), data)
+            self.assertTrue(fobj.close.called)
+
+
+class TestZstdCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'data.zst')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_level_and_threads(self):
+        module = mock.Mock()
+        compressor = ZstdCompressor(module)
+        compressor.open(self.path, level=19, jobs=8)
+        module.ZstdCompressor.assert_called_once_with(level=19, threads=8)
+
+    def test_defaults(self):
+        module = mock.Mock()
+        compressor = ZstdCompressor(module)
+        compressor.open(self.path)
+        module.ZstdCompressor.assert_called_once_with(level=3, threads=0)
+
+    def test_reproducible(self):
+        module = mock.Mock()
+        compressor = ZstdCompressor(module)
+        compressor.open(self.path, reproducible=True)
+        module.ZstdCompressor.assert_called_once_with(level=3, threads=1)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not available')
+    def test_roundtrip(self):
+        data = os.urandom(1000) * 100
+        with ZstdCompressor(zstandard).open(self.path, jobs=2) as f:
+            f.write(data)
+        with open(self.path, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            self.assertEqual(reader.read(), data)
+
+
+class TestCompressionLevel(unittest.TestCase):
+
+    def test_choose_level(self):
+        compressor = Compressor(gzip)
+        sample = os.urandom(1000) * 100
+        self.assertEqual(compressor.choose_level(sample, len(sample), 1e6),
+                         9)
+        self.assertEqual(compressor.choose_level(sample, len(sample), 0), 1)
+        self.assertEqual(compressor.choose_level(b'', 100, 0), 9)
+
+    def test_choose_level_stops_over_budget(self):
+        compressor = Compressor(mock.Mock())
+        clock = mock.Mock(side_effect=[0, 1, 1, 3, 3, 6, 6, 10])
+        with mock.patch('setuptools_pkg.compression.clock', clock):
+            level = compressor.choose_level(b'x', 1, 2.5)
+        self.assertEqual(level, 2)
+        self.assertEqual(compressor.module.compress.call_count, 3)
+
+    def test_choose_level_parallel(self):
+        compressor = ZstdCompressor(mock.Mock())
+        clock = mock.Mock(side_effect=[0, 1, 1, 3])
+        with mock.patch('setuptools_pkg.compression.clock', clock):
+            level = compressor.choose_level(b'x', 4, 3, jobs=4,
+                                            levels=(1, 2))
+        self.assertEqual(level, 2)
+
+    @unittest.skipIf(lzma is None, 'lzma is not available')
+    def test_xz_limit_level(self):
+        compressor = XZCompressor(lzma)
+        self.assertEqual(compressor.limit_level(9, 1024), 9)
+        self.assertEqual(compressor.limit_level(9, 100), 6)
+        self.assertEqual(compressor.limit_level(None, 100, jobs=4), 2)
+        self.assertEqual(compressor.limit_level(6, 1), 0)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from setuptools_pkg.inventory import Inventory, PathFilter
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('usr/local/bin/foo', b'foo')
+        self.write('usr/local/lib64/python/bar.py', b'bar!')
+        self.write('usr/local/share/doc/baz.txt', b'')
+        os.symlink(os.path.join(self.root, 'usr/local/share'),
+                   os.path.join(self.root, 'usr/local/link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, path, data):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_files(self):
+        inventory = Inventory(self.root, '/usr/local')
+        self.assertEqual(sorted(item.install_path for item in inventory), [
+            '/usr/local/bin/foo',
+            '/usr/local/lib/python/bar.py',
+            '/usr/local/share/doc/baz.txt',
+        ])
+        for item in inventory:
+            self.assertEqual(item.stat.st_size, os.path.getsize(item.path))
+            self.assertIsNone(item.digest)
+        self.assertEqual(inventory.flatsize, 7)
+
+    def test_same_as_walk(self):
+        expected = []
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                expected.append(os.path.join(root, name))
+        inventory = Inventory(self.root, '/usr/local')
+        self.assertEqual(sorted(item.path for item in inventory),
+                         sorted(expected))
+
+    def test_dirs(self):
+        inventory = Inventory(self.root, '/usr/local')
+        self.assertEqual(sorted(inventory.dirs), [
+            '/usr/local/bin',
+            '/usr/local/lib/python',
+            '/usr/local/share/doc',
+        ])
+        real_path, st = inventory.dirs['/usr/local/lib/python']
+        self.assertEqual(real_path,
+                         os.path.join(self.root, 'usr/local/lib64/python'))
+
+    def test_missing_root(self):
+        inventory = Inventory(os.path.join(self.root, 'missing'), '/usr')
+        self.assertEqual(len(inventory), 0)
+        self.assertEqual(inventory.flatsize, 0)
+
+    def test_path_filter(self):
+        self.write('usr/local/share/doc/tests/test_baz.txt', b'test')
+        path_filter = PathFilter(include=['*/doc/tests/*'],
+                                 exclude=['*/doc/*', '*.py'])
+        inventory = Inventory(self.root, '/usr/local', path_filter)
+        self.assertEqual(sorted(item.install_path for item in inventory), [
+            '/usr/local/bin/foo',
+            '/usr/local/share/doc/tests/test_baz.txt',
+        ])
+        self.assertNotIn('/usr/local/lib/python', inventory.dirs)
+        self.assertEqual(path_filter.as_dict(), {
+            '*/doc/*': {'files': 1, 'bytes': 0},
+            '*.py': {'files': 1, 'bytes': 4},
+        })
+        # Counters are per walk.
+        Inventory(self.root, '/usr/local', path_filter)
+        self.assertEqual(path_filter.removed['*.py'], [1, 4])
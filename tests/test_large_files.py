@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+SCRIPT = '''
+import resource
+import sys
+
+limit = int(sys.argv[2])
+resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+import os
+
+from setuptools import Distribution
+from setuptools_pkg.archive import TarStream
+from setuptools_pkg.bdist_pkg import bdist_pkg
+from setuptools_pkg.inventory import InstallFile
+
+
+class NullWriter(object):
+
+    def write(self, data):
+        pass
+
+
+path = sys.argv[1]
+cmd = bdist_pkg(Distribution({}))
+item = InstallFile(path, '/big', os.lstat(path))
+cmd.digest_file(item)
+print('%d %s' % (item.stat.st_size, item.digest))
+item = InstallFile(path, '/big', os.lstat(path))
+cmd.archive_file(TarStream(NullWriter()), item)
+print('%d %s' % (item.stat.st_size, item.digest))
+'''
+
+
+@unittest.skipIf(resource is None, 'resource limits are not supported')
+class TestLargeFiles(unittest.TestCase):
+
+    size = 2 * 1024 ** 3
+    memory_limit = 512 * 1024 ** 2
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'big')
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash_sparse_file_with_memory_limit(self):
+        hasher = hashlib.sha256()
+        chunk = b'\0' * (1024 ** 2)
+        for _ in range(self.size // len(chunk)):
+            hasher.update(chunk)
+        expected = '{} {}'.format(self.size, hasher.hexdigest())
+
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT, self.path, str(self.memory_limit)],
+        )
+        self.assertEqual(output.decode().splitlines(), [expected, expected])
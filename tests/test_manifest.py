@@ -7,9 +7,19 @@
 # you should have received as part of this distribution.
 #
 
+import io
+import json
 import os
+import shutil
+import tempfile
+import unittest
 from distutils.errors import DistutilsOptionError
 
+from setuptools_pkg.cache import DigestCache
+from setuptools_pkg.inventory import Inventory
+from setuptools_pkg.manifest import (DirectoriesView, FilesView,
+                                     write_manifests)
+
 from .utils import EmptyProject, SimpleProject
 
 
@@ -79,6 +89,51 @@ class TestSimpleProjectManifest(SimpleProject):
             self.assertEqual(value['uname'], 'root')
             self.assertIn('sum', value)
 
+    def test_parallel_digest(self):
+        self.cmd.finalize_options()
+        self.cmd.install_dir = os.path.join(os.path.dirname(__file__),
+                                            'simple_project_layout')
+        self.cmd.bdist_dir = tempfile.mkdtemp()
+        try:
+            results = []
+            for jobs in (1, 4):
+                self.cmd.jobs = jobs
+                with tempfile.TemporaryFile() as payload:
+                    manifest = self.cmd.generate_manifest_content(payload)
+                    payload.seek(0)
+                    results.append((manifest, payload.read()))
+                self.assertEqual(manifest,
+                                 self.cmd.generate_manifest_content())
+        finally:
+            shutil.rmtree(self.cmd.bdist_dir)
+        self.assertEqual(results[0], results[1])
+
+    def test_digest_cache(self):
+        self.cmd.finalize_options()
+        self.cmd.install_dir = os.path.join(os.path.dirname(__file__),
+                                            'simple_project_layout')
+        self.cmd.bdist_base = tempfile.mkdtemp()
+        try:
+            manifest = self.cmd.generate_manifest_content()
+            cache = DigestCache(os.path.join(self.cmd.bdist_base,
+                                             'pkg-digests.json'))
+            self.assertEqual(len(cache.entries), len(manifest['files']))
+            for path in cache.entries:
+                cache.entries[path][3] = 'cached'
+            cache.seen.update(cache.entries)
+            cache.save()
+
+            manifest = self.cmd.generate_manifest_content()
+            self.assertEqual({value['sum'] for value
+                              in manifest['files'].values()}, {'cached'})
+
+            self.cmd.no_digest_cache = True
+            manifest = self.cmd.generate_manifest_content()
+            self.assertNotIn('cached', {value['sum'] for value
+                                        in manifest['files'].values()})
+        finally:
+            shutil.rmtree(self.cmd.bdist_base)
+
     def test_require_project_name(self):
         self.cmd.finalize_options()
         self.cmd.name = None
@@ -108,3 +163,90 @@ class TestSimpleProjectManifest(SimpleProject):
         self.cmd.maintainer = None
         with self.assertRaises(DistutilsOptionError):
             self.cmd.generate_manifest_content()
+
+    def test_manifest_indent(self):
+        self.cmd.manifest_indent = '0'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.manifest_indent, 0)
+
+    def test_negative_manifest_indent(self):
+        self.cmd.manifest_indent = '-1'
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
+
+
+class TestWriteManifests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for path in ('a/b/c.py', 'a/d.py', 'e.py', 'a/b/f/g.py'):
+            path = os.path.join(self.tmpdir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fobj:
+                fobj.write(path)
+        self.inventory = Inventory(self.tmpdir, '/usr/local')
+        for idx, item in enumerate(self.inventory):
+            item.digest = str(idx)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_manifest(self):
+        return {
+            'deps': {'py-foo': {'origin': 'devel/py-foo', 'version': '1.0'}},
+            'directories': DirectoriesView(self.inventory),
+            'files': FilesView(self.inventory),
+            'flatsize': 42,
+            'name': 'foo',
+            'users': [],
+        }
+
+    def write(self, manifest, indent):
+        fobj, compact_fobj = io.StringIO(), io.StringIO()
+        write_manifests(manifest, fobj, compact_fobj, indent)
+        return fobj.getvalue(), compact_fobj.getvalue()
+
+    def test_same_as_json_dump(self):
+        manifest = self.make_manifest()
+        expected = dict(manifest, directories=dict(manifest['directories']),
+                        files=dict(manifest['files']))
+        self.assertEqual(set(expected['directories']),
+                         {'/', '/a', '/a/b', '/a/b/f'})
+        for indent in (2, 4):
+            content, compact = self.write(manifest, indent)
+            self.assertEqual(content, json.dumps(expected, sort_keys=True,
+                                                 indent=indent))
+            compact_expected = dict(expected)
+            del compact_expected['directories'], compact_expected['files']
+            self.assertEqual(compact, json.dumps(compact_expected,
+                                                 sort_keys=True,
+                                                 indent=indent))
+
+    def test_no_indent(self):
+        manifest = self.make_manifest()
+        content, compact = self.write(manifest, 0)
+        self.assertNotIn('\n', content)
+        self.assertNotIn(' ', compact)
+        self.assertEqual(json.loads(content)['files'], dict(manifest['files']))
+        self.assertNotIn('files', json.loads(compact))
+
+    def test_views_lookup(self):
+        files = FilesView(self.inventory)
+        self.assertIn('/a/d.py', files)
+        self.assertNotIn('/a', files)
+        self.assertEqual(files['/e.py']['perm'], '0644')
+        with self.assertRaises(KeyError):
+            files['/x.py']
+        self.assertIn(('/e.py', files['/e.py']), files.items())
+        self.assertEqual(files, dict(files.items()))
+        directories = DirectoriesView(self.inventory)
+        self.assertIn('/a/b', directories)
+        self.assertEqual(len(list(directories.values())), 4)
+
+    def test_empty_file_lists(self):
+        manifest = {'directories': {}, 'files': {}, 'name': 'foo'}
+        content, compact = self.write(manifest, 4)
+        self.assertEqual(content, json.dumps(manifest, sort_keys=True,
+                                             indent=4))
+        self.assertEqual(compact, json.dumps({'name': 'foo'}, indent=4))
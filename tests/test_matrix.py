@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from setuptools_pkg.matrix import MatrixTarget
+
+CHILD = '''
+import json, sys
+args = sys.argv[1:]
+state_path = args[args.index('--matrix-target') + 1]
+with open(state_path) as f:
+    state = json.load(f)
+state['package'] = args[args.index('--selected-options') + 1]
+with open(state_path, 'w') as f:
+    json.dump(state, f)
+print(state.get('resolved_deps'))
+sys.exit(int(args[0]))
+'''
+
+
+class TestMatrixTarget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.bdist_base = os.path.join(self.tmpdir, 'matrix', 'target')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        target = MatrixTarget('/usr/local/bin/python3.8:foo+bar')
+        self.assertEqual(target.interpreter, '/usr/local/bin/python3.8')
+        self.assertEqual(target.extras, ['bar', 'foo'])
+        self.assertEqual(target.id, 'python3.8-bar-foo')
+
+    def test_parse_no_extras(self):
+        target = MatrixTarget('python3.9')
+        self.assertEqual(target.interpreter, 'python3.9')
+        self.assertEqual(target.extras, [])
+        self.assertEqual(target.id, 'python3.9')
+
+    def test_run(self):
+        target = MatrixTarget(sys.executable + ':foo+bar')
+        state = {'resolved_deps': {'test': {'key': 'test', 'version': '1'}}}
+        target.run(['-c', CHILD, '0'], self.bdist_base, state)
+        self.assertTrue(target.ok)
+        self.assertEqual(target.package, 'bar,foo')
+        with open(target.log_path) as fobj:
+            self.assertIn("'version': '1'", fobj.read())
+        self.assertIn('ok', target.summary())
+
+    def test_run_failed(self):
+        target = MatrixTarget(sys.executable)
+        target.run(['-c', CHILD, '3'], self.bdist_base, {})
+        self.assertFalse(target.ok)
+        self.assertEqual(target.returncode, 3)
+        self.assertIn(target.log_path, target.summary())
+
+    def test_run_missing_interpreter(self):
+        target = MatrixTarget(os.path.join(self.tmpdir, 'python'))
+        target.run([], self.bdist_base, {})
+        self.assertFalse(target.ok)
+        self.assertIsNone(target.package)
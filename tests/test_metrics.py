@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import unittest
+
+from setuptools_pkg.metrics import Metrics, reset_peak_rss
+
+CAN_RESET_PEAK_RSS = reset_peak_rss()
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_phases(self):
+        metrics = Metrics()
+        with metrics.phase('walk') as phase:
+            phase.files, phase.bytes = 2, 42
+        with metrics.phase('hash'):
+            sum(range(100000))
+        report = metrics.as_dict()
+        self.assertEqual([p['name'] for p in report['phases']],
+                         ['walk', 'hash'])
+        walk, hash = report['phases']
+        self.assertEqual((walk['files'], walk['bytes']), (2, 42))
+        self.assertIsNone(hash['bytes'])
+        for phase in report['phases']:
+            self.assertGreaterEqual(phase['wall_time'], 0)
+            self.assertGreaterEqual(phase['cpu_time'], 0)
+            self.assertGreater(phase['peak_rss'], 0)
+        self.assertAlmostEqual(report['wall_time'],
+                               walk['wall_time'] + hash['wall_time'])
+
+    def test_failed_phase(self):
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.phase('build'):
+                raise ValueError
+        self.assertEqual([p.name for p in metrics.phases], ['build'])
+        self.assertIsNotNone(metrics.phases[0].wall_time)
+
+    @unittest.skipUnless(CAN_RESET_PEAK_RSS, 'peak RSS can not be reset')
+    def test_peak_rss_per_phase(self):
+        metrics = Metrics()
+        with metrics.phase('big'):
+            data = bytearray(64 * 1024 * 1024)
+            del data
+        with metrics.phase('small'):
+            pass
+        big, small = metrics.phases
+        self.assertGreater(big.peak_rss - small.peak_rss, 32 * 1024 * 1024)
+        self.assertGreaterEqual(metrics.as_dict()['peak_rss'], big.peak_rss)
+
+    def test_nested_peak_rss(self):
+        metrics = Metrics()
+        with metrics.phase('outer'):
+            with metrics.phase('inner'):
+                data = bytearray(64 * 1024 * 1024)
+                del data
+        inner, outer = metrics.phases
+        self.assertGreaterEqual(outer.peak_rss, inner.peak_rss)
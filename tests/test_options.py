@@ -38,6 +38,144 @@ class TestCommandOptions(EmptyProject):
             self.assertFalse(self.cmd.warn.called)
             self.assertEqual(self.cmd.format, format)
 
+    def test_format_unavailable(self):
+        self.cmd.format = 'tzst'
+        with mock.patch.object(self.cmd.compressor_for_format['tzst'],
+                               'module', None):
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_compression_level(self):
+        self.assertIsNone(self.cmd.compression_level)
+        self.cmd.finalize_options()
+        self.assertIsNone(self.cmd.compression_level)
+
+    def test_compression_level_set_str(self):
+        self.cmd.format = 'txz'
+        self.cmd.compression_level = '0'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.compression_level, 0)
+
+    def test_compression_level_bad(self):
+        for format, level in (('tbz', '0'), ('tgz', 'max'), ('tar', 1),
+                              ('tzst', 23)):
+            self.cmd.format = format
+            self.cmd.compression_level = level
+            with mock.patch.object(self.cmd.compressor_for_format['tzst'],
+                                   'module', mock.Mock()):
+                with self.assertRaises(DistutilsOptionError):
+                    self.cmd.finalize_options()
+
+    def test_compression_profile(self):
+        for format, profile, level in (('tgz', 'fast', 1), ('txz', 'max', 9),
+                                       ('tbz', 'balanced', 6),
+                                       ('txz', 'auto', None)):
+            self.cmd.format = format
+            self.cmd.compression_level = None
+            self.cmd.compression_profile = profile
+            self.cmd.finalize_options()
+            self.assertEqual(self.cmd.compression_level, level)
+
+    def test_compression_profile_bad(self):
+        for format, profile, level in (('tgz', 'turbo', None),
+                                       ('tar', 'fast', None),
+                                       ('txz', 'fast', 1)):
+            self.cmd.format = format
+            self.cmd.compression_profile = profile
+            self.cmd.compression_level = level
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_compression_profile_auto_reproducible(self):
+        self.cmd.format = 'txz'
+        self.cmd.compression_profile = 'auto'
+        self.cmd.reproducible = True
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
+
+    def test_compression_time_budget(self):
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.compression_time_budget, 60)
+        self.cmd.compression_time_budget = '0'
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
+
+    def test_xz_memory_limit(self):
+        self.cmd.format = 'txz'
+        self.cmd.jobs = 2
+        self.cmd.xz_memory_limit = '200'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.compression_level, 6)
+        self.cmd.compression_level = None
+        self.cmd.compression_profile = 'max'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.compression_level, 6)
+
+    def test_jobs(self):
+        self.assertIsNone(self.cmd.jobs)
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.jobs, 1)
+
+    def test_jobs_set_str(self):
+        self.cmd.jobs = '4'
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.jobs, 4)
+
+    def test_jobs_bad(self):
+        for jobs in ('many', 0, -1):
+            self.cmd.jobs = jobs
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_pipeline_buffer(self):
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.pipeline_buffer, 64)
+        for pipeline_buffer in ('lots', 0):
+            self.cmd.pipeline_buffer = pipeline_buffer
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_matrix(self):
+        self.assertIsNone(self.cmd.matrix)
+        self.cmd.finalize_options()
+        self.assertIsNone(self.cmd.matrix)
+
+    def test_matrix_set_str(self):
+        self.cmd.matrix = 'python3.8, python3.9'
+        self.cmd.finalize_options()
+        self.assertEqual([target.interpreter for target in self.cmd.matrix],
+                         ['python3.8', 'python3.9'])
+
+    def test_matrix_bad(self):
+        for matrix in (['python3.8:ololo'], [':'],
+                       ['python3.8', 'python3.8']):
+            self.cmd.matrix = matrix
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_metrics_hook(self):
+        self.cmd.metrics_hook = 'os.path:join'
+        self.cmd.finalize_options()
+        self.assertIs(self.cmd.metrics_hook, os.path.join)
+
+    def test_metrics_hook_bad(self):
+        for hook in ('ololo.trololo:func', 'os:ololo', 'os:sep'):
+            self.cmd.metrics_hook = hook
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
+    def test_reproducible(self):
+        self.cmd.reproducible = True
+        with mock.patch.dict('os.environ', {'SOURCE_DATE_EPOCH': '42'}):
+            self.cmd.finalize_options()
+        self.assertEqual(self.cmd.source_date_epoch, 42)
+
+    def test_reproducible_bad_epoch(self):
+        self.cmd.reproducible = True
+        with mock.patch.dict('os.environ', {'SOURCE_DATE_EPOCH': 'now'}):
+            with self.assertRaises(DistutilsOptionError):
+                self.cmd.finalize_options()
+
     def test_unknown_format(self):
         self.cmd.warn = mock.Mock()
         self.cmd.format = 'zip'
@@ -333,6 +471,16 @@ class TestSimpleProjectOptions(SimpleProject):
         with self.assertRaises(DistutilsOptionError):
             self.cmd.finalize_options()
 
+    def test_selected_options_set_str(self):
+        self.cmd.selected_options = 'foo,zoo'
+        self.cmd.requirements_mapping = None
+        self.cmd.use_pypi_deps = True
+        self.cmd.no_deps_cache = True
+        self.cmd.package_index = mock.Mock()
+        self.cmd.new_package_index = lambda: self.cmd.package_index
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.selected_options, {'foo', 'zoo'})
+
     def test_select_unknown_options(self):
         self.cmd.selected_options = {'ololo'}
         with self.assertRaises(DistutilsOptionError):
@@ -7,9 +7,12 @@
 # you should have received as part of this distribution.
 #
 
+import hashlib
+import io
 import json
 import os
 import shutil
+import tarfile
 import tempfile
 
 from .utils import SimpleProject, mock
@@ -43,7 +46,7 @@ class TestSimplePackage(SimpleProject):
     def test_make_tar_package(self):
         self.cmd.format = 'tar'
         manifest = self.cmd.generate_manifest_content()
-        self.cmd.compress_tar = mock.Mock()
+        self.cmd.get_compressor = mock.Mock()
         try:
             bdist_dir = tempfile.mkdtemp()
             dist_dir = tempfile.mkdtemp()
@@ -58,7 +61,309 @@ class TestSimplePackage(SimpleProject):
         finally:
             shutil.rmtree(bdist_dir)
             shutil.rmtree(dist_dir)
-        self.assertFalse(self.cmd.compress_tar.called)
+        self.assertFalse(self.cmd.get_compressor.called)
+
+    def test_make_compressed_package(self):
+        for format in ('tgz', 'tbz', 'txz'):
+            self.cmd.format = format
+            manifest = self.cmd.generate_manifest_content()
+            try:
+                bdist_dir = tempfile.mkdtemp()
+                dist_dir = tempfile.mkdtemp()
+
+                self.cmd.bdist_dir = bdist_dir
+                self.cmd.dist_dir = dist_dir
+                path = self.cmd.make_pkg(manifest)
+
+                self.assertEqual(os.listdir(dist_dir),
+                                 [os.path.basename(path)])
+                with tarfile.open(path) as tar:
+                    self.assertEqual(tar.getnames()[:2],
+                                     ['+MANIFEST', '+COMPACT_MANIFEST'])
+            finally:
+                shutil.rmtree(bdist_dir)
+                shutil.rmtree(dist_dir)
+
+    def test_make_package_from_payload(self):
+        self.cmd.format = 'tar'
+        try:
+            bdist_dir = tempfile.mkdtemp()
+            dist_dir = tempfile.mkdtemp()
+
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            with self.cmd.open_payload() as payload:
+                manifest = self.cmd.generate_manifest_content(payload)
+                self.cmd.make_pkg(manifest, payload)
+
+            txxname = '{}-{}.tar'.format(self.cmd.name, self.cmd.version)
+            with tarfile.open(os.path.join(dist_dir, txxname)) as tar:
+                members = tar.getmembers()
+                self.assertEqual([m.name for m in members[:2]],
+                                 ['+MANIFEST', '+COMPACT_MANIFEST'])
+                files = {m.name: hashlib.sha256(
+                    tar.extractfile(m).read()).hexdigest()
+                    for m in members[2:] if m.isreg()}
+        finally:
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+        self.assertEqual(files, {path: value['sum'] for path, value
+                                 in manifest['files'].items()})
+
+    def test_make_parallel_txz_package(self):
+        self.cmd.format = 'txz'
+        self.cmd.jobs = 4
+        manifest = self.cmd.generate_manifest_content()
+        try:
+            bdist_dir = tempfile.mkdtemp()
+            dist_dir = tempfile.mkdtemp()
+
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            path = self.cmd.make_pkg(manifest)
+
+            with tarfile.open(path, 'r:xz') as tar:
+                self.assertEqual(sorted(m.name for m in tar if m.isreg()),
+                                 sorted(['+MANIFEST', '+COMPACT_MANIFEST'] +
+                                        list(manifest['files'])))
+        finally:
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+
+    def test_make_reproducible_package(self):
+        self.cmd.reproducible = True
+        self.cmd.source_date_epoch = 1500000000
+        install_dir = tempfile.mkdtemp()
+        bdist_dir = tempfile.mkdtemp()
+        dist_dir = tempfile.mkdtemp()
+        try:
+            shutil.rmtree(install_dir)
+            shutil.copytree(self.cmd.install_dir, install_dir)
+            self.cmd.install_dir = install_dir
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            for format in ('tgz', 'tbz', 'txz'):
+                self.cmd.format = format
+                packages = []
+                for jobs in (1, 4):
+                    self.cmd.jobs = jobs
+                    for root, dirs, files in os.walk(install_dir):
+                        for name in dirs + files:
+                            path = os.path.join(root, name)
+                            os.utime(path, (jobs, jobs))
+                    with self.cmd.open_payload() as payload:
+                        manifest = self.cmd.generate_manifest_content(payload)
+                        path = self.cmd.make_pkg(manifest, payload)
+                    with open(path, 'rb') as f:
+                        packages.append(f.read())
+                self.assertEqual(packages[0], packages[1])
+            with tarfile.open(path) as tar:
+                for member in tar:
+                    self.assertEqual(member.mtime, 1500000000)
+                    self.assertEqual((member.uname, member.gname),
+                                     ('root', 'wheel'))
+        finally:
+            shutil.rmtree(install_dir)
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+
+    def test_make_pipelined_package(self):
+        self.cmd.reproducible = True
+        self.cmd.source_date_epoch = 1500000000
+        self.cmd.hardlink_duplicates = True
+        self.cmd.pipeline_buffer = 1
+        bdist_dir = tempfile.mkdtemp()
+        dist_dir = tempfile.mkdtemp()
+        try:
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            for format in ('tar', 'tgz', 'tbz', 'txz'):
+                self.cmd.format = format
+                packages, archives = [], []
+                for pipeline, jobs in ((False, 1), (True, 1), (True, 4)):
+                    self.cmd.pipeline = pipeline
+                    self.cmd.jobs = jobs
+                    with self.cmd.open_payload() as payload:
+                        manifest = self.cmd.generate_manifest_content(payload)
+                        path = self.cmd.make_pkg(manifest, payload)
+                    with open(path, 'rb') as f:
+                        packages.append(f.read())
+                    compressor = self.cmd.get_compressor(format)
+                    if compressor is not None:
+                        with compressor.open_reader(path) as f:
+                            archives.append(f.read())
+                self.assertEqual(packages[0], packages[1])
+                self.assertEqual(packages[1], packages[2])
+                if compressor is not None:
+                    with tarfile.open(fileobj=io.BytesIO(archives[0])) as tar:
+                        self.assertEqual(tar.getnames()[:2],
+                                         ['+MANIFEST', '+COMPACT_MANIFEST'])
+            stages = self.cmd.pipeline_stats['stages']
+            self.assertEqual([stage['name'] for stage in stages],
+                             ['read', 'hash', 'tar', 'compress'])
+            self.assertEqual(stages[2]['bytes'], self.cmd.payload_size)
+            self.assertTrue(self.cmd.pipeline_stats['threaded'])
+        finally:
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+
+    def test_make_package_with_hardlinks(self):
+        self.cmd.format = 'tar'
+        self.cmd.hardlink_duplicates = True
+        install_dir = tempfile.mkdtemp()
+        bdist_dir = tempfile.mkdtemp()
+        dist_dir = tempfile.mkdtemp()
+        try:
+            shutil.rmtree(install_dir)
+            shutil.copytree(self.cmd.install_dir, install_dir)
+            lib_dir = os.path.join(install_dir, 'usr', 'local', 'lib')
+            for name, content in (('a', b'same'), ('b', b'same'),
+                                  ('c', b'diff'), ('d', b''), ('e', b'')):
+                with open(os.path.join(lib_dir, name), 'wb') as fobj:
+                    fobj.write(content)
+            self.cmd.install_dir = install_dir
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            for jobs, use_payload in ((1, True), (4, True), (1, False)):
+                self.cmd.jobs = jobs
+                self.cmd.inventory = None
+                with self.cmd.open_payload() as payload:
+                    payload = payload if use_payload else None
+                    manifest = self.cmd.generate_manifest_content(payload)
+                    path = self.cmd.make_pkg(manifest, payload)
+                with tarfile.open(path) as tar:
+                    links = {m.name: m.linkname for m in tar if m.islnk()}
+                    files = {m.name: hashlib.sha256(
+                        tar.extractfile(m).read()).hexdigest()
+                        for m in tar if m.isreg() or m.islnk()}
+                self.assertEqual(links.pop('/usr/local/lib/b'),
+                                 '/usr/local/lib/a')
+                # Some __init__.py files of the layout are the same too.
+                for name, linkname in links.items():
+                    self.assertTrue(name.endswith('/__init__.py'), name)
+                    self.assertEqual(files[name], files[linkname])
+                del files['+MANIFEST'], files['+COMPACT_MANIFEST']
+                self.assertEqual(files, {path: value['sum'] for path, value
+                                         in manifest['files'].items()})
+        finally:
+            shutil.rmtree(install_dir)
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+
+    def test_hardlinks_keep_modes(self):
+        self.cmd.format = 'tar'
+        self.cmd.hardlink_duplicates = True
+        install_dir = tempfile.mkdtemp()
+        bdist_dir = tempfile.mkdtemp()
+        dist_dir = tempfile.mkdtemp()
+        try:
+            bin_dir = os.path.join(install_dir, 'usr', 'local', 'bin')
+            share_dir = os.path.join(install_dir, 'usr', 'local', 'share')
+            os.makedirs(bin_dir)
+            os.makedirs(share_dir)
+            for path, mode in ((os.path.join(bin_dir, 'tool'), 0o755),
+                               (os.path.join(share_dir, 'tool.sample'), 0o644),
+                               (os.path.join(share_dir, 'tool.copy'), 0o644)):
+                with open(path, 'wb') as fobj:
+                    fobj.write(b'#!/bin/sh\n')
+                os.chmod(path, mode)
+            self.cmd.install_dir = install_dir
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            with self.cmd.open_payload() as payload:
+                manifest = self.cmd.generate_manifest_content(payload)
+                path = self.cmd.make_pkg(manifest, payload)
+            with tarfile.open(path) as tar:
+                members = {m.name: m for m in tar}
+        finally:
+            shutil.rmtree(install_dir)
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+        tool = members['/usr/local/bin/tool']
+        self.assertTrue(tool.isreg())
+        self.assertEqual(tool.mode, 0o755)
+        self.assertTrue(members['/usr/local/share/tool.copy'].isreg())
+        sample = members['/usr/local/share/tool.sample']
+        self.assertTrue(sample.islnk())
+        self.assertEqual(sample.linkname, '/usr/local/share/tool.copy')
+
+    def test_symlink_sums(self):
+        self.cmd.format = 'tar'
+        install_dir = tempfile.mkdtemp()
+        bdist_dir = tempfile.mkdtemp()
+        dist_dir = tempfile.mkdtemp()
+        try:
+            lib_dir = os.path.join(install_dir, 'usr', 'local', 'lib')
+            os.makedirs(lib_dir)
+            with open(os.path.join(lib_dir, 'libfoo.so.1'), 'wb') as fobj:
+                fobj.write(b'foo')
+            os.symlink('libfoo.so.1', os.path.join(lib_dir, 'libfoo.so'))
+            os.symlink('missing', os.path.join(lib_dir, 'dangling'))
+            self.cmd.install_dir = install_dir
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            self.cmd.no_digest_cache = True
+            sums = []
+            for pipeline, jobs, use_payload in ((False, 1, False),
+                                                (False, 1, True),
+                                                (False, 4, True),
+                                                (True, 4, True)):
+                self.cmd.pipeline = pipeline
+                self.cmd.jobs = jobs
+                self.cmd.inventory = None
+                with self.cmd.open_payload() as payload:
+                    payload = payload if use_payload else None
+                    manifest = self.cmd.generate_manifest_content(payload)
+                    path = self.cmd.make_pkg(manifest, payload)
+                sums.append({path: value['sum'] for path, value
+                             in manifest['files'].items()})
+                with tarfile.open(path) as tar:
+                    self.assertEqual(
+                        tar.getmember('/usr/local/lib/libfoo.so').linkname,
+                        'libfoo.so.1')
+        finally:
+            shutil.rmtree(install_dir)
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+        self.assertEqual(sums[0]['/usr/local/lib/libfoo.so'],
+                         hashlib.sha256(b'libfoo.so.1').hexdigest())
+        self.assertEqual(sums[0]['/usr/local/lib/dangling'],
+                         hashlib.sha256(b'missing').hexdigest())
+        for other in sums[1:]:
+            self.assertEqual(other, sums[0])
+
+    def test_make_package_with_excluded_files(self):
+        self.cmd.exclude = '*/package/*, *.txt'
+        self.cmd.include = '*/subpackage/*'
+        self.cmd.ensure_path_filter()
+        manifest = self.cmd.generate_manifest_content()
+        self.assertTrue(manifest['files'])
+        for path in manifest['files']:
+            self.assertTrue('/package/' not in path or
+                            '/subpackage/' in path, path)
+        self.assertIn('*/package/*', self.cmd.path_filter.removed)
+        self.assertGreater(self.cmd.path_filter.removed['*/package/*'][0], 0)
+
+    def test_make_package_auto_compression_level(self):
+        self.cmd.format = 'tgz'
+        self.cmd.compression_profile = 'auto'
+        self.cmd.compression_time_budget = 3600
+        try:
+            bdist_dir = tempfile.mkdtemp()
+            dist_dir = tempfile.mkdtemp()
+
+            self.cmd.bdist_dir = bdist_dir
+            self.cmd.dist_dir = dist_dir
+            with self.cmd.open_payload() as payload:
+                manifest = self.cmd.generate_manifest_content(payload)
+                path = self.cmd.make_pkg(manifest, payload)
+            with tarfile.open(path) as tar:
+                self.assertEqual(tar.getnames()[:2],
+                                 ['+MANIFEST', '+COMPACT_MANIFEST'])
+        finally:
+            shutil.rmtree(bdist_dir)
+            shutil.rmtree(dist_dir)
+        self.assertEqual(self.cmd.compression_level, 9)
 
     def test_fail_for_unsupported_format(self):
         self.cmd.format = 'txx'
@@ -71,7 +376,7 @@ class TestSimplePackage(SimpleProject):
             self.cmd.dist_dir = dist_dir
             with self.assertRaises(RuntimeError):
                 self.cmd.make_pkg(manifest)
-            self.check_tar_exists(self.cmd.dist_dir)
+            self.assertEqual(os.listdir(dist_dir), [])
         finally:
             shutil.rmtree(bdist_dir)
             shutil.rmtree(dist_dir)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import hashlib
+import unittest
+
+from setuptools_pkg.pipeline import Pipeline, Stage
+
+
+def split(blocks):
+    for block in blocks:
+        for i in range(0, len(block), 7):
+            yield block[i:i + 7]
+
+
+def digest(chunks):
+    hasher = hashlib.sha256()
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+    yield hasher.hexdigest().encode('ascii')
+
+
+class TestPipeline(unittest.TestCase):
+
+    def run_pipeline(self, threaded, buffer_size=1024, sink=None):
+        output = []
+        sink = sink or output.extend
+        pipeline = Pipeline([
+            Stage('split', split),
+            Stage('digest', digest),
+            Stage('sink', lambda chunks: map(sink, chunks), lambda _: 0),
+        ], buffer_size, depth=4)
+        blocks = [bytes(bytearray(range(256))) * n for n in range(20)]
+        pipeline.run(blocks, threaded=threaded)
+        return pipeline, output
+
+    def test_same_output(self):
+        _, expected = self.run_pipeline(False)
+        for buffer_size in (1, 64, 1024 * 1024):
+            _, output = self.run_pipeline(True, buffer_size)
+            self.assertEqual(output, expected)
+
+    def test_buffer_size(self):
+        pipeline, _ = self.run_pipeline(True, 64)
+        # Every channel may take one item over the limit.
+        self.assertLessEqual(pipeline.peak_buffered, 64 + 2 * 64)
+        self.assertGreater(pipeline.peak_buffered, 0)
+        pipeline, _ = self.run_pipeline(False)
+        self.assertEqual(pipeline.peak_buffered, 0)
+
+    def test_stats(self):
+        for threaded in (False, True):
+            pipeline, _ = self.run_pipeline(threaded)
+            stats = pipeline.as_dict()
+            self.assertEqual(stats['threaded'], threaded)
+            self.assertEqual([stage['name'] for stage in stats['stages']],
+                             ['split', 'digest', 'sink'])
+            split_stats, digest_stats, _ = stats['stages']
+            self.assertEqual(split_stats['bytes'], 256 * sum(range(20)))
+            self.assertEqual(digest_stats['items'], split_stats['items'] + 1)
+            for stage in stats['stages']:
+                self.assertGreaterEqual(stage['utilization'], 0)
+                self.assertLessEqual(stage['utilization'], 1)
+
+    def test_failed_stage(self):
+        def sink(chunk):
+            raise ValueError(chunk)
+
+        for threaded in (False, True):
+            with self.assertRaises(ValueError):
+                self.run_pipeline(threaded, 64, sink)
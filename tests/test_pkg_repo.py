@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from distutils.errors import DistutilsOptionError
+
+from setuptools_pkg.pkg_repo import pkg_repo
+
+from .utils import SimpleProject, mock
+
+
+class TestPkgRepo(SimpleProject):
+
+    def setUp(self):
+        super(TestPkgRepo, self).setUp()
+        self.bdist_dir = tempfile.mkdtemp()
+        self.dist_dir = tempfile.mkdtemp()
+        self.cmd.finalize_options()
+        self.cmd.install_dir = os.path.join(os.path.dirname(__file__),
+                                            'simple_project_layout')
+        self.cmd.bdist_dir = self.bdist_dir
+        self.cmd.dist_dir = self.dist_dir
+        self.repo = pkg_repo(self.dist)
+        self.repo.dist_dir = self.dist_dir
+        self.repo.finalize_options()
+
+    def tearDown(self):
+        super(TestPkgRepo, self).tearDown()
+        shutil.rmtree(self.bdist_dir)
+        shutil.rmtree(self.dist_dir)
+
+    def make_pkg(self, version, format='tgz'):
+        self.cmd.version = version
+        self.cmd.format = format
+        return self.cmd.make_pkg(self.cmd.generate_manifest_content())
+
+    def read_catalog(self, name):
+        path = os.path.join(self.dist_dir, name + '.txz')
+        with tarfile.open(path) as tar:
+            return tar.getnames(), tar.extractfile(tar.getmembers()[0]).read()
+
+    def test_catalog(self):
+        path = self.make_pkg('1.0')
+        self.make_pkg('2.0', 'txz')
+        self.repo.run()
+
+        names, data = self.read_catalog('packagesite')
+        self.assertEqual(names, ['packagesite.yaml'])
+        manifests = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual([m['version'] for m in manifests], ['1.0', '2.0'])
+        self.assertEqual(manifests[0]['path'], 'simple-1.0.tgz')
+        self.assertEqual(manifests[0]['pkgsize'], os.path.getsize(path))
+        with open(path, 'rb') as f:
+            self.assertEqual(manifests[0]['sum'],
+                             hashlib.sha256(f.read()).hexdigest())
+        self.assertNotIn('files', manifests[0])
+
+        names, data = self.read_catalog('digests')
+        self.assertEqual(names, ['digests'])
+        self.assertEqual(len(data.splitlines()), 2)
+        self.assertTrue(data.startswith(b'devel/py'))
+
+        names, data = self.read_catalog('meta')
+        with open(os.path.join(self.dist_dir, 'meta.conf'), 'rb') as f:
+            self.assertEqual(data, f.read())
+        self.assertIn(b'packing_format = "txz";', data)
+
+    def test_incremental(self):
+        self.make_pkg('1.0')
+        self.make_pkg('2.0')
+        self.repo.run()
+        self.repo.read_package = mock.Mock(wraps=self.repo.read_package)
+        self.repo.run()
+        self.assertFalse(self.repo.read_package.called)
+
+        os.remove(self.make_pkg('2.0'))
+        self.make_pkg('3.0')
+        self.repo.run()
+        self.assertEqual(self.repo.read_package.call_count, 1)
+        _, data = self.read_catalog('packagesite')
+        self.assertEqual([json.loads(line)['version']
+                          for line in data.splitlines()], ['1.0', '3.0'])
+
+    def test_force(self):
+        self.make_pkg('1.0')
+        self.repo.run()
+        self.repo.force = True
+        self.repo.read_package = mock.Mock(wraps=self.repo.read_package)
+        self.repo.run()
+        self.assertEqual(self.repo.read_package.call_count, 1)
+
+    def test_not_a_package(self):
+        with open(os.path.join(self.dist_dir, 'simple-1.0.tgz'), 'wb') as f:
+            with tarfile.open(fileobj=f, mode='w:gz'):
+                pass
+        with self.assertRaises(DistutilsOptionError):
+            self.repo.run()
+
+    def test_bad_format(self):
+        self.repo.format = 'zip'
+        with self.assertRaises(DistutilsOptionError):
+            self.repo.finalize_options()
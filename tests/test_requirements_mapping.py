@@ -7,9 +7,15 @@
 # you should have received as part of this distribution.
 #
 
-from distutils.errors import DistutilsOptionError
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from distutils.errors import DistutilsError, DistutilsOptionError
 
-from .utils import SimpleProject
+from .utils import SimpleProject, mock
 
 
 class TestRequirementsMapping(SimpleProject):
@@ -99,3 +105,149 @@ class TestRequirementsMapping(SimpleProject):
         }
         with self.assertRaises(DistutilsOptionError):
             self.cmd.finalize_options()
+
+
+class TestPyPIDeps(SimpleProject):
+
+    def setUp(self):
+        super(TestPyPIDeps, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.cmd.requirements_mapping = None
+        self.cmd.use_pypi_deps = True
+        self.cmd.deps_cache = os.path.join(self.tmpdir, 'deps.json')
+        self.cmd.package_index = mock.Mock()
+        self.cmd.package_index.obtain.return_value = mock.Mock(
+            key='test', version='1.2.3')
+        self.cmd.new_package_index = lambda: self.cmd.package_index
+
+    def tearDown(self):
+        super(TestPyPIDeps, self).tearDown()
+        shutil.rmtree(self.tmpdir)
+
+    def test_resolve(self):
+        self.cmd.finalize_options()
+        pyver = ''.join(map(str, sys.version_info[:2]))
+        self.assertEqual(self.cmd.deps, {
+            'py{}-test'.format(pyver): {
+                'origin': 'pypi/py-test',
+                'version': '1.2.3',
+            },
+        })
+        self.assertEqual(self.cmd.package_index.obtain.call_count, 1)
+
+    def test_cached(self):
+        self.cmd.finalize_options()
+        deps = self.cmd.deps
+        cmd = self.new_bdist_pkg_cmd(self.dist)
+        cmd.requirements_mapping = None
+        cmd.use_pypi_deps = True
+        cmd.deps_cache = self.cmd.deps_cache
+        cmd.package_index = mock.Mock()
+        cmd.finalize_options()
+        self.assertEqual(cmd.deps, deps)
+        self.assertFalse(cmd.package_index.obtain.called)
+
+    def test_cached_per_index(self):
+        self.cmd.finalize_options()
+        cmd = self.new_bdist_pkg_cmd(self.dist)
+        cmd.requirements_mapping = None
+        cmd.use_pypi_deps = True
+        cmd.deps_cache = self.cmd.deps_cache
+        cmd.find_links = os.path.join(self.tmpdir, 'links')
+        cmd.package_index = self.cmd.package_index
+        cmd.finalize_options()
+        self.assertEqual(cmd.package_index.obtain.call_count, 2)
+
+    def test_no_deps_cache(self):
+        self.cmd.no_deps_cache = True
+        self.cmd.finalize_options()
+        self.assertFalse(os.path.exists(self.cmd.deps_cache))
+
+    def test_not_found(self):
+        self.cmd.package_index.obtain.return_value = None
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
+
+    def test_bad_ttl(self):
+        self.cmd.deps_cache_ttl = 'day'
+        with self.assertRaises(DistutilsOptionError):
+            self.cmd.finalize_options()
+
+    def test_local_index(self):
+        index_dir = os.path.join(self.tmpdir, 'simple')
+        os.makedirs(os.path.join(index_dir, 'test'))
+        with open(os.path.join(index_dir, 'test', 'index.html'), 'w') as f:
+            f.write('<a href="test-1.2.3.tar.gz">test-1.2.3.tar.gz</a>')
+        self.cmd.index_url = 'file://' + index_dir
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.resolved_deps['test==1.2.3'],
+                         {'key': 'test', 'version': '1.2.3'})
+
+    def test_find_links(self):
+        links_dir = os.path.join(self.tmpdir, 'links')
+        os.makedirs(links_dir)
+        open(os.path.join(links_dir, 'test-1.2.3.tar.gz'), 'w').close()
+        self.cmd.index_url = 'file://' + os.path.join(self.tmpdir, 'empty')
+        self.cmd.find_links = links_dir
+        self.cmd.finalize_options()
+        self.assertEqual(self.cmd.resolved_deps['test==1.2.3'],
+                         {'key': 'test', 'version': '1.2.3'})
+
+    def test_resolve_concurrently(self):
+        def obtain(requirement):
+            return mock.Mock(key=requirement.key,
+                             version=str(len(requirement.key)))
+        self.cmd.package_index.obtain.side_effect = obtain
+        self.cmd.selected_options = {'foo', 'bar', 'zoo'}
+        self.cmd.finalize_options()
+        pyver = ''.join(map(str, sys.version_info[:2]))
+        self.assertEqual(list(self.cmd.deps), [
+            'py{}-{}'.format(pyver, name)
+            for name in ('bar', 'foo', 'test', 'zoo')
+        ])
+        self.assertEqual(self.cmd.package_index.obtain.call_count, 4)
+
+    def test_index_per_worker(self):
+        running = []
+        overlaps = []
+        indexes = {}
+        lock = threading.Lock()
+
+        def obtain(requirement):
+            with lock:
+                running.append(requirement)
+                overlaps.append(len(running) > 1)
+            time.sleep(0.05)
+            with lock:
+                running.remove(requirement)
+            return mock.Mock(key=requirement.key, version='1.0')
+
+        def new_package_index():
+            package_index = mock.Mock()
+            package_index.obtain.side_effect = obtain
+            indexes[threading.current_thread()] = package_index
+            return package_index
+        self.cmd.new_package_index = new_package_index
+        self.cmd.selected_options = {'foo', 'bar', 'zoo'}
+        self.cmd.finalize_options()
+        self.assertTrue(any(overlaps))
+        self.assertGreater(len(indexes), 1)
+        self.assertEqual(sum(package_index.obtain.call_count
+                             for package_index in indexes.values()), 4)
+        self.assertFalse(self.cmd.package_index.obtain.called)
+
+    def test_errors_aggregated(self):
+        def obtain(requirement):
+            if requirement.key == 'test':
+                raise DistutilsError('connection refused')
+            if requirement.key == 'zoo':
+                return None
+            return mock.Mock(key=requirement.key, version='1.0')
+        self.cmd.package_index.obtain.side_effect = obtain
+        self.cmd.selected_options = {'foo', 'zoo'}
+        with self.assertRaises(DistutilsOptionError) as ctx:
+            self.cmd.finalize_options()
+        self.assertIn('test==1.2.3: connection refused', str(ctx.exception))
+        self.assertIn('zoo<=3.0: no matching', str(ctx.exception))
+        self.assertEqual(self.cmd.package_index.obtain.call_count, 3)
+        self.assertEqual(sorted(self.cmd.resolved_deps), ['foo==1.0'])
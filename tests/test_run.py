@@ -7,6 +7,12 @@
 # you should have received as part of this distribution.
 #
 
+import json
+import os
+import shutil
+import tempfile
+from distutils.errors import DistutilsExecError
+
 from pip._vendor import pkg_resources
 
 from .utils import SimpleProject, mock
@@ -20,14 +26,45 @@ class TestRunCommand(SimpleProject):
 
     def test_run(self):
         self.cmd.build_and_install = mock.Mock()
+        self.cmd.open_payload = mock.MagicMock()
         self.cmd.generate_manifest_content = mock.Mock()
-        self.cmd.make_pkg = mock.Mock()
+        self.cmd.make_pkg = mock.Mock(return_value=__file__)
 
         self.cmd.run()
 
+        payload = self.cmd.open_payload.return_value.__enter__.return_value
         self.assertTrue(self.cmd.build_and_install.called)
-        self.assertTrue(self.cmd.generate_manifest_content.called)
-        self.assertTrue(self.cmd.make_pkg.called)
+        self.cmd.generate_manifest_content.assert_called_once_with(payload)
+        self.cmd.make_pkg.assert_called_once_with(
+            self.cmd.generate_manifest_content.return_value, payload)
+
+    def test_report(self):
+        tmpdir = tempfile.mkdtemp()
+        self.cmd.build_and_install = mock.Mock()
+        self.cmd.bdist_base = self.cmd.bdist_dir = tmpdir
+        self.cmd.dist_dir = tmpdir
+        self.cmd.install_dir = os.path.join(os.path.dirname(__file__),
+                                            'simple_project_layout')
+        self.cmd.report = True
+        self.cmd.keep_temp = True
+        self.cmd.metrics_hook = mock.Mock()
+        try:
+            self.cmd.run()
+            path = os.path.join(tmpdir, 'simple-1.2.3.tgz.metrics.json')
+            with open(path) as fobj:
+                report = json.load(fobj)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.cmd.metrics_hook.assert_called_once_with(report)
+        self.assertEqual(report['package'],
+                         os.path.join(tmpdir, 'simple-1.2.3.tgz'))
+        phases = {phase['name']: phase for phase in report['phases']}
+        self.assertEqual(sorted(phases), ['archive', 'inventory', 'manifest'])
+        self.assertEqual(phases['manifest']['files'],
+                         phases['inventory']['files'])
+        self.assertGreater(phases['archive']['bytes'],
+                           phases['manifest']['bytes'])
+        self.assertGreater(phases['archive']['bytes_out'], 0)
 
     def test_build_and_install(self):
         self.cmd.run_command = mock.Mock()
@@ -35,6 +72,15 @@ class TestRunCommand(SimpleProject):
         self.cmd.run_command.assert_has_calls([mock.call('build'),
                                                mock.call('install')])
 
+    def test_build_and_install_matrix_target(self):
+        self.cmd.matrix_target = os.path.join(self.cmd.bdist_dir, 'state')
+        self.cmd.bdist_base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cmd.bdist_base)
+        self.cmd.run_command = mock.Mock()
+        self.cmd.build_and_install()
+        egg_info = self.dist.get_command_obj('egg_info')
+        self.assertEqual(egg_info.egg_base, self.cmd.bdist_base)
+
     @mock.patch('pip.wheel.move_wheel_files')
     def test_build_and_install_wheel(self, pip_move_wheel):
         self.cmd.use_wheel = True
@@ -52,6 +98,17 @@ class TestRunCommand(SimpleProject):
             wheeldir=None,
         )])
 
+    def test_build_and_stream_wheel(self):
+        self.cmd.stream_wheel = True
+        self.cmd.run_command = mock.Mock()
+        self.cmd.reinitialize_command = mock.Mock()
+        self.dist.dist_files = [('bdist_wheel', 'py3', '/tmp/foo.whl')]
+        self.cmd.build_and_install()
+        self.cmd.run_command.assert_has_calls([mock.call('bdist_wheel')])
+        self.assertEqual(self.cmd.wheel_path, '/tmp/foo.whl')
+        self.assertEqual(self.cmd.reinitialize_command.return_value.dist_dir,
+                         self.cmd.bdist_dir)
+
     @mock.patch('shutil.rmtree')
     def test_maybe_remove_temp(self, rmtree):
         self.cmd.maybe_remove_temp(None)
@@ -66,3 +123,150 @@ class TestRunCommand(SimpleProject):
         self.cmd.keep_temp = True
         self.cmd.maybe_remove_temp(__file__)
         self.assertFalse(rmtree.called)
+
+    def test_incremental(self):
+        self.cmd.incremental = True
+        self.cmd.bdist_dir = tempfile.mkdtemp()
+        self.cmd.install_dir = os.path.join(self.cmd.bdist_dir, 'root')
+        self.cmd.build_and_install = mock.Mock(
+            side_effect=lambda: os.mkdir(self.cmd.install_dir))
+        try:
+            self.cmd.maybe_build_and_install()
+            self.assertEqual(self.cmd.build_and_install.call_count, 1)
+            self.cmd.maybe_build_and_install()
+            self.assertEqual(self.cmd.build_and_install.call_count, 1)
+            self.cmd.prefix = '/opt'
+            self.cmd.maybe_build_and_install()
+            self.assertEqual(self.cmd.build_and_install.call_count, 2)
+        finally:
+            shutil.rmtree(self.cmd.bdist_dir)
+
+    def test_install_fingerprint(self):
+        fingerprint = self.cmd.get_install_fingerprint()
+        self.assertEqual(fingerprint, self.cmd.get_install_fingerprint())
+        self.cmd.selected_options = {'foo'}
+        self.assertEqual(fingerprint, self.cmd.get_install_fingerprint())
+        self.cmd.use_wheel = True
+        self.assertNotEqual(fingerprint, self.cmd.get_install_fingerprint())
+
+    def test_install_fingerprint_config(self):
+        fd, path = tempfile.mkstemp(suffix='.cfg')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.dist.find_config_files = mock.Mock(return_value=[path])
+        fingerprint = self.cmd.get_install_fingerprint()
+        with open(path, 'w') as fobj:
+            fobj.write('[build_ext]\ninplace = 1\n')
+        self.assertNotEqual(fingerprint, self.cmd.get_install_fingerprint())
+
+    def test_install_fingerprint_package_data(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmpdir)
+        os.mkdir('pkg')
+        open(os.path.join('pkg', '__init__.py'), 'w').close()
+        with open(os.path.join('pkg', 'data.txt'), 'w') as fobj:
+            fobj.write('foo')
+        with open('setup.py', 'w') as fobj:
+            fobj.write('')
+        self.dist.script_name = 'setup.py'
+        self.dist.packages = ['pkg']
+        self.dist.package_data = {'pkg': ['data.txt']}
+        self.assertIn(os.path.join('pkg', 'data.txt'),
+                      list(self.cmd.iter_source_files()))
+        fingerprint = self.cmd.get_install_fingerprint()
+        with open(os.path.join('pkg', 'data.txt'), 'w') as fobj:
+            fobj.write('foo bar')
+        self.assertNotEqual(fingerprint, self.cmd.get_install_fingerprint())
+
+    @mock.patch('setuptools_pkg.matrix.MatrixTarget.run', autospec=True)
+    def test_run_matrix(self, run):
+        run.side_effect = lambda target, *args: target
+        self.cmd.matrix = 'python3.8 python3.9:foo python3.9:foo+bar'
+        self.cmd.finalize_options()
+        self.cmd.maybe_remove_temp = mock.Mock()
+        for target in self.cmd.matrix:
+            target.returncode, target.elapsed = 0, 0
+        self.cmd.run()
+        self.assertEqual(run.call_count, 3)
+        dist_dirs = []
+        for (target, args, bdist_base, state), _ in run.call_args_list:
+            self.assertEqual(args[:2], [self.cmd.distribution.script_name
+                                        or 'setup.py', 'bdist_pkg'])
+            self.assertEqual(os.path.basename(bdist_base), target.id)
+            dist_dirs.append(args[args.index('--dist-dir') + 1])
+        dist_dir = os.path.abspath(self.cmd.dist_dir)
+        self.assertEqual(dist_dirs, [
+            os.path.join(dist_dir, 'python3.8'),
+            os.path.join(dist_dir, 'python3.9-foo'),
+            os.path.join(dist_dir, 'python3.9-bar-foo'),
+        ])
+
+    @mock.patch('setuptools_pkg.matrix.MatrixTarget.run', autospec=True)
+    def test_run_matrix_single_target(self, run):
+        run.side_effect = lambda target, *args: target
+        self.cmd.matrix = 'python3'
+        self.cmd.finalize_options()
+        self.cmd.maybe_remove_temp = mock.Mock()
+        self.cmd.matrix[0].returncode = self.cmd.matrix[0].elapsed = 0
+        self.cmd.run()
+        (_, args, _, _), _ = run.call_args
+        self.assertEqual(args[args.index('--dist-dir') + 1],
+                         os.path.abspath(self.cmd.dist_dir))
+
+    @mock.patch('setuptools_pkg.matrix.MatrixTarget.run', autospec=True)
+    def test_run_matrix_failed(self, run):
+        run.side_effect = lambda target, *args: target
+        self.cmd.matrix = 'python3.8 python3.9'
+        self.cmd.finalize_options()
+        for target, returncode in zip(self.cmd.matrix, [0, 1]):
+            target.returncode, target.elapsed = returncode, 0
+        with self.assertRaises(DistutilsExecError):
+            self.cmd.run()
+
+    @mock.patch('setuptools_pkg.matrix.MatrixTarget.run', autospec=True)
+    def test_matrix_target_ignores_matrix(self, run):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        state_path = os.path.join(tmpdir, 'state')
+        with open(state_path, 'w') as fobj:
+            json.dump({}, fobj)
+        cmd = self.new_bdist_pkg_cmd(self.dist)
+        self.dist._set_command_options(cmd, {
+            'matrix': ('setup.cfg', 'python3'),
+            'matrix_target': ('command line', state_path),
+        })
+        cmd.finalize_options()
+        self.assertIsNone(cmd.matrix)
+        cmd.build_and_install = mock.Mock()
+        cmd.open_payload = mock.MagicMock()
+        cmd.generate_manifest_content = mock.Mock()
+        cmd.make_pkg = mock.Mock(return_value=__file__)
+        cmd.run()
+        self.assertFalse(run.called)
+        self.assertTrue(cmd.build_and_install.called)
+
+    def test_matrix_target_state(self):
+        self.cmd.bdist_dir = tempfile.mkdtemp()
+        self.cmd.matrix_target = os.path.join(self.cmd.bdist_dir, 'state')
+        with open(self.cmd.matrix_target, 'w') as fobj:
+            json.dump({'resolved_deps': {
+                'foo': {'key': 'foo', 'version': '1.0'},
+            }}, fobj)
+        try:
+            self.cmd.load_matrix_target()
+            self.assertEqual(self.cmd.resolve_pypi_dep('foo'),
+                             {'key': 'foo', 'version': '1.0'})
+            self.cmd.save_matrix_target('foo-1.0.tgz')
+            with open(self.cmd.matrix_target) as fobj:
+                self.assertEqual(json.load(fobj)['package'],
+                                 os.path.abspath('foo-1.0.tgz'))
+        finally:
+            shutil.rmtree(self.cmd.bdist_dir)
+
+    @mock.patch('shutil.rmtree')
+    def test_incremental_keeps_temps(self, rmtree):
+        self.cmd.incremental = True
+        self.cmd.maybe_remove_temp(__file__)
+        self.assertFalse(rmtree.called)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from distutils.errors import DistutilsExecError
+from distutils.spawn import find_executable
+
+import _ctypes
+
+from setuptools_pkg.strip import is_elf, strip_file
+
+from .utils import SimpleProject, mock
+
+HAS_BINUTILS = bool(find_executable('strip') and find_executable('objcopy'))
+
+
+class TestStripFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, os.path.basename(
+            _ctypes.__file__))
+        shutil.copyfile(_ctypes.__file__, self.path)
+        os.chmod(self.path, 0o444)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_is_elf(self):
+        self.assertTrue(is_elf(self.path, os.stat(self.path)))
+        self.assertFalse(is_elf(__file__, os.stat(__file__)))
+        self.assertFalse(is_elf(self.tmpdir, os.stat(self.tmpdir)))
+
+    @unittest.skipUnless(HAS_BINUTILS, 'binutils are not installed')
+    def test_strip_file(self):
+        size, stripped_size = strip_file(self.path,
+                                         ['strip', '--strip-unneeded'])
+        self.assertLessEqual(stripped_size, size)
+        self.assertEqual(stripped_size, os.path.getsize(self.path))
+        self.assertTrue(is_elf(self.path, os.stat(self.path)))
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o444)
+
+    @unittest.skipUnless(HAS_BINUTILS, 'binutils are not installed')
+    def test_split_debug(self):
+        debug_path = os.path.join(self.tmpdir, 'debug', 'foo.so.debug')
+        strip_file(self.path, ['strip', '--strip-debug'], 'objcopy',
+                   debug_path)
+        self.assertTrue(is_elf(debug_path, os.stat(debug_path)))
+
+    def test_missing_tool(self):
+        with self.assertRaises(DistutilsExecError):
+            strip_file(self.path, ['/nonexistent/strip'])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o444)
+
+
+@unittest.skipUnless(HAS_BINUTILS, 'binutils are not installed')
+class TestStripCommand(SimpleProject):
+
+    def setUp(self):
+        super(TestStripCommand, self).setUp()
+        self.cmd.format = 'tar'
+        self.cmd.split_debug = True
+        self.cmd.finalize_options()
+        layout = os.path.join(os.path.dirname(__file__),
+                              'simple_project_layout')
+        self.tmpdir = tempfile.mkdtemp()
+        self.cmd.bdist_base = self.cmd.bdist_dir = self.tmpdir
+        self.cmd.dist_dir = os.path.join(self.tmpdir, 'dist')
+        self.cmd.debug_dir = os.path.join(self.tmpdir, 'debug-root')
+        self.cmd.install_dir = os.path.join(self.tmpdir, 'root')
+        self.cmd.keep_temp = True
+        shutil.copytree(layout, self.cmd.install_dir)
+        self.lib_path = '/usr/local/lib/_ctypes.so'
+        shutil.copyfile(_ctypes.__file__,
+                        self.cmd.install_dir + self.lib_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestStripCommand, self).tearDown()
+
+    def test_run_with_split_debug(self):
+        self.cmd.build_and_install = mock.Mock()
+        self.cmd.report = True
+        self.cmd.run()
+
+        package = os.path.join(self.cmd.dist_dir, 'simple-1.2.3.tar')
+        with open(package + '.metrics.json') as fobj:
+            report = json.load(fobj)
+        phases = {phase['name']: phase for phase in report['phases']}
+        self.assertEqual(phases['strip']['files'], 1)
+        self.assertLessEqual(phases['strip']['bytes_out'],
+                             phases['strip']['bytes'])
+        with tarfile.open(package) as tar:
+            self.assertIn(self.lib_path, tar.getnames())
+            self.assertFalse(any('/lib/debug/' in name
+                                 for name in tar.getnames()))
+
+        debug_package = os.path.join(self.cmd.dist_dir,
+                                     'simple-debug-1.2.3.tar')
+        with tarfile.open(debug_package) as tar:
+            names = tar.getnames()
+            manifest = json.load(tar.extractfile('+MANIFEST'))
+        debug_path = '/usr/local/lib/debug' + self.lib_path + '.debug'
+        self.assertIn(debug_path, names)
+        self.assertEqual(list(manifest['files']), [debug_path])
+        self.assertEqual(manifest['name'], 'simple-debug')
+        self.assertEqual(manifest['deps'], {'simple': {
+            'origin': self.cmd.origin, 'version': '1.2.3'}})
+        self.assertEqual(self.cmd.name, 'simple')
+
+        with open(os.path.join(self.tmpdir, 'pkg-digests.json')) as fobj:
+            digests = json.load(fobj)['entries']
+        self.assertIn(self.cmd.install_dir + self.lib_path, digests)
+        self.assertEqual(len(digests), len(self.cmd.get_inventory()))
+        with open(os.path.join(self.tmpdir,
+                               'pkg-debug-digests.json')) as fobj:
+            self.assertEqual(len(json.load(fobj)['entries']), 1)
+
+    def test_fingerprint(self):
+        fingerprint = self.cmd.get_install_fingerprint()
+        self.cmd.strip_command = ['strip', '--strip-all']
+        self.assertNotEqual(fingerprint, self.cmd.get_install_fingerprint())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import base64
+import hashlib
+import os
+import shutil
+import sysconfig
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from setuptools_pkg.inventory import PathFilter
+from setuptools_pkg.wheel import WheelInventory
+
+from .utils import SimpleProject
+
+
+def record_digest(data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return 'sha256=' + digest.rstrip(b'=').decode('ascii')
+
+
+def make_wheel(path, members, entry_points=None, name='foo', version='1.0',
+               metadata=None):
+    dist_info = '{}-{}.dist-info/'.format(name, version)
+    members = dict(members)
+    if entry_points is not None:
+        members[dist_info + 'entry_points.txt'] = entry_points
+    members[dist_info + 'METADATA'] = metadata or (
+        'Metadata-Version: 2.0\nName: {}\nVersion: {}\n'
+        ''.format(name, version).encode('utf-8'))
+    members[dist_info + 'WHEEL'] = (
+        b'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n')
+    record = ''.join('{},{},{}\n'.format(member, record_digest(data),
+                                         len(data))
+                     for member, data in sorted(members.items()))
+    members[dist_info + 'RECORD'] = (
+        record + dist_info + 'RECORD,,\n').encode('utf-8')
+    with zipfile.ZipFile(path, 'w') as zf:
+        for member, data in sorted(members.items()):
+            zf.writestr(member, data)
+
+
+class TestWheelInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'foo-1.0-py3-none-any.whl')
+        self.site_dir = sysconfig.get_paths('posix_prefix', vars={
+            'base': '/usr/local', 'platbase': '/usr/local',
+            'installed_base': '/usr/local',
+            'installed_platbase': '/usr/local'})['purelib']
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_install_paths(self):
+        make_wheel(self.path, {
+            'foo/__init__.py': b'',
+            'foo/bar.py': b'bar = 42\n',
+            'foo-1.0.data/scripts/foo-tool': b'#!python\nprint(42)\n',
+            'foo-1.0.data/data/share/foo/foo.txt': b'foo',
+            'foo-1.0.data/headers/foo.h': b'int foo;',
+        })
+        inventory = WheelInventory(self.path, '/usr/local', '/bin/python')
+        paths = [item.install_path for item in inventory]
+        self.assertEqual(paths, sorted(paths))
+        self.assertEqual(set(paths), {
+            '/usr/local/bin/foo-tool',
+            '/usr/local/share/foo/foo.txt',
+            sysconfig.get_paths('posix_prefix', vars={
+                'installed_base': '/usr/local',
+                'installed_platbase': '/usr/local',
+                'base': '/usr/local',
+                'platbase': '/usr/local'})['include'] + '/foo/foo.h',
+            self.site_dir + '/foo/__init__.py',
+            self.site_dir + '/foo/bar.py',
+            self.site_dir + '/foo-1.0.dist-info/METADATA',
+            self.site_dir + '/foo-1.0.dist-info/RECORD',
+            self.site_dir + '/foo-1.0.dist-info/WHEEL',
+        })
+        self.assertIn('/usr/local/bin', inventory.dirs)
+        self.assertIn(self.site_dir + '/foo', inventory.dirs)
+
+    def test_record_digests(self):
+        make_wheel(self.path, {'foo/bar.py': b'bar = 42\n'})
+        inventory = WheelInventory(self.path, '/usr/local')
+        for item in inventory:
+            with item.open() as fobj:
+                data = fobj.read()
+            self.assertEqual(item.known_digest,
+                             hashlib.sha256(data).hexdigest())
+            self.assertEqual(item.stat.st_size, len(data))
+        self.assertEqual(inventory.flatsize,
+                         sum(item.stat.st_size for item in inventory))
+
+    def test_scripts(self):
+        make_wheel(self.path, {
+            'foo-1.0.data/scripts/foo-tool': b'#!python\nprint(42)\n',
+        }, b'[console_scripts]\nfoo = foo.cli:main\n')
+        inventory = WheelInventory(self.path, '/usr/local', '/bin/python')
+        scripts = {item.install_path: item for item in inventory
+                   if item.install_path.startswith('/usr/local/bin/')}
+        self.assertEqual(set(scripts), {'/usr/local/bin/foo',
+                                        '/usr/local/bin/foo-tool'})
+        for item in scripts.values():
+            self.assertEqual(item.stat.st_mode & 0o755, 0o755)
+            with item.open() as fobj:
+                data = fobj.read()
+            self.assertTrue(data.startswith(b'#!/bin/python\n'), data)
+            self.assertEqual(item.known_digest,
+                             hashlib.sha256(data).hexdigest())
+        with scripts['/usr/local/bin/foo'].open() as fobj:
+            self.assertIn(b'from foo.cli import main', fobj.read())
+
+    def test_record(self):
+        make_wheel(self.path, {
+            'foo/bar.py': b'bar = 42\n',
+            'foo-1.0.data/scripts/foo-tool': b'#!python\nprint(42)\n',
+        })
+        inventory = WheelInventory(self.path, '/usr/local', '/bin/python')
+        items = {item.install_path: item for item in inventory}
+        with items[self.site_dir + '/foo-1.0.dist-info/RECORD'].open() as f:
+            record = f.read().decode('utf-8').splitlines()
+        tool = os.path.relpath('/usr/local/bin/foo-tool', self.site_dir)
+        with items['/usr/local/bin/foo-tool'].open() as fobj:
+            data = fobj.read()
+        self.assertIn('{},{},{}'.format(tool, record_digest(data), len(data)),
+                      record)
+        self.assertIn('foo/bar.py,{},9'.format(record_digest(b'bar = 42\n')),
+                      record)
+        self.assertEqual(record[-1], 'foo-1.0.dist-info/RECORD,,')
+
+    def test_path_filter(self):
+        make_wheel(self.path, {
+            'foo/__init__.py': b'',
+            'foo/tests/test_foo.py': b'assert True\n',
+        })
+        path_filter = PathFilter(exclude=['*/tests/*'])
+        inventory = WheelInventory(self.path, '/usr/local',
+                                   path_filter=path_filter)
+        items = {item.install_path: item for item in inventory}
+        self.assertNotIn(self.site_dir + '/foo/tests/test_foo.py', items)
+        self.assertEqual(path_filter.removed['*/tests/*'], [1, 12])
+        with items[self.site_dir + '/foo-1.0.dist-info/RECORD'].open() as f:
+            self.assertNotIn(b'tests', f.read())
+
+    def test_no_dist_info(self):
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr('foo.py', b'')
+        with self.assertRaises(ValueError):
+            WheelInventory(self.path, '/usr/local')
+
+
+class TestWheelPackage(SimpleProject):
+
+    def test_make_package_from_wheel(self):
+        self.cmd.format = 'tar'
+        self.cmd.finalize_options()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.cmd.wheel_path = os.path.join(tmpdir, 'foo.whl')
+            make_wheel(self.cmd.wheel_path, {
+                'foo/__init__.py': b'',
+                'foo/bar.py': b'bar = 42\n',
+            })
+            self.cmd.bdist_dir = os.path.join(tmpdir, 'bdist')
+            self.cmd.dist_dir = os.path.join(tmpdir, 'dist')
+            with self.cmd.open_payload() as payload:
+                manifest = self.cmd.generate_manifest_content(payload)
+                path = self.cmd.make_pkg(manifest, payload)
+            with tarfile.open(path) as tar:
+                files = {m.name: hashlib.sha256(
+                    tar.extractfile(m).read()).hexdigest()
+                    for m in tar if m.isreg()}
+        finally:
+            shutil.rmtree(tmpdir)
+        del files['+MANIFEST'], files['+COMPACT_MANIFEST']
+        self.assertEqual(files, {path: value['sum'] for path, value
+                                 in manifest['files'].items()})
+        self.assertEqual(len(files), 5)
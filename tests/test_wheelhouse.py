@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016-2017 Alexander Shorin
+# All rights reserved.
+#
+# This software is licensed as described in the file LICENSE, which
+# you should have received as part of this distribution.
+#
+
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+from distutils.errors import DistutilsExecError
+
+from setuptools import Distribution
+
+from setuptools_pkg.wheel import read_metadata
+from setuptools_pkg.wheelhouse import pkg_wheelhouse
+
+from .test_wheel import make_wheel
+
+
+def make_project_wheel(wheel_dir, name, version, requires=()):
+    path = os.path.join(wheel_dir,
+                        '{}-{}-py3-none-any.whl'.format(name, version))
+    metadata = [
+        'Metadata-Version: 2.1',
+        'Name: {}'.format(name),
+        'Version: {}'.format(version),
+        'Summary: {} project'.format(name),
+        'Author: Author',
+        'Author-email: author@example.com',
+        'License: MIT',
+        'Keywords: foo,bar',
+        'Provides-Extra: extra',
+    ] + ['Requires-Dist: {}'.format(item) for item in requires]
+    metadata = '\n'.join(metadata) + '\n\n{} long description\n'.format(name)
+    make_wheel(path, {'{}/__init__.py'.format(name): b''}, name=name,
+               version=version, metadata=metadata.encode('utf-8'))
+    return path
+
+
+class TestWheelhouse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wheel_dir = os.path.join(self.tmpdir, 'wheels')
+        os.mkdir(self.wheel_dir)
+        self.dist_dir = os.path.join(self.tmpdir, 'dist')
+        self.cmd = pkg_wheelhouse(Distribution())
+        self.cmd.wheel_dir = self.wheel_dir
+        self.cmd.dist_dir = self.dist_dir
+        self.cmd.bdist_base = os.path.join(self.tmpdir, 'build')
+        self.cmd.format = 'tar'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_manifest(self, name):
+        with tarfile.open(os.path.join(self.dist_dir, name)) as tar:
+            return json.loads(tar.extractfile('+COMPACT_MANIFEST').read()
+                              .decode('utf-8'))
+
+    def test_read_metadata(self):
+        path = make_project_wheel(self.wheel_dir, 'foo', '1.0', [
+            'bar>=1.0',
+            'baz; extra == "extra"',
+            'qux; python_version < "3"',
+        ])
+        attrs = read_metadata(path)
+        self.assertEqual(attrs['name'], 'foo')
+        self.assertEqual(attrs['version'], '1.0')
+        self.assertEqual(attrs['license'], 'MIT')
+        self.assertEqual(attrs['install_requires'], ['bar>=1.0'])
+        self.assertEqual(attrs['extras_require'], {'extra': ['baz']})
+        self.assertEqual(attrs['long_description'].strip(),
+                         'foo long description')
+        self.assertTrue(attrs['root_is_purelib'])
+
+    def test_convert(self):
+        make_project_wheel(self.wheel_dir, 'foo', '1.0', ['bar>=1.0'])
+        make_project_wheel(self.wheel_dir, 'bar', '1.2')
+        for jobs in (1, 2):
+            self.cmd.jobs = jobs
+            self.cmd.ensure_finalized()
+            self.cmd.run()
+            self.assertEqual(sorted(os.listdir(self.dist_dir)),
+                             ['bar-1.2.tar', 'foo-1.0.tar'])
+            manifest = self.read_manifest('foo-1.0.tar')
+            self.assertEqual(manifest['deps'], {'bar': {
+                'origin': 'devel/py{}{}-bar'.format(*sys.version_info[:2]),
+                'version': '1.2',
+            }})
+            self.assertEqual(manifest['comment'], 'foo project')
+            self.assertEqual(manifest['licenses'], ['MIT'])
+            self.assertEqual(manifest['options'], {'extra': False})
+
+    def test_failures_are_isolated(self):
+        make_project_wheel(self.wheel_dir, 'foo', '1.0', ['missing'])
+        make_project_wheel(self.wheel_dir, 'bar', '1.2')
+        with open(os.path.join(self.wheel_dir, 'broken-1.0-py3-none-any.whl'),
+                  'wb') as fobj:
+            fobj.write(b'not a zip')
+        self.cmd.jobs = 2
+        self.cmd.ensure_finalized()
+        with self.assertRaises(DistutilsExecError) as ctx:
+            self.cmd.run()
+        self.assertIn('broken-1.0-py3-none-any.whl', str(ctx.exception))
+        self.assertIn('foo-1.0-py3-none-any.whl', str(ctx.exception))
+        self.assertEqual(os.listdir(self.dist_dir), ['bar-1.2.tar'])